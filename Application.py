@@ -1,4 +1,5 @@
 import os
+import platform
 import sys
 from typing import Union
 
@@ -22,6 +23,8 @@ class Application(object):
         self._script_dir = script_dir
         self._misc_dir = os.path.join(self._script_dir, 'misc')
         self._tool_dir = os.path.join(self._misc_dir, 'vip_download_tool')
+        self._cache_dir = Application._default_cache_dir()
+        self._data_dir = Application._default_data_dir()
 
     def application_dir(self) -> str:
         return self._application_dir
@@ -37,3 +40,29 @@ class Application(object):
 
     def tool_dir(self) -> str:
         return self._tool_dir
+
+    def set_tool_dir(self, tool_dir: str):
+        # i.e. stub tools of benchmark
+        self._tool_dir = tool_dir
+
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    def data_dir(self) -> str:
+        return self._data_dir
+
+    @staticmethod
+    def _default_cache_dir() -> str:
+        if platform.system() == 'Windows':
+            base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base_dir, 't29008')
+
+    @staticmethod
+    def _default_data_dir() -> str:
+        if platform.system() == 'Windows':
+            base_dir = os.environ.get('APPDATA', os.path.expanduser('~'))
+        else:
+            base_dir = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+        return os.path.join(base_dir, 't29008')
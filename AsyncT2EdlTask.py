@@ -0,0 +1,259 @@
+import asyncio
+import codecs
+import concurrent.futures
+import os
+import platform
+import re
+import subprocess
+import threading
+from typing import AsyncIterator, Callable, Sequence, Tuple, Union
+
+from AsyncTaskEngine import AsyncTaskEngine
+from FailureClassifier import FailureClassifier
+from T2EdlTask import T2EdlTask
+from Task import Task
+
+
+class AsyncT2EdlTask(T2EdlTask):
+    SAHARA_TIMEOUT = 60  # seconds for the whole sahara session
+    FH_LOADER_IDLE_TIMEOUT = 600  # seconds without any output from fh_loader
+    READ_SIZE = 4096
+    SAHARA_WORKERS = 64  # threads for builtin sahara, blocking on tty reads
+
+    # shared by all tasks of the loop, created on first builtin sahara
+    _sahara_executor: Union[concurrent.futures.ThreadPoolExecutor, None] = None
+
+    PATTERN_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+    def __init__(self, engine: AsyncTaskEngine, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._engine = engine
+        self._task: Union[asyncio.Task, None] = None  # created on the loop
+        self._done: Union[threading.Event, None] = None  # set once processes are killed and state is final
+
+    def start(self):
+        self._done = threading.Event()
+        self._engine.call_soon(self._create_task)
+
+    def wait_for_finished(self):
+        if self._done is None:
+            return
+        self._done.wait()
+
+    def cancel(self):
+        # kills running processes, the task ends with error
+        self._cancel_event.set()
+        self._engine.call_soon(self._cancel_task)
+
+    def _create_task(self):
+        self._task = asyncio.get_running_loop().create_task(self._run_async())
+        self._task.add_done_callback(self._on_task_done)
+
+    def _cancel_task(self):
+        # the asyncio task itself, cancelling a future of run_coroutine_threadsafe does not wait for the coroutine
+        if self._task is not None:
+            self._task.cancel()
+
+    def _on_task_done(self, task: asyncio.Task):
+        # cancelled before its first step, the coroutine never ran
+        if not self.check_state(Task.STATE_SUCCESS | Task.STATE_ERROR):
+            self.close_sahara_client()
+            self.set_state(Task.STATE_ERROR, message='cancelled')
+        self._done.set()
+
+    async def _run_async(self):
+        try:
+            await self.on_start_async()
+        except asyncio.CancelledError:
+            self.close_sahara_client()
+            self.set_state(Task.STATE_ERROR, message='cancelled')
+            raise
+        except Exception as e:
+            # always end with a final state, someone may be waiting for it
+            self.set_state(Task.STATE_ERROR, message=f'{type(e).__name__}: {e}')
+
+    async def on_start_async(self) -> bool:
+        self.set_state(Task.STATE_RUNNING)
+
+        if self._identify is not None:
+            result, msg = await self.identify_device_async()
+            if not result:
+                self.set_state(Task.STATE_ERROR, message=msg)
+                return False
+
+        while True:
+            result, msg = await self.download_attempt_async()
+            if result:
+                break
+
+            delay = self.retry_delay()
+            if delay is None:
+                self.set_state(Task.STATE_ERROR, message=msg)
+                return False
+            self.notify_retry(delay, msg)
+            await asyncio.sleep(delay)  # cancelled with the task
+
+        self._finish_current_program()
+        self._meter.update(self._meter.total_bytes())
+        self.set_state(Task.STATE_SUCCESS, message=msg)
+
+        return True
+
+    async def identify_device_async(self) -> Tuple[bool, str]:
+        if self._sahara == T2EdlTask.SAHARA_BUILTIN:
+            return await AsyncT2EdlTask._run_sahara_executor(self.identify_device)
+
+        trace_filename = self.prepare_identify_trace()
+        cmd = self.sahara_identify_cmd()
+        self.set_phase(T2EdlTask.PHASE_IDENTIFY)
+
+        sahara = await AsyncT2EdlTask._create_process_async(cmd)
+        try:
+            with self.open_trace(trace_filename, cmd) as file:
+                def on_line(line: str):
+                    file.write(f'{line}\n')
+                    self.parse_identity_line(line)
+
+                await asyncio.wait_for(AsyncT2EdlTask._read_all(sahara, on_line), AsyncT2EdlTask.SAHARA_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._classifier.set_failure_class(FailureClassifier.CLASS_SAHARA_TIMEOUT)
+            return False, f'sahara timeout at {self._phase}, {trace_filename}'
+        finally:
+            await AsyncT2EdlTask._kill(sahara)
+        if sahara.returncode != 0:
+            return False, trace_filename
+
+        return self.apply_identity(trace_filename)
+
+    async def download_attempt_async(self) -> Tuple[bool, str]:
+        self._classifier.reset()
+        sahara_trace_filename, fh_loader_trace_filename, console_trace_filename = self.prepare_trace()
+
+        if self._needs_sahara:
+            result, msg = await self.download_sahara_async(sahara_trace_filename)
+            if not result:
+                return False, msg
+            self._needs_sahara = False
+
+        self.rewind_programs()
+        self.start_meter()
+        result, msg = await self.download_fh_loader_async(fh_loader_trace_filename, console_trace_filename)
+        self._meter.stop()
+        if not result:
+            self._classifier.feed_fh_loader_trace(os.path.join(self._trace_dir, fh_loader_trace_filename))
+            self._sendxml_index = self.resume_index()
+        return result, msg
+
+    async def download_sahara_async(self, trace_filename: str) -> Tuple[bool, str]:
+        if self._sahara == T2EdlTask.SAHARA_BUILTIN:
+            return await AsyncT2EdlTask._run_sahara_executor(self.download_sahara, trace_filename)
+
+        cmd = self.sahara_cmd()
+        self.set_phase(T2EdlTask.PHASE_SAHARA)
+
+        # run sahara, save logs while reading
+        sahara = await AsyncT2EdlTask._create_process_async(cmd)
+        try:
+            with self.open_trace(trace_filename, cmd) as file:
+                def on_line(line: str):
+                    file.write(f'{line}\n')
+                    self.parse_sahara_line(line)
+
+                await asyncio.wait_for(AsyncT2EdlTask._read_all(sahara, on_line), AsyncT2EdlTask.SAHARA_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._classifier.set_failure_class(FailureClassifier.CLASS_SAHARA_TIMEOUT)
+            return False, f'sahara timeout at {self._phase}, {trace_filename}'
+        finally:
+            await AsyncT2EdlTask._kill(sahara)
+
+        # result
+        return sahara.returncode == 0, trace_filename
+
+    @staticmethod
+    async def _run_sahara_executor(func: Callable[..., Tuple[bool, str]], *args) -> Tuple[bool, str]:
+        # no process to await, the blocking client runs in a worker thread
+        if AsyncT2EdlTask._sahara_executor is None:
+            AsyncT2EdlTask._sahara_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=AsyncT2EdlTask.SAHARA_WORKERS, thread_name_prefix='t29008-sahara')
+        return await asyncio.get_running_loop().run_in_executor(AsyncT2EdlTask._sahara_executor, func, *args)
+
+    async def download_fh_loader_async(self, trace_filename: str, console_trace_filename: str) -> Tuple[bool, str]:
+        trace_file = os.path.join(self._trace_dir, trace_filename)
+
+        # cmd
+        cmd = self.fh_loader_cmd(trace_file)
+        self.set_phase(T2EdlTask.PHASE_FIREHOSE)
+
+        # run fh_loader, progress
+        fh_loader = await AsyncT2EdlTask._create_process_async(cmd)
+        try:
+            with self.open_trace(console_trace_filename, cmd) as file:
+                lines = AsyncT2EdlTask._read_lines(fh_loader.stdout)
+                while True:
+                    try:
+                        line = await asyncio.wait_for(lines.__anext__(), AsyncT2EdlTask.FH_LOADER_IDLE_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        # device stopped responding, usb is the usual cause
+                        self._classifier.set_failure_class(FailureClassifier.CLASS_TRANSIENT_USB)
+                        return False, f'fh_loader timeout at {self._phase}, {trace_filename}'
+                    file.write(f'{line}\n')
+                    self.parse_hf_loader_line(line)
+            await fh_loader.wait()
+        finally:
+            await AsyncT2EdlTask._kill(fh_loader)
+
+        # result
+        return fh_loader.returncode == 0, trace_filename
+
+    @staticmethod
+    async def _create_process_async(cmd: Sequence[str]) -> asyncio.subprocess.Process:
+        if platform.system() == 'Windows':
+            return await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
+            )
+        else:
+            return await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass  # already exited
+            await process.wait()
+
+    @staticmethod
+    async def _read_all(process: asyncio.subprocess.Process, callback: Callable[[str], None]):
+        async for line in AsyncT2EdlTask._read_lines(process.stdout):
+            callback(line)
+        await process.wait()
+
+    @staticmethod
+    async def _read_lines(stream: asyncio.StreamReader) -> AsyncIterator[str]:
+        # split on \r as well, tools redraw progress with it
+        decoder = codecs.getincrementaldecoder(T2EdlTask.encoding())(errors='replace')
+        buffer = ''
+        while True:
+            data = await stream.read(AsyncT2EdlTask.READ_SIZE)
+            if not data:
+                break
+            parts = AsyncT2EdlTask.PATTERN_LINE_BREAK.split(buffer + decoder.decode(data))
+            buffer = parts.pop()
+            for part in parts:
+                yield part
+        buffer += decoder.decode(b'', final=True)
+        if buffer:
+            yield buffer
@@ -0,0 +1,74 @@
+import asyncio
+import concurrent.futures
+import platform
+import sys
+import threading
+import traceback
+from typing import Any, Callable, Coroutine, Union
+
+
+class AsyncTaskEngine(object):
+    def __init__(self, name: str = 't29008-engine'):
+        self._name = name
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._thread: Union[threading.Thread, None] = None
+
+    def loop(self) -> Union[asyncio.AbstractEventLoop, None]:
+        return self._loop
+
+    def start(self):
+        if self._thread is not None:
+            return  # already started
+
+        # subprocesses on Windows require the proactor loop
+        if platform.system() == 'Windows':
+            self._loop = asyncio.ProactorEventLoop()
+        else:
+            self._loop = asyncio.new_event_loop()
+        self._loop.set_exception_handler(AsyncTaskEngine._on_exception)
+
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), name=self._name, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._thread is None:
+            return  # already stopped
+
+        # pending coroutines are cancelled, callers should wait for their tasks before stop
+        thread = self._thread
+        self._thread = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call_soon(self, callback: Callable[[], None]):
+        self._loop.call_soon_threadsafe(callback)
+
+    def _run(self, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(started.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            # cancel what is left and let it clean up (i.e. kill processes)
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+    @staticmethod
+    def _on_exception(loop: asyncio.AbstractEventLoop, context: dict):
+        # never let one bad callback kill the engine
+        exception = context.get('exception')
+        if exception is not None:
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
+        else:
+            print(context.get('message'), file=sys.stderr)  # stdout may carry json events
@@ -0,0 +1,102 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Union
+
+
+class ControlServer(object):
+    COMMAND_STATUS = 'status'
+    COMMAND_PAUSE = 'pause'
+    COMMAND_RESUME = 'resume'
+    COMMAND_IMAGE = 'image'
+    COMMAND_PARALLEL = 'parallel'
+    COMMAND_STOP = 'stop'
+    COMMANDS = (COMMAND_STATUS, COMMAND_PAUSE, COMMAND_RESUME, COMMAND_IMAGE, COMMAND_PARALLEL, COMMAND_STOP)
+
+    TIMEOUT = 10  # seconds for a client to wait for response
+
+    # one JSON request per line, answered by one JSON response per line
+    def __init__(self, path: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        self._path = path
+        self._handler = handler
+        self._server: Union[socketserver.BaseServer, None] = None
+        self._thread: Union[threading.Thread, None] = None
+
+    def path(self) -> str:
+        return self._path
+
+    def start(self):
+        if self._server is not None:
+            return  # already started
+        if not ControlServer.is_supported():
+            raise OSError('unix socket is not supported on this platform')
+
+        # a socket left by a crashed daemon blocks binding, a live one must not be taken over
+        if os.path.exists(self._path):
+            if ControlServer.is_alive(self._path):
+                raise OSError(f'another daemon is listening on {self._path}')
+            os.remove(self._path)
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+
+        handler = self._handler
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode('utf8'))
+                        if not isinstance(request, dict):
+                            raise ValueError('request should be a JSON object')
+                        response = handler(request)
+                    except ValueError as e:
+                        response = {'ok': False, 'message': f'bad request: {e}'}
+                    self.wfile.write((json.dumps(response) + '\n').encode('utf8'))
+                    self.wfile.flush()
+
+        self._server = socketserver.ThreadingUnixStreamServer(self._path, Handler)
+        self._server.daemon_threads = True
+        os.chmod(self._path, 0o600)  # same user only
+        self._thread = threading.Thread(target=self._server.serve_forever, name='t29008-control', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None:
+            return  # not started
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass  # already removed
+
+    @staticmethod
+    def is_supported() -> bool:
+        return hasattr(socket, 'AF_UNIX') and hasattr(socketserver, 'ThreadingUnixStreamServer')
+
+    @staticmethod
+    def is_alive(path: str) -> bool:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(path)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def request(path: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        # client side, raises OSError if the daemon is not reachable
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(ControlServer.TIMEOUT)
+            client.connect(path)
+            client.sendall((json.dumps(request) + '\n').encode('utf8'))
+            with client.makefile('rb') as file:
+                line = file.readline()
+        if not line:
+            raise OSError('connection closed by daemon')
+        return json.loads(line.decode('utf8'))
@@ -0,0 +1,429 @@
+import collections
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Union
+
+
+class StationStats(object):
+    def __init__(self, station: str):
+        self._station = station
+        self._started = 0
+        self._local = 0  # started without lease, coordinator unreachable or lease expired
+        self._success = 0
+        self._error = 0
+        self._bytes = 0
+        self._download_time = 0.0
+        self._first_time: Union[float, None] = None
+        self._last_seen = 0.0
+
+    def on_start(self, local: bool, timestamp: float):
+        self._started += 1
+        if local:
+            self._local += 1
+        if self._first_time is None or timestamp < self._first_time:
+            self._first_time = timestamp
+
+    def on_cancel(self):
+        self._started -= 1
+
+    def on_finish(self, success: bool, transfer_bytes: int, duration: float):
+        if success:
+            self._success += 1
+            self._bytes += transfer_bytes
+            self._download_time += duration
+        else:
+            self._error += 1
+
+    def touch(self):
+        self._last_seen = time.time()
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        finished = self._success + self._error
+        elapsed = now - self._first_time if self._first_time is not None else 0.0
+        return {
+            'station': self._station,
+            'started': self._started,
+            'local': self._local,
+            'success': self._success,
+            'error': self._error,
+            'yield': self._success / finished if finished > 0 else 0.0,
+            'devices_per_hour': self._success * 3600 / elapsed if elapsed > 0 else 0.0,
+            'speed': self._bytes / self._download_time if self._download_time > 0 else 0.0,
+            'last_seen': self._last_seen,
+        }
+
+
+class Coordinator(object):
+    # lot wide download quota and stats shared by stations on the local network
+    DEFAULT_PORT = 29008
+    LEASE_TTL = 120  # seconds before unused slots of a silent station return to the lot
+    OFFLINE_TIME = 30  # seconds without request before a station is shown offline
+
+    def __init__(self, quota: int = 0, lease_ttl: float = LEASE_TTL):
+        self._quota = quota  # 0: no limit, only stats
+        self._lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._started = 0
+        self._leases: Dict[str, int] = dict()  # unused slots by station
+        self._lease_expires: Dict[str, float] = dict()
+        self._stations: Dict[str, StationStats] = dict()
+        self._server: Union[ThreadingHTTPServer, None] = None
+        self._thread: Union[threading.Thread, None] = None
+
+    def quota(self) -> int:
+        return self._quota
+
+    def _station(self, station: str) -> StationStats:
+        stats = self._stations.get(station)
+        if stats is None:
+            stats = self._stations[station] = StationStats(station)
+        stats.touch()
+        return stats
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        for station, expires in list(self._lease_expires.items()):
+            if expires < now:
+                del self._leases[station]
+                del self._lease_expires[station]
+
+    def _available(self) -> Union[int, None]:
+        if self._quota <= 0:
+            return None  # no limit
+        return max(self._quota - self._started - sum(self._leases.values()), 0)
+
+    def _exhausted(self) -> bool:
+        return 0 < self._quota <= self._started
+
+    def lease(self, station: str, count: int) -> Dict[str, Any]:
+        with self._lock:
+            self._station(station)
+            self._expire_leases()
+            available = self._available()
+            granted = count if available is None else min(count, available)
+            self._leases[station] = self._leases.get(station, 0) + granted
+            self._lease_expires[station] = time.monotonic() + self._lease_ttl
+            return {'ok': True, 'granted': granted, 'slots': self._leases[station], 'exhausted': self._exhausted(),
+                    'ttl': self._lease_ttl}
+
+    def release(self, station: str) -> Dict[str, Any]:
+        # unused slots go back to the lot when a station stops
+        with self._lock:
+            self._station(station)
+            released = self._leases.pop(station, 0)
+            self._lease_expires.pop(station, None)
+            return {'ok': True, 'released': released}
+
+    def report(self, station: str, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            stats = self._station(station)
+            self._expire_leases()
+            for event in events:
+                kind = event.get('type')
+                if kind == 'start':
+                    # a start on an expired lease is counted as local, its slot may be leased to others already
+                    local = not event.get('leased', True) or self._leases.get(station, 0) <= 0
+                    if not local:
+                        self._leases[station] -= 1
+                    self._started += 1
+                    stats.on_start(local, float(event.get('time') or time.time()))
+                elif kind == 'cancel':
+                    self._started -= 1
+                    stats.on_cancel()
+                elif kind == 'finish':
+                    stats.on_finish(event.get('result') == 'success', int(event.get('bytes') or 0),
+                                    float(event.get('duration') or 0.0))
+            if station in self._lease_expires:
+                self._lease_expires[station] = time.monotonic() + self._lease_ttl
+            return {'ok': True, 'accepted': len(events), 'slots': self._leases.get(station, 0),
+                    'exhausted': self._exhausted()}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire_leases()
+            now = time.time()
+            stations = [stats.to_dict(now) for _, stats in sorted(self._stations.items())]
+            for item in stations:
+                item['online'] = now - item['last_seen'] < Coordinator.OFFLINE_TIME
+                item['leased'] = self._leases.get(item['station'], 0)
+            success = sum(item['success'] for item in stations)
+            error = sum(item['error'] for item in stations)
+            return {
+                'quota': self._quota,
+                'started': self._started,
+                'leased': sum(self._leases.values()),
+                'available': self._available(),
+                'success': success,
+                'error': error,
+                'yield': success / (success + error) if success + error > 0 else 0.0,
+                'devices_per_hour': sum(item['devices_per_hour'] for item in stations),
+                'stations': stations,
+            }
+
+    def handle(self, path: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        station = request.get('station')
+        if not isinstance(station, str) or not station:
+            return {'ok': False, 'message': 'station not provided'}
+        if path == '/lease':
+            count = request.get('count')
+            if not isinstance(count, int) or count < 0:
+                return {'ok': False, 'message': 'count should be a non negative integer'}
+            return self.lease(station, count)
+        elif path == '/release':
+            return self.release(station)
+        elif path == '/events':
+            events = request.get('events')
+            if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+                return {'ok': False, 'message': 'events should be a list of objects'}
+            return self.report(station, events)
+        return {'ok': False, 'message': f'unknown path: {path}'}
+
+    def start_server(self, port: int, host: str = ''):
+        if self._server is not None:
+            return  # already started
+
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/stats'):
+                    self.send_error(404)
+                    return
+                self.send_json(coordinator.stats())
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    request = json.loads(self.rfile.read(length).decode('utf8'))
+                    if not isinstance(request, dict):
+                        raise ValueError('request should be a JSON object')
+                except ValueError as e:
+                    self.send_json({'ok': False, 'message': f'bad request: {e}'}, 400)
+                    return
+                response = coordinator.handle(self.path.split('?')[0], request)
+                self.send_json(response, 200 if response.get('ok') else 400)
+
+            def send_json(self, response: Dict[str, Any], code: int = 200):
+                body = json.dumps(response).encode('utf8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep console clean
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='t29008-coordinator', daemon=True)
+        self._thread.start()
+
+    def stop_server(self):
+        if self._server is None:
+            return  # not started
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def request(url: str, path: str, request: Union[Dict[str, Any], None] = None,
+                timeout: float = 3) -> Dict[str, Any]:
+        # client side, GET without request, raises OSError if the coordinator is not reachable
+        data = json.dumps(request).encode('utf8') if request is not None else None
+        http_request = urllib.request.Request(url.rstrip('/') + path, data=data,
+                                              headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(http_request, timeout=timeout) as response:
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            body = e.read()  # rejected request, message in body
+        try:
+            return json.loads(body.decode('utf8'))
+        except ValueError as e:
+            raise OSError(f'bad response: {e}')
+
+
+class CoordinatorClient(object):
+    SLOT_LEASED = 'leased'
+    SLOT_LOCAL = 'local'  # coordinator unreachable, started on local lease
+    SLOT_NONE = 'none'  # lot quota reached, or remaining slots leased by other stations
+
+    BATCH = 4  # slots leased at once, refilled when half used
+    TIMEOUT = 3  # seconds of one request
+    SYNC_INTERVAL = 1  # seconds between flushing events and retrying an unreachable coordinator
+    HEARTBEAT_INTERVAL = 10  # seconds between lease renewals, well before lease ttl and offline time
+    MAX_EVENTS = 100000  # events kept while coordinator is unreachable
+
+    # leases slots and streams download events in background, never blocks downloading for long
+    def __init__(self, url: str, station: str, batch: int = BATCH, fallback: int = 0):
+        self._url = url
+        self._station = station
+        self._batch = max(batch, 1)
+        self._fallback = fallback  # slots started while unreachable, 0: no limit
+        self._lock = threading.Lock()
+        self._slots = 0
+        self._waiting = False  # a slot was asked while none left
+        self._heartbeat = CoordinatorClient.HEARTBEAT_INTERVAL
+        self._lease_time: Union[float, None] = None  # of last lease response
+        self._local_count = 0
+        self._online: Union[bool, None] = None  # unknown before first request
+        self._exhausted = False
+        self._events: Deque[Dict[str, Any]] = collections.deque(maxlen=CoordinatorClient.MAX_EVENTS)
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Union[threading.Thread, None] = None
+        self._state_listener: Union[Callable[[bool, str], None], None] = None
+        self._slot_listener: Union[Callable[[], None], None] = None
+
+    def url(self) -> str:
+        return self._url
+
+    def online(self) -> bool:
+        return bool(self._online)
+
+    def exhausted(self) -> bool:
+        return self._exhausted
+
+    def set_state_listener(self, listener: Callable[[bool, str], None]):
+        self._state_listener = listener
+
+    def set_slot_listener(self, listener: Callable[[], None]):
+        # called by client thread once take_slot may succeed again, or the lot quota is reached
+        self._slot_listener = listener
+
+    def start(self):
+        if self._thread is not None:
+            return  # already started
+
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name='t29008-coordinator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return  # already stopped
+
+        # pending events are flushed and unused slots released, once
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def take_slot(self) -> str:
+        # never waits, slot listener is called once a slot is leased after SLOT_NONE
+        with self._lock:
+            if self._slots > 0:
+                self._slots -= 1
+                slot = CoordinatorClient.SLOT_LEASED
+            elif self._exhausted:
+                slot = CoordinatorClient.SLOT_NONE
+            elif self._online is False and (self._fallback <= 0 or self._local_count < self._fallback):
+                self._local_count += 1
+                slot = CoordinatorClient.SLOT_LOCAL
+            else:
+                slot = CoordinatorClient.SLOT_NONE
+                self._waiting = True
+            if self._slots <= self._batch // 2:
+                self._wake.set()  # refill in background
+        if slot != CoordinatorClient.SLOT_NONE:
+            self._add_event({'type': 'start', 'leased': slot == CoordinatorClient.SLOT_LEASED})
+        return slot
+
+    def cancel_slot(self):
+        # device removed before started, the slot is counted back
+        self._add_event({'type': 'cancel'})
+
+    def report_finish(self, record: Dict[str, Any]):
+        self._add_event(dict(record, type='finish'))
+
+    def _add_event(self, event: Dict[str, Any]):
+        event.setdefault('time', time.time())
+        with self._lock:
+            self._events.append(event)
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopped:
+            self._wake.wait(CoordinatorClient.SYNC_INTERVAL)
+            self._wake.clear()
+            self._sync()
+        self._sync()
+        if self._online:
+            self._post('/release', dict())
+
+    def _sync(self):
+        # events first, so slots started on local lease are counted before leasing more
+        with self._lock:
+            events = list(self._events)
+        if events:
+            response = self._post('/events', {'events': events})
+            if response is None:
+                return
+            with self._lock:
+                for _ in range(min(len(events), len(self._events))):
+                    self._events.popleft()
+                if response.get('ok'):
+                    self._set_slots(response)
+            self._notify_slots()
+
+        # renewed even if no slot needed, the lease expires and the station shows offline otherwise
+        with self._lock:
+            count = self._batch - self._slots if self._slots <= self._batch // 2 and not self._stopped else 0
+            heartbeat = not self._stopped and (self._lease_time is None or
+                                               time.monotonic() - self._lease_time >= self._heartbeat)
+        if count <= 0 and not heartbeat:
+            return
+        response = self._post('/lease', {'count': max(count, 0)})
+        if response is None:
+            return
+        with self._lock:
+            if response.get('ok'):
+                self._lease_time = time.monotonic()
+                ttl = float(response.get('ttl') or 0)
+                if ttl > 0:
+                    self._heartbeat = min(CoordinatorClient.HEARTBEAT_INTERVAL, ttl / 4)
+                self._set_slots(response)
+        self._notify_slots()
+
+    def _set_slots(self, response: Dict[str, Any]):
+        # called with lock held, slots of starts not reported yet are already taken
+        unreported = sum(1 for event in self._events if event.get('type') == 'start' and event.get('leased'))
+        self._slots = max(int(response.get('slots') or 0) - unreported, 0)
+        self._exhausted = bool(response.get('exhausted'))
+
+    def _notify_slots(self):
+        with self._lock:
+            notify = self._waiting and (self._slots > 0 or self._exhausted or self._online is False)
+            if notify:
+                self._waiting = False
+        if notify and self._slot_listener is not None:
+            self._slot_listener()
+
+    def _post(self, path: str, request: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+        try:
+            response = Coordinator.request(self._url, path, dict(request, station=self._station),
+                                           CoordinatorClient.TIMEOUT)
+        except OSError as e:
+            self._set_online(False, str(e))
+            return None
+        self._set_online(True, 'connected')
+        return response
+
+    def _set_online(self, online: bool, message: str):
+        with self._lock:
+            changed = self._online != online
+            self._online = online
+            if online:
+                self._local_count = 0  # a new outage starts a new local lease
+        if changed and self._state_listener is not None:
+            self._state_listener(online, message)
+        if changed and not online:
+            self._notify_slots()  # local lease for waiting devices
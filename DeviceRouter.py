@@ -0,0 +1,125 @@
+import fnmatch
+import json
+import os
+from typing import Any, Dict, List, Union
+
+from ImageProfile import ProfileConfig
+
+
+class RouteRule(object):
+    def __init__(self,
+                 profile: str,
+                 usb_path: Union[str, None] = None,
+                 serial: Union[str, None] = None,
+                 hw_id: Union[str, None] = None):
+        self._profile = profile
+        self._usb_path = usb_path  # glob patterns, i.e. "1-2.*"
+        self._serial = serial
+        self._hw_id = hw_id
+
+    def profile(self) -> str:
+        return self._profile
+
+    def needs_identity(self) -> bool:
+        return self._serial is not None or self._hw_id is not None
+
+    def matches_port(self, usb_path: Union[str, None]) -> bool:
+        if self._usb_path is None:
+            return True
+        return usb_path is not None and fnmatch.fnmatchcase(usb_path, self._usb_path)
+
+    def matches(self, usb_path: Union[str, None], serial: Union[str, None], hw_id: Union[str, None]) -> bool:
+        return self.matches_port(usb_path) \
+            and RouteRule._matches_id(serial, self._serial) \
+            and RouteRule._matches_id(hw_id, self._hw_id)
+
+    @staticmethod
+    def _matches_id(value: Union[str, None], pattern: Union[str, None]) -> bool:
+        if pattern is None:
+            return True
+        return value is not None and fnmatch.fnmatchcase(value.lower(), pattern.lower())
+
+
+class DeviceRouter(object):
+    # first matched rule wins, devices matching none use the default profile
+    def __init__(self, profiles: Dict[str, ProfileConfig], rules: List[RouteRule]):
+        self._profiles = profiles
+        self._rules = rules
+
+    def profiles(self) -> Dict[str, ProfileConfig]:
+        return self._profiles
+
+    def rules(self) -> List[RouteRule]:
+        return self._rules
+
+    def route_by_port(self, usb_path: Union[str, None]) -> Union[str, None]:
+        # profile name, None if serial or hw id is needed to decide
+        for rule in self._rules:
+            if not rule.matches_port(usb_path):
+                continue
+            if rule.needs_identity():
+                return None
+            return rule.profile()
+        return ProfileConfig.DEFAULT_NAME
+
+    def route(self, usb_path: Union[str, None], serial: Union[str, None], hw_id: Union[str, None]) -> str:
+        for rule in self._rules:
+            if rule.matches(usb_path, serial, hw_id):
+                return rule.profile()
+        return ProfileConfig.DEFAULT_NAME
+
+    @staticmethod
+    def load(path: str) -> 'DeviceRouter':
+        # raises OSError or ValueError, image dirs are relative to the file
+        with open(path, 'r', encoding='utf8') as file:
+            data = json.load(file)
+        if not isinstance(data, dict):
+            raise ValueError('should be a JSON object')
+        base_dir = os.path.dirname(os.path.abspath(path))
+
+        profiles: Dict[str, ProfileConfig] = dict()
+        for name, item in DeviceRouter._object(data.get('profiles', {}), 'profiles').items():
+            if name == ProfileConfig.DEFAULT_NAME:
+                raise ValueError(f'profile name "{name}" is reserved for -image-dir')
+            item = DeviceRouter._object(item, f'profile {name}')
+            image_dir = item.get('image_dir')
+            if not isinstance(image_dir, str) or not image_dir:
+                raise ValueError(f'image_dir of profile {name} not provided')
+            vip = item.get('vip')
+            if vip not in (None, True, False):
+                raise ValueError(f'vip of profile {name} should be true, false or null')
+            profiles[name] = ProfileConfig(name,
+                                           os.path.join(base_dir, image_dir),
+                                           DeviceRouter._string(item, 'prog', name),
+                                           vip,
+                                           DeviceRouter._string(item, 'signed_digests', name),
+                                           DeviceRouter._string(item, 'chained_digests', name))
+
+        rules: List[RouteRule] = []
+        routes = data.get('routes', [])
+        if not isinstance(routes, list):
+            raise ValueError('routes should be a list')
+        for index, item in enumerate(routes):
+            item = DeviceRouter._object(item, f'route {index}')
+            profile = item.get('profile')
+            if profile != ProfileConfig.DEFAULT_NAME and profile not in profiles:
+                raise ValueError(f'unknown profile of route {index}: {profile}')
+            patterns = {key: DeviceRouter._string(item, key, f'route {index}') for key in ('usb_path', 'serial', 'hw_id')}
+            if all(pattern is None for pattern in patterns.values()):
+                raise ValueError(f'route {index} should match usb_path, serial or hw_id')
+            rules.append(RouteRule(profile, **patterns))
+
+        return DeviceRouter(profiles, rules)
+
+    @staticmethod
+    def _object(value: Any, name: str) -> Dict[str, Any]:
+        if not isinstance(value, dict):
+            raise ValueError(f'{name} should be a JSON object')
+        return value
+
+    @staticmethod
+    def _string(item: Dict[str, Any], key: str, name: str) -> Union[str, None]:
+        value = item.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{key} of {name} should be a string')
+        return value
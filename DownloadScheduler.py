@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple, Union
+
+from Task import Task
+
+
+class SchedulerStats(object):
+    def __init__(self):
+        self._start_time = time.monotonic()
+        self._started_count = 0
+        self._success_count = 0
+        self._error_count = 0
+        self._max_queued_count = 0
+        self._max_running_count = 0
+        self._total_download_time = 0.0
+        self._total_bytes = 0
+
+    def on_queued(self, queued_count: int):
+        self._max_queued_count = max(self._max_queued_count, queued_count)
+
+    def on_started(self, running_count: int):
+        self._started_count += 1
+        self._max_running_count = max(self._max_running_count, running_count)
+
+    def on_finished(self, success: bool, duration: float, transferred_bytes: int):
+        if success:
+            self._success_count += 1
+        else:
+            self._error_count += 1
+        self._total_download_time += duration
+        self._total_bytes += transferred_bytes
+
+    def finished_count(self) -> int:
+        return self._success_count + self._error_count
+
+    def devices_per_hour(self) -> float:
+        elapsed = time.monotonic() - self._start_time
+        return self.finished_count() * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def average_download_time(self) -> float:
+        count = self.finished_count()
+        return self._total_download_time / count if count > 0 else 0.0
+
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def bytes_per_second(self) -> float:
+        elapsed = time.monotonic() - self._start_time
+        return self._total_bytes / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f'finished {self.finished_count()} ({self._success_count} success, {self._error_count} error), '
+                f'{self.devices_per_hour():.1f} devices/hour, '
+                f'{self.bytes_per_second() / 1024 / 1024:.1f} MB/s total, '
+                f'average {self.average_download_time():.1f}s/device, '
+                f'max parallel {self._max_running_count}, max queued {self._max_queued_count}')
+
+
+class DownloadScheduler(object):
+    def __init__(self, max_parallel: int = 0, max_parallel_per_hub: int = 0):
+        self._max_parallel = max_parallel  # 0: no limit
+        self._max_parallel_per_hub = max_parallel_per_hub  # 0: no limit
+        self._paused = False
+        self._lock = threading.Condition()
+        self._pending: Deque[Tuple[str, Task, Union[str, None]]] = deque()
+        self._running: Dict[str, float] = dict()  # key -> start time
+        self._running_hubs: Dict[str, Union[str, None]] = dict()  # key -> hub
+        self._stats = SchedulerStats()
+        self._on_start: Union[Callable[[str, Task], None], None] = None
+
+    def set_start_listener(self, listener: Callable[[str, Task], None]):
+        self._on_start = listener
+
+    def stats(self) -> SchedulerStats:
+        return self._stats
+
+    def queued_count(self) -> int:
+        return len(self._pending)
+
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def paused(self) -> bool:
+        return self._paused
+
+    def pause(self):
+        # submitted tasks are queued, running ones are not affected
+        with self._lock:
+            self._paused = True
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            started = self._start_pending()
+        self.notify_starts(started)
+
+    def set_max_parallel(self, max_parallel: int, max_parallel_per_hub: int):
+        with self._lock:
+            self._max_parallel = max_parallel
+            self._max_parallel_per_hub = max_parallel_per_hub
+            started = self._start_pending()
+        self.notify_starts(started)
+
+    def running_count_on_hub(self, hub: Union[str, None]) -> int:
+        return sum(1 for running_hub in self._running_hubs.values() if running_hub == hub)
+
+    def submit(self, key: str, task: Task, hub: Union[str, None] = None) -> bool:
+        # return True if started immediately, False if queued
+        with self._lock:
+            if self._can_start(hub):
+                self._mark_started(key, hub)
+                started = True
+            else:
+                self._pending.append((key, task, hub))
+                self._stats.on_queued(len(self._pending))
+                started = False
+
+        if started:
+            self.notify_start(key, task)
+        return started
+
+    def cancel(self, key: str) -> bool:
+        # return True if the key was still queued
+        with self._lock:
+            for item in self._pending:
+                if item[0] == key:
+                    self._pending.remove(item)
+                    self._lock.notify_all()
+                    return True
+        return False
+
+    def on_finished(self, key: str, success: bool, transferred_bytes: int = 0):
+        with self._lock:
+            if key not in self._running:
+                return  # not started by scheduler
+            self._stats.on_finished(success, time.monotonic() - self._running.pop(key), transferred_bytes)
+            del self._running_hubs[key]
+            started = self._start_pending()
+            self._lock.notify_all()
+
+        self.notify_starts(started)
+
+    def wait_for_idle(self):
+        with self._lock:
+            while self._pending or self._running:
+                self._lock.wait()
+
+    def notify_start(self, key: str, task: Task):
+        if self._on_start:
+            self._on_start(key, task)
+
+    def notify_starts(self, started: List[Tuple[str, Task]]):
+        for key, task in started:
+            self.notify_start(key, task)
+
+    def _start_pending(self) -> List[Tuple[str, Task]]:
+        # start queued tasks with released slots, skip those whose hub is still busy
+        started: List[Tuple[str, Task]] = []
+        for item in list(self._pending):
+            if not self._can_start():
+                break
+            next_key, next_task, next_hub = item
+            if self._can_start(next_hub):
+                self._pending.remove(item)
+                self._mark_started(next_key, next_hub)
+                started.append((next_key, next_task))
+        return started
+
+    def _can_start(self, hub: Union[str, None] = None) -> bool:
+        if self._paused:
+            return False
+        if 0 < self._max_parallel <= len(self._running):
+            return False
+        if hub is not None and 0 < self._max_parallel_per_hub <= self.running_count_on_hub(hub):
+            return False
+        return True
+
+    def _mark_started(self, key: str, hub: Union[str, None] = None):
+        self._running[key] = time.monotonic()
+        self._running_hubs[key] = hub
+        self._stats.on_started(len(self._running))
@@ -0,0 +1,108 @@
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Union
+
+
+class EventBus(object):
+    DEFAULT_RATE = 10.0  # coalesced events dispatched per second
+
+    def __init__(self, name: str, rate: float = DEFAULT_RATE):
+        self._name = name
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._cond = threading.Condition()
+        self._events: List[Callable[[], None]] = []
+        self._latest: Dict[str, Dict[str, Callable[[], None]]] = dict()  # key -> slot -> latest event
+        self._next_flush_time = 0.0
+        self._thread: Union[threading.Thread, None] = None
+        self._stopping = False
+        self._running = False  # consumer thread is dispatching
+
+    def start(self):
+        if self._thread is not None:
+            return  # already started
+
+        self._stopping = False
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return  # already stopped
+
+        # everything posted before stop is still dispatched
+        thread = self._thread
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def post(self, event: Callable[[], None]):
+        # state transitions, never dropped and dispatched in order
+        with self._cond:
+            if not self._running:
+                dispatch_now = True
+            else:
+                dispatch_now = False
+                self._events.append(event)
+                self._cond.notify_all()
+        if dispatch_now:
+            # not started, nobody else is dispatching
+            EventBus._dispatch(event)
+
+    def post_latest(self, key: str, slot: str, event: Callable[[], None]):
+        # progress of key, only the latest one of each slot is dispatched
+        with self._cond:
+            if not self._running:
+                dispatch_now = True
+            else:
+                dispatch_now = False
+                self._latest.setdefault(key, dict())[slot] = event
+                self._cond.notify_all()
+        if dispatch_now:
+            EventBus._dispatch(event)
+
+    def post_final(self, key: str, event: Callable[[], None]):
+        # last event of key, pending progress of key is useless
+        with self._cond:
+            self._latest.pop(key, None)
+        self.post(event)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    flush = bool(self._latest) and (now >= self._next_flush_time or self._stopping)
+                    if self._events or flush:
+                        break
+                    if self._stopping:
+                        self._running = False
+                        return  # everything dispatched
+                    self._cond.wait(self._next_flush_time - now if self._latest else None)
+
+                events = self._events
+                self._events = []
+                latest: List[Callable[[], None]] = []
+                if flush:
+                    for slots in self._latest.values():
+                        latest.extend(slots.values())
+                    self._latest.clear()
+                    self._next_flush_time = now + self._interval
+
+            # transitions first, coalesced progress always follows the transitions posted before it
+            for event in events:
+                EventBus._dispatch(event)
+            for event in latest:
+                EventBus._dispatch(event)
+
+    @staticmethod
+    def _dispatch(event: Callable[[], None]):
+        try:
+            event()
+        except Exception:
+            # never let one bad event kill the bus
+            traceback.print_exc()
@@ -0,0 +1,44 @@
+import queue
+import threading
+import traceback
+from typing import Callable, Union
+
+
+class EventDispatcher(object):
+    def __init__(self, name: str):
+        self._name = name
+        self._queue: 'queue.Queue[Union[Callable[[], None], None]]' = queue.Queue()
+        self._thread: Union[threading.Thread, None] = None
+
+    def start(self):
+        if self._thread is not None:
+            return  # already started
+
+        self._thread = threading.Thread(target=self._loop, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return  # already stopped
+
+        # events posted before stop are still dispatched
+        thread = self._thread
+        self._thread = None
+        self._queue.put(None)
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def post(self, event: Callable[[], None]):
+        self._queue.put(event)
+
+    def _loop(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break  # stopped
+
+            try:
+                event()
+            except Exception:
+                # never let one bad event kill the dispatcher
+                traceback.print_exc()
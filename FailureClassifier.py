@@ -0,0 +1,80 @@
+import os
+import re
+from typing import Union
+
+
+class FailureClassifier(object):
+    CLASS_TRANSIENT_USB = 'transient usb'
+    CLASS_SAHARA_TIMEOUT = 'sahara timeout'
+    CLASS_FATAL = 'fatal'
+    CLASS_VIP = 'vip'
+    CLASSES = (CLASS_TRANSIENT_USB, CLASS_SAHARA_TIMEOUT, CLASS_FATAL, CLASS_VIP)
+
+    # worth another attempt on the same device
+    RETRYABLE_CLASSES = (CLASS_TRANSIENT_USB, CLASS_SAHARA_TIMEOUT)
+
+    # later ones win when one attempt shows several kinds of errors
+    SEVERITY = (CLASS_TRANSIENT_USB, CLASS_SAHARA_TIMEOUT, CLASS_FATAL, CLASS_VIP)
+
+    TAIL_SIZE = 64 * 1024  # bytes read from the end of fh_loader port trace
+
+    PATTERN_ERROR_LINE = re.compile(r'.*(?:error|fail|\bnak\b|timeout|timed\s+out|could\s+not|cannot|unable)', re.IGNORECASE)
+    PATTERN_VIP_LINE = re.compile(r'.*(?:digest|hash|signature|authenticat|secure\s*boot|\bvip\b)', re.IGNORECASE)
+    PATTERN_FATAL_LINE = re.compile(r'.*(?:\bnak\b|not\s+supported|out\s+of\s+range|write\s+protect|invalid\s+(?:xml|lun|sector|partition)'
+                                    r'|storage\s+(?:error|init)|file\s+not\s+found|could\s+not\s+find\s+file)', re.IGNORECASE)
+    PATTERN_TIMEOUT_LINE = re.compile(r'.*(?:timeout|timed\s+out)', re.IGNORECASE)
+    PATTERN_USB_LINE = re.compile(r'.*(?:readfile|writefile|read\s+failed|write\s+failed|no\s+such\s+(?:device|file)|not\s+connected'
+                                  r'|disconnect|broken\s+pipe|i/o\s+error|open\s+port|port\s+.*open|\busb\b)', re.IGNORECASE)
+
+    def __init__(self):
+        self._failure_class: Union[str, None] = None
+
+    def failure_class(self) -> Union[str, None]:
+        return self._failure_class
+
+    def reset(self):
+        self._failure_class = None
+
+    def set_failure_class(self, failure_class: str):
+        if self._failure_class is None \
+                or FailureClassifier.SEVERITY.index(failure_class) > FailureClassifier.SEVERITY.index(self._failure_class):
+            self._failure_class = failure_class
+
+    def feed_sahara_line(self, line: str):
+        failure_class = FailureClassifier.classify_line(line)
+        if failure_class == FailureClassifier.CLASS_TRANSIENT_USB and FailureClassifier.PATTERN_TIMEOUT_LINE.match(line):
+            failure_class = FailureClassifier.CLASS_SAHARA_TIMEOUT
+        if failure_class is not None:
+            self.set_failure_class(failure_class)
+
+    def feed_fh_loader_line(self, line: str):
+        failure_class = FailureClassifier.classify_line(line)
+        if failure_class is not None:
+            self.set_failure_class(failure_class)
+
+    def feed_fh_loader_trace(self, path: str):
+        # fh_loader writes the details of an error to its own port trace only
+        try:
+            with open(path, 'rb') as file:
+                file.seek(max(os.path.getsize(path) - FailureClassifier.TAIL_SIZE, 0))
+                data = file.read()
+        except OSError:
+            return
+        for line in data.decode('utf8', errors='replace').splitlines():
+            self.feed_fh_loader_line(line)
+
+    @staticmethod
+    def classify_line(line: str) -> Union[str, None]:
+        if not FailureClassifier.PATTERN_ERROR_LINE.match(line):
+            return None
+        if FailureClassifier.PATTERN_VIP_LINE.match(line):
+            return FailureClassifier.CLASS_VIP
+        if FailureClassifier.PATTERN_FATAL_LINE.match(line):
+            return FailureClassifier.CLASS_FATAL
+        if FailureClassifier.PATTERN_USB_LINE.match(line) or FailureClassifier.PATTERN_TIMEOUT_LINE.match(line):
+            return FailureClassifier.CLASS_TRANSIENT_USB
+        return None
+
+    @staticmethod
+    def is_retryable(failure_class: Union[str, None]) -> bool:
+        return failure_class in FailureClassifier.RETRYABLE_CLASSES
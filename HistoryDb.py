@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Sequence, Union
+
+from EventDispatcher import EventDispatcher
+
+
+class HistoryDb(object):
+    GROUP_STATION = 'station'
+    GROUP_PORT = 'port'
+    GROUP_BUILD = 'build'
+    GROUPS = (GROUP_STATION, GROUP_PORT, GROUP_BUILD)
+
+    COLUMNS = ('station', 'port', 'usb_path', 'hub', 'serial', 'build', 'image_dir', 'engine',
+               'started_at', 'duration', 'bytes', 'result', 'error_class', 'message', 'phases')
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS downloads ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'station TEXT, port TEXT, usb_path TEXT, hub TEXT, serial TEXT, build TEXT, image_dir TEXT, engine TEXT, '
+        'started_at REAL, duration REAL, bytes INTEGER, result TEXT, error_class TEXT, message TEXT, phases TEXT)',
+        'CREATE INDEX IF NOT EXISTS downloads_started_at ON downloads (started_at)',
+    )
+
+    def __init__(self, path: str):
+        self._path = path
+        self._connection: Union[sqlite3.Connection, None] = None
+
+        # sqlite is only touched by its own thread, never slows down downloading
+        self._dispatcher = EventDispatcher('t29008-history')
+
+    def path(self) -> str:
+        return self._path
+
+    def start(self):
+        self._dispatcher.start()
+
+    def stop(self):
+        # pending records are still written
+        self._dispatcher.post(self._close)
+        self._dispatcher.stop()
+
+    def add(self, record: Dict[str, Any]):
+        self._dispatcher.post(lambda: self._insert(record))
+
+    def _insert(self, record: Dict[str, Any]):
+        if self._connection is None:
+            self._connection = HistoryDb.connect(self._path)
+        values = [record.get(column) for column in HistoryDb.COLUMNS]
+        values[HistoryDb.COLUMNS.index('phases')] = json.dumps(record.get('phases') or dict())
+        with self._connection:
+            self._connection.execute(f'INSERT INTO downloads ({",".join(HistoryDb.COLUMNS)}) '
+                                     f'VALUES ({",".join("?" * len(HistoryDb.COLUMNS))})', values)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def connect(path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=10)
+        for statement in HistoryDb.SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    @staticmethod
+    def stats(path: str, group: str, since: Union[float, None] = None) -> List[Dict[str, Any]]:
+        # flash time percentiles of successful downloads, grouped by station, hub port or build
+        column = {HistoryDb.GROUP_STATION: 'station',
+                  HistoryDb.GROUP_PORT: "station || ' ' || COALESCE(usb_path, port)",
+                  HistoryDb.GROUP_BUILD: 'build'}[group]
+        query = f'SELECT {column}, result, duration, bytes FROM downloads'
+        params: List[Any] = []
+        if since is not None:
+            query += ' WHERE started_at >= ?'
+            params.append(since)
+
+        groups: Dict[str, Dict[str, Any]] = dict()
+        connection = HistoryDb.connect(path)
+        try:
+            for key, result, duration, transferred_bytes in connection.execute(query, params):
+                item = groups.setdefault(key or '-', {'key': key or '-', 'count': 0, 'success': 0, 'durations': [], 'bytes': 0})
+                item['count'] += 1
+                if result == 'success':
+                    item['success'] += 1
+                    item['durations'].append(duration or 0.0)
+                    item['bytes'] += transferred_bytes or 0
+        finally:
+            connection.close()
+
+        rows: List[Dict[str, Any]] = []
+        for item in sorted(groups.values(), key=lambda i: i['key']):
+            durations: List[float] = item.pop('durations')
+            total_time = sum(durations)
+            item['yield'] = item['success'] / item['count'] if item['count'] > 0 else 0.0
+            item['p50'] = HistoryDb.percentile(durations, 50)
+            item['p95'] = HistoryDb.percentile(durations, 95)
+            item['speed'] = item['bytes'] / total_time if total_time > 0 else 0.0
+            rows.append(item)
+        return rows
+
+    @staticmethod
+    def percentile(values: Sequence[float], percent: float) -> Union[float, None]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    @staticmethod
+    def since(days: float) -> float:
+        return time.time() - days * 24 * 60 * 60
@@ -0,0 +1,301 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _ProgressReader(object):
+    def __init__(self, file: BinaryIO, callback: Callable[[int], None]):
+        self._file = file
+        self._callback = callback
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._callback(len(data))
+        return data
+
+
+class ImageCache(object):
+    ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.zst', '.tzst')
+    COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+    DEFAULT_MAX_SIZE = 20 * 1024 * 1024 * 1024
+    COMPLETE_MARKER = '.t29008_complete'
+    DIGESTS_FILE = 'digests.json'
+
+    # entry dir -> caches using it, never evicted while used by a profile
+    _lock = threading.Lock()
+    _users: Dict[str, int] = dict()
+
+    def __init__(self, cache_dir: str, max_size: int = DEFAULT_MAX_SIZE):
+        self._root_dir = os.path.join(cache_dir, 'images')
+        self._max_size = max_size
+        self._image_dir: Union[str, None] = None
+        self._on_progress: Union[Callable[[int, int], None], None] = None
+
+        self._progress_lock = threading.Lock()
+        self._progress_done = 0
+        self._progress_total = 0
+
+    def image_dir(self) -> Union[str, None]:
+        return self._image_dir
+
+    def set_progress_listener(self, listener: Callable[[int, int], None]):
+        self._on_progress = listener
+
+    @staticmethod
+    def is_archive(path: str) -> bool:
+        return os.path.isfile(path) and path.lower().endswith(ImageCache.ARCHIVE_SUFFIXES)
+
+    @staticmethod
+    def is_compressed_image(filename: str) -> bool:
+        return filename.lower().endswith(ImageCache.COMPRESSED_SUFFIXES) and not filename.lower().endswith(ImageCache.ARCHIVE_SUFFIXES)
+
+    @staticmethod
+    def needs_decompress(path: str) -> bool:
+        if ImageCache.is_archive(path):
+            return True
+        if os.path.isdir(path):
+            return any(ImageCache.is_compressed_image(filename) for filename in os.listdir(path))
+        return False
+
+    def prepare(self, path: str) -> Tuple[bool, str]:
+        path = os.path.realpath(path)
+        if ImageCache.is_archive(path):
+            sources = [path]
+        else:
+            sources = sorted(os.path.join(path, filename) for filename in os.listdir(path)
+                             if os.path.isfile(os.path.join(path, filename)))
+
+        # same content always goes to the same entry
+        key = self._content_key(sources)
+        entry_dir = os.path.join(self._root_dir, key)
+        if os.path.exists(os.path.join(entry_dir, ImageCache.COMPLETE_MARKER)):
+            self._touch(entry_dir)
+            self._use(entry_dir)
+            return True, f'cache hit: {entry_dir}'
+
+        # decompress into temp dir, then rename to make entry visible atomically
+        tmp_dir = f'{entry_dir}.tmp{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            self._reset_progress(sum(os.path.getsize(source) for source in sources))
+            if ImageCache.is_archive(path):
+                self._extract_archive(path, tmp_dir)
+            else:
+                self._decompress_images(sources, tmp_dir)
+            with open(os.path.join(tmp_dir, ImageCache.COMPLETE_MARKER), 'w') as file:
+                file.write(path)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self._touch(entry_dir)
+        self._use(entry_dir)
+        self.evict()
+        return True, f'decompressed to {entry_dir}'
+
+    def release(self):
+        # the entry may be evicted once no cache uses it
+        if self._image_dir is None:
+            return
+        with ImageCache._lock:
+            count = ImageCache._users.get(self._image_dir, 1) - 1
+            if count > 0:
+                ImageCache._users[self._image_dir] = count
+            else:
+                ImageCache._users.pop(self._image_dir, None)
+        self._image_dir = None
+
+    def _use(self, entry_dir: str):
+        self.release()
+        with ImageCache._lock:
+            ImageCache._users[entry_dir] = ImageCache._users.get(entry_dir, 0) + 1
+        self._image_dir = entry_dir
+
+    def evict(self):
+        # LRU by last used time, never evict entries in use
+        entries: List[Tuple[float, int, str]] = []
+        for name in os.listdir(self._root_dir):
+            entry_dir = os.path.join(self._root_dir, name)
+            marker = os.path.join(entry_dir, ImageCache.COMPLETE_MARKER)
+            if os.path.exists(marker):
+                entries.append((os.path.getmtime(marker), ImageCache._dir_size(entry_dir), entry_dir))
+
+        total = sum(entry[1] for entry in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self._max_size:
+                break
+            with ImageCache._lock:
+                if entry_dir in ImageCache._users:
+                    continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def _extract_archive(self, archive: str, target_dir: str):
+        with open(archive, 'rb') as file:
+            reader = _ProgressReader(file, self._on_read)
+            lower = archive.lower()
+            if lower.endswith(('.tar.zst', '.tzst')):
+                self._with_zstd_stream(reader, lambda stream: ImageCache._extract_tar(stream, target_dir))
+            elif lower.endswith(('.tar.gz', '.tgz')):
+                with gzip.GzipFile(fileobj=reader) as stream:
+                    ImageCache._extract_tar(stream, target_dir)
+            else:
+                ImageCache._extract_tar(reader, target_dir)
+
+    @staticmethod
+    def _extract_tar(stream: BinaryIO, target_dir: str):
+        # image sets are flat, keep file names only to stay inside target dir
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = os.path.basename(member.name)
+                source = tar.extractfile(member)
+                with open(os.path.join(target_dir, name), 'wb') as file:
+                    shutil.copyfileobj(source, file, ImageCache.CHUNK_SIZE)
+
+    def _decompress_images(self, sources: List[str], target_dir: str):
+        # one file per core, zlib and zstd release GIL
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            futures = [executor.submit(self._decompress_image, source, target_dir) for source in sources]
+            for future in futures:
+                future.result()
+
+    def _decompress_image(self, source: str, target_dir: str):
+        filename = os.path.basename(source)
+        if not ImageCache.is_compressed_image(filename):
+            # plain file, link instead of copy if possible
+            target = os.path.join(target_dir, filename)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            self._on_read(os.path.getsize(source))
+            return
+
+        target = os.path.join(target_dir, os.path.splitext(filename)[0])
+        with open(source, 'rb') as src_file, open(target, 'wb') as dst_file:
+            reader = _ProgressReader(src_file, self._on_read)
+            if filename.lower().endswith('.zst'):
+                self._with_zstd_stream(reader, lambda stream: shutil.copyfileobj(stream, dst_file, ImageCache.CHUNK_SIZE))
+            else:
+                with gzip.GzipFile(fileobj=reader) as stream:
+                    shutil.copyfileobj(stream, dst_file, ImageCache.CHUNK_SIZE)
+
+    @staticmethod
+    def _with_zstd_stream(reader: _ProgressReader, consumer: Callable[[BinaryIO], None]):
+        if zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(reader) as stream:
+                consumer(stream)
+            return
+
+        # fallback to zstd command line tool
+        if shutil.which('zstd') is None:
+            raise OSError('zstd support requires "pip install zstandard" or zstd command in PATH')
+
+        zstd = subprocess.Popen(['zstd', '-d', '-c', '-q'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def feed():
+            try:
+                while True:
+                    data = reader.read(ImageCache.CHUNK_SIZE)
+                    if not data:
+                        break
+                    zstd.stdin.write(data)
+            except OSError:
+                pass  # zstd exited, error is reported by return code
+            finally:
+                zstd.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        consumer(zstd.stdout)
+        feeder.join()
+        if zstd.wait() != 0:
+            raise OSError(f'zstd failed with code {zstd.returncode}')
+
+    def _content_key(self, sources: List[str]) -> str:
+        digests = self._load_digests()
+        sha256 = hashlib.sha256()
+        for source in sources:
+            sha256.update(os.path.basename(source).encode('utf8'))
+            sha256.update(self._file_digest(source, digests).encode('utf8'))
+        self._save_digests(digests)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def _file_digest(path: str, digests: Dict[str, str]) -> str:
+        # memorized by path, size and mtime to hash each file only once
+        stat = os.stat(path)
+        memo_key = f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}'
+        if memo_key not in digests:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as file:
+                while True:
+                    data = file.read(ImageCache.CHUNK_SIZE)
+                    if not data:
+                        break
+                    sha256.update(data)
+            digests[memo_key] = sha256.hexdigest()
+        return digests[memo_key]
+
+    def _load_digests(self) -> Dict[str, str]:
+        try:
+            with open(os.path.join(self._root_dir, ImageCache.DIGESTS_FILE), 'r', encoding='utf8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    def _save_digests(self, digests: Dict[str, str]):
+        os.makedirs(self._root_dir, exist_ok=True)
+        digests_file = os.path.join(self._root_dir, ImageCache.DIGESTS_FILE)
+        tmp_file = f'{digests_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as file:
+            json.dump(digests, file)
+        os.replace(tmp_file, digests_file)
+
+    def _reset_progress(self, total: int):
+        with self._progress_lock:
+            self._progress_done = 0
+            self._progress_total = total
+
+    def _on_read(self, size: int):
+        with self._progress_lock:
+            self._progress_done += size
+            done, total = self._progress_done, self._progress_total
+        if self._on_progress:
+            self._on_progress(done, total)
+
+    @staticmethod
+    def _touch(entry_dir: str):
+        now = time.time()
+        os.utime(os.path.join(entry_dir, ImageCache.COMPLETE_MARKER), (now, now))
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        # hard linked plain files take no extra space
+        size = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    if stat.st_nlink <= 1:
+                        size += stat.st_size
+        return size
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+
+class ProgramEntry(object):
+    def __init__(self,
+                 xml: str,
+                 label: str,
+                 filename: str,
+                 lun: str,
+                 start_sector: str,
+                 num_sectors: int,
+                 sector_size: int,
+                 file_sector_offset: int,
+                 sparse: bool,
+                 transfer_bytes: int):
+        self._xml = xml
+        self._label = label
+        self._filename = filename
+        self._lun = lun
+        self._start_sector = start_sector  # may be an expression, i.e. "NUM_DISK_SECTORS-5."
+        self._num_sectors = num_sectors
+        self._sector_size = sector_size
+        self._file_sector_offset = file_sector_offset
+        self._sparse = sparse
+        self._transfer_bytes = transfer_bytes  # bytes really sent by fh_loader
+
+    def xml(self) -> str:
+        return self._xml
+
+    def label(self) -> str:
+        return self._label
+
+    def filename(self) -> str:
+        return self._filename
+
+    def lun(self) -> str:
+        return self._lun
+
+    def start_sector(self) -> str:
+        return self._start_sector
+
+    def num_sectors(self) -> int:
+        return self._num_sectors
+
+    def sector_size(self) -> int:
+        return self._sector_size
+
+    def file_sector_offset(self) -> int:
+        return self._file_sector_offset
+
+    def sparse(self) -> bool:
+        return self._sparse
+
+    def transfer_bytes(self) -> int:
+        return self._transfer_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'xml': self._xml,
+            'label': self._label,
+            'filename': self._filename,
+            'lun': self._lun,
+            'start_sector': self._start_sector,
+            'num_sectors': self._num_sectors,
+            'sector_size': self._sector_size,
+            'file_sector_offset': self._file_sector_offset,
+            'sparse': self._sparse,
+            'transfer_bytes': self._transfer_bytes,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'ProgramEntry':
+        return ProgramEntry(**data)
+
+
+class ImageManifest(object):
+    VERSION = 2
+
+    PATTERN_RAWPROGRAM = re.compile(r'rawprogram\d+.xml')
+    PATTERN_PATCH = re.compile(r'patch\d+.xml')
+    PATTERN_BUILD_CONTENT = re.compile(r'.*(\.xml|digest.*)$', re.IGNORECASE)  # small files hashed into build id
+
+    def __init__(self,
+                 image_dir: str,
+                 fingerprint: str,
+                 build_id: str,
+                 files: Dict[str, int],
+                 rawprograms: Sequence[str],
+                 patches: Sequence[str],
+                 programs: Sequence[ProgramEntry]):
+        self._image_dir = image_dir
+        self._fingerprint = fingerprint  # changes with mtime, only tells if rescanning is needed
+        self._build_id = build_id  # same for the same build on any station
+        self._files = files  # filename -> size
+        self._rawprograms = list(rawprograms)
+        self._patches = list(patches)
+        self._programs = list(programs)
+
+    def image_dir(self) -> str:
+        return self._image_dir
+
+    def fingerprint(self) -> str:
+        return self._fingerprint
+
+    def build_id(self) -> str:
+        return self._build_id
+
+    def files(self) -> Dict[str, int]:
+        return self._files
+
+    def file_list(self) -> List[str]:
+        return list(self._files.keys())
+
+    def has_file(self, filename: str) -> bool:
+        return filename in self._files
+
+    def file_size(self, filename: str) -> int:
+        return self._files.get(filename, 0)
+
+    def rawprograms(self) -> List[str]:
+        return self._rawprograms
+
+    def patches(self) -> List[str]:
+        return self._patches
+
+    def programs(self) -> List[ProgramEntry]:
+        return self._programs
+
+    def partitions(self) -> List[str]:
+        labels: List[str] = []
+        for program in self._programs:
+            if program.label() and program.label() not in labels:
+                labels.append(program.label())
+        return labels
+
+    def sendxml(self) -> List[str]:
+        return [*self._rawprograms, *self._patches]
+
+    def total_bytes(self) -> int:
+        return sum(program.transfer_bytes() for program in self._programs)
+
+    def find_file(self, search_list: Sequence[str]) -> Union[str, None]:
+        for filename in search_list:
+            if filename in self._files:
+                return filename
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'version': ImageManifest.VERSION,
+            'image_dir': self._image_dir,
+            'fingerprint': self._fingerprint,
+            'build_id': self._build_id,
+            'files': self._files,
+            'rawprograms': self._rawprograms,
+            'patches': self._patches,
+            'programs': [program.to_dict() for program in self._programs],
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'ImageManifest':
+        return ImageManifest(data['image_dir'],
+                             data['fingerprint'],
+                             data['build_id'],
+                             data['files'],
+                             data['rawprograms'],
+                             data['patches'],
+                             [ProgramEntry.from_dict(program) for program in data['programs']])
+
+    @staticmethod
+    def load(image_dir: str, cache_dir: Union[str, None] = None) -> 'ImageManifest':
+        image_dir = os.path.realpath(image_dir)
+        stats = ImageManifest._scan(image_dir)
+        fingerprint = ImageManifest._fingerprint_of(stats)
+
+        # reuse cached manifest if no file is changed
+        cache_file = ImageManifest._cache_file(cache_dir, image_dir) if cache_dir else None
+        if cache_file:
+            manifest = ImageManifest._load_cache(cache_file)
+            if manifest is not None and manifest.fingerprint() == fingerprint and manifest.image_dir() == image_dir:
+                return manifest
+
+        manifest = ImageManifest._build(image_dir, fingerprint, stats)
+        if cache_file:
+            ImageManifest._save_cache(cache_file, manifest)
+        return manifest
+
+    @staticmethod
+    def _scan(image_dir: str) -> Dict[str, Tuple[int, int]]:
+        # filename -> (size, mtime_ns)
+        stats: Dict[str, Tuple[int, int]] = dict()
+        with os.scandir(image_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    @staticmethod
+    def _fingerprint_of(stats: Dict[str, Tuple[int, int]]) -> str:
+        sha1 = hashlib.sha1()
+        for filename in sorted(stats.keys()):
+            size, mtime_ns = stats[filename]
+            sha1.update(f'{filename}\0{size}\0{mtime_ns}\n'.encode('utf8'))
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _build(image_dir: str, fingerprint: str, stats: Dict[str, Tuple[int, int]]) -> 'ImageManifest':
+        files = {filename: stat[0] for filename, stat in stats.items()}
+        rawprograms = sorted(filename for filename in files if ImageManifest.PATTERN_RAWPROGRAM.match(filename))
+        patches = sorted(filename for filename in files if ImageManifest.PATTERN_PATCH.match(filename))
+
+        programs: List[ProgramEntry] = []
+        for rawprogram in rawprograms:
+            programs.extend(ImageManifest.parse_rawprogram(os.path.join(image_dir, rawprogram), rawprogram, files))
+
+        return ImageManifest(image_dir, fingerprint, ImageManifest._build_id_of(image_dir, files), files,
+                             rawprograms, patches, programs)
+
+    @staticmethod
+    def _build_id_of(image_dir: str, files: Dict[str, int]) -> str:
+        # names and sizes of all files, contents of xml and digests, images are too large to hash on every load
+        sha256 = hashlib.sha256()
+        for filename in sorted(files.keys()):
+            sha256.update(f'{filename}\0{files[filename]}\n'.encode('utf8'))
+            if ImageManifest.PATTERN_BUILD_CONTENT.match(filename):
+                try:
+                    with open(os.path.join(image_dir, filename), 'rb') as file:
+                        sha256.update(file.read())
+                except OSError:
+                    pass  # removed meanwhile, the name and size still count
+        return sha256.hexdigest()
+
+    @staticmethod
+    def parse_rawprogram(path: str, xml: str, files: Dict[str, int]) -> List[ProgramEntry]:
+        programs: List[ProgramEntry] = []
+        try:
+            root = ElementTree.parse(path).getroot()
+        except (OSError, ElementTree.ParseError):
+            return programs
+
+        for element in root.iter('program'):
+            filename = element.get('filename', '')
+            sector_size = ImageManifest.parse_int(element.get('SECTOR_SIZE_IN_BYTES'), 512)
+            num_sectors = ImageManifest.parse_int(element.get('num_partition_sectors'), 0)
+            file_sector_offset = ImageManifest.parse_int(element.get('file_sector_offset'), 0)
+            sparse = element.get('sparse', 'false').lower() == 'true'
+
+            # fh_loader skips entries whose file is not given
+            transfer_bytes = 0
+            if filename and filename in files:
+                transfer_bytes = max(files[filename] - file_sector_offset * sector_size, 0)
+                if num_sectors > 0 and not sparse:
+                    transfer_bytes = min(transfer_bytes, num_sectors * sector_size)
+
+            programs.append(ProgramEntry(xml,
+                                         element.get('label', ''),
+                                         filename,
+                                         element.get('physical_partition_number', '0'),
+                                         element.get('start_sector', '0'),
+                                         num_sectors,
+                                         sector_size,
+                                         file_sector_offset,
+                                         sparse,
+                                         transfer_bytes))
+        return programs
+
+    @staticmethod
+    def parse_int(value: Union[str, None], default: int) -> int:
+        if value is None:
+            return default
+        try:
+            return int(value.strip().rstrip('.'), 0)
+        except ValueError:
+            return default
+
+    @staticmethod
+    def _cache_file(cache_dir: str, image_dir: str) -> str:
+        key = hashlib.sha1(image_dir.encode('utf8')).hexdigest()
+        return os.path.join(cache_dir, 'manifest', f'{key}.json')
+
+    @staticmethod
+    def _load_cache(cache_file: str) -> Union['ImageManifest', None]:
+        try:
+            with open(cache_file, 'r', encoding='utf8') as file:
+                data = json.load(file)
+            if data.get('version') != ImageManifest.VERSION:
+                return None
+            return ImageManifest.from_dict(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None  # broken cache, rebuild
+
+    @staticmethod
+    def _save_cache(cache_file: str, manifest: 'ImageManifest'):
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf8') as file:
+                json.dump(manifest.to_dict(), file)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # cache is optional
@@ -0,0 +1,165 @@
+import threading
+from typing import Any, Dict, List, Union
+
+from ImageCache import ImageCache
+from ImageManifest import ImageManifest
+from ImageStager import ImageStager
+from SendXmlBuilder import SendXmlBuilder
+from T2EdlTask import T2EdlTask
+
+
+class ProfileConfig(object):
+    DEFAULT_NAME = 'default'
+
+    def __init__(self,
+                 name: str,
+                 image_dir: str,
+                 prog: Union[str, None] = None,
+                 is_vip: Union[bool, None] = None,
+                 signed_digests: Union[str, None] = None,
+                 chained_digests: Union[str, None] = None):
+        self._name = name
+        self._image_dir = image_dir  # may be an archive
+        self._prog = prog
+        self._is_vip = is_vip  # None: auto detect
+        self._signed_digests = signed_digests
+        self._chained_digests = chained_digests
+
+    def name(self) -> str:
+        return self._name
+
+    def image_dir(self) -> str:
+        return self._image_dir
+
+    def prog(self) -> Union[str, None]:
+        return self._prog
+
+    def is_vip(self) -> Union[bool, None]:
+        return self._is_vip
+
+    def signed_digests(self) -> Union[str, None]:
+        return self._signed_digests
+
+    def chained_digests(self) -> Union[str, None]:
+        return self._chained_digests
+
+    def with_image_dir(self, image_dir: str) -> 'ProfileConfig':
+        return ProfileConfig(self._name, image_dir, self._prog, self._is_vip, self._signed_digests, self._chained_digests)
+
+
+class ImageProfile(object):
+    # everything prepared from one image set, shared by all tasks downloading it
+    def __init__(self, config: ProfileConfig):
+        self._config = config
+        self._image_dir = config.image_dir()  # real dir downloaded from
+        self._manifest: Union[ImageManifest, None] = None
+        self._is_vip: Union[bool, None] = config.is_vip()
+        self._signed_digests: Union[str, None] = config.signed_digests()
+        self._chained_digests: Union[str, None] = config.chained_digests()
+        self._sendxml_builder: Union[SendXmlBuilder, None] = None
+        self._erase_partitions: List[str] = list(T2EdlTask.ERASE_PARTITIONS)
+        self._stager: Union[ImageStager, None] = None
+        self._cache: Union[ImageCache, None] = None  # decompressed image dir in use
+
+        # generated files are removed once retired and no task uses them
+        self._lock = threading.Lock()
+        self._task_count = 0
+        self._retired = False
+
+    def config(self) -> ProfileConfig:
+        return self._config
+
+    def name(self) -> str:
+        return self._config.name()
+
+    def source_dir(self) -> str:
+        return self._config.image_dir()
+
+    def image_dir(self) -> str:
+        return self._image_dir
+
+    def set_image_dir(self, image_dir: str):
+        self._image_dir = image_dir
+
+    def manifest(self) -> Union[ImageManifest, None]:
+        return self._manifest
+
+    def set_manifest(self, manifest: ImageManifest):
+        self._manifest = manifest
+
+    def is_vip(self) -> Union[bool, None]:
+        return self._is_vip
+
+    def signed_digests(self) -> Union[str, None]:
+        return self._signed_digests
+
+    def chained_digests(self) -> Union[str, None]:
+        return self._chained_digests
+
+    def set_vip(self, is_vip: bool, signed_digests: Union[str, None], chained_digests: Union[str, None]):
+        self._is_vip = is_vip
+        self._signed_digests = signed_digests
+        self._chained_digests = chained_digests
+
+    def sendxml_builder(self) -> Union[SendXmlBuilder, None]:
+        return self._sendxml_builder
+
+    def set_sendxml_builder(self, sendxml_builder: SendXmlBuilder):
+        self._sendxml_builder = sendxml_builder
+
+    def erase_partitions(self) -> List[str]:
+        return self._erase_partitions
+
+    def set_erase_partitions(self, erase_partitions: List[str]):
+        self._erase_partitions = erase_partitions
+
+    def stager(self) -> Union[ImageStager, None]:
+        return self._stager
+
+    def set_stager(self, stager: ImageStager):
+        self._stager = stager
+
+    def cache(self) -> Union[ImageCache, None]:
+        return self._cache
+
+    def set_cache(self, cache: ImageCache):
+        self._cache = cache
+
+    def build(self) -> str:
+        return self._manifest.build_id() if self._manifest is not None else ''
+
+    def task_params(self) -> Dict[str, Any]:
+        return dict(prog=self._config.prog(),
+                    is_vip=self._is_vip,
+                    signed_digests=self._signed_digests,
+                    chained_digests=self._chained_digests,
+                    sendxml=self._sendxml_builder.sendxml(),
+                    programs=self._sendxml_builder.programs(),
+                    erase_partitions=self._erase_partitions)
+
+    def acquire(self):
+        with self._lock:
+            self._task_count += 1
+
+    def release(self):
+        with self._lock:
+            self._task_count -= 1
+            clean = self._retired and self._task_count == 0
+        if clean:
+            self.clean()
+
+    def retire(self):
+        # replaced by another profile, cleaned after its last task
+        with self._lock:
+            self._retired = True
+            clean = self._task_count == 0
+        if clean:
+            self.clean()
+
+    def clean(self):
+        if self._stager is not None:
+            self._stager.clean()
+        if self._sendxml_builder is not None:
+            self._sendxml_builder.clean()
+        if self._cache is not None:
+            self._cache.release()
@@ -0,0 +1,201 @@
+import ctypes
+import os
+import platform
+import shutil
+import threading
+from typing import Callable, Dict, Tuple, Union
+
+from ImageManifest import ImageManifest
+
+
+class ImageStager(object):
+    MODE_NONE = 'none'
+    MODE_CACHE = 'cache'  # pre-read images into page cache
+    MODE_TMPFS = 'tmpfs'  # copy images into a RAM backed dir
+    MODES = (MODE_NONE, MODE_CACHE, MODE_TMPFS)
+
+    CHUNK_SIZE = 8 * 1024 * 1024
+    MEMORY_RESERVE = 512 * 1024 * 1024  # memory left for the system & downloading processes
+    TMPFS_DIR = '/dev/shm'
+
+    # staged dir -> stagers using it, profiles of the same image set share one copy
+    _lock = threading.Lock()
+    _users: Dict[str, int] = dict()
+
+    def __init__(self, manifest: ImageManifest, mode: str):
+        self._manifest = manifest
+        self._mode = mode
+        self._staged_dir: Union[str, None] = None
+        self._on_progress: Union[Callable[[int, int], None], None] = None
+
+    def mode(self) -> str:
+        return self._mode
+
+    def staged_dir(self) -> Union[str, None]:
+        return self._staged_dir
+
+    def set_progress_listener(self, listener: Callable[[int, int], None]):
+        self._on_progress = listener
+
+    def total_bytes(self) -> int:
+        return sum(self._manifest.file_size(filename) for filename in self._manifest.file_list())
+
+    def stage(self) -> Tuple[bool, str]:
+        if self._mode == ImageStager.MODE_CACHE:
+            return self._warm_page_cache()
+        elif self._mode == ImageStager.MODE_TMPFS:
+            return self._copy_to_tmpfs()
+        return True, 'staging disabled'
+
+    def clean(self):
+        # removed with its last user
+        if self._staged_dir is None:
+            return
+        with ImageStager._lock:
+            count = ImageStager._users.get(self._staged_dir, 1) - 1
+            if count > 0:
+                ImageStager._users[self._staged_dir] = count
+            else:
+                ImageStager._users.pop(self._staged_dir, None)
+        if count <= 0:
+            shutil.rmtree(self._staged_dir, ignore_errors=True)
+        self._staged_dir = None
+
+    def _warm_page_cache(self) -> Tuple[bool, str]:
+        total = self.total_bytes()
+        ok, msg = ImageStager._check_memory(total)
+        if not ok:
+            return False, msg
+
+        done = 0
+        for filename in self._manifest.file_list():
+            path = os.path.join(self._manifest.image_dir(), filename)
+            with open(path, 'rb', buffering=0) as file:
+                ImageStager._advise(file.fileno())
+                while True:
+                    size = len(file.read(ImageStager.CHUNK_SIZE))
+                    if size <= 0:
+                        break
+                    done += size
+                    self.notify_progress(done, total)
+        return True, f'{total / 1024 / 1024:.1f} MB loaded into page cache'
+
+    def _copy_to_tmpfs(self) -> Tuple[bool, str]:
+        if not os.path.isdir(ImageStager.TMPFS_DIR):
+            return False, f'RAM backed dir not available: {ImageStager.TMPFS_DIR}'
+
+        # one dir per session, another session may remove its own at any time
+        root_dir = os.path.join(ImageStager.TMPFS_DIR, 't29008')
+        staged_dir = os.path.join(root_dir, f'{self._manifest.fingerprint()}.{os.getpid()}')
+        total = self.total_bytes()
+        with ImageStager._lock:
+            if staged_dir in ImageStager._users:
+                ImageStager._users[staged_dir] += 1
+                self._staged_dir = staged_dir
+                return True, f'{total / 1024 / 1024:.1f} MB already staged to {staged_dir}'
+        ImageStager._remove_stale(root_dir)
+
+        ok, msg = ImageStager._check_memory(total)
+        if not ok:
+            return False, msg
+        if shutil.disk_usage(ImageStager.TMPFS_DIR).free < total:
+            return False, f'not enough space in {ImageStager.TMPFS_DIR} for {total / 1024 / 1024:.1f} MB'
+
+        shutil.rmtree(staged_dir, ignore_errors=True)
+        os.makedirs(staged_dir)
+        try:
+            done = 0
+            for filename in self._manifest.file_list():
+                src = os.path.join(self._manifest.image_dir(), filename)
+                dst = os.path.join(staged_dir, filename)
+                with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                    ImageStager._advise(src_file.fileno())
+                    while True:
+                        data = src_file.read(ImageStager.CHUNK_SIZE)
+                        if not data:
+                            break
+                        dst_file.write(data)
+                        done += len(data)
+                        self.notify_progress(done, total)
+                shutil.copystat(src, dst)
+        except BaseException:
+            # i.e. no space left, never leave a partial copy in RAM
+            shutil.rmtree(staged_dir, ignore_errors=True)
+            raise
+
+        with ImageStager._lock:
+            ImageStager._users[staged_dir] = 1
+        self._staged_dir = staged_dir
+        return True, f'{total / 1024 / 1024:.1f} MB staged to {staged_dir}'
+
+    def notify_progress(self, done: int, total: int):
+        if self._on_progress:
+            self._on_progress(done, total)
+
+    @staticmethod
+    def _remove_stale(root_dir: str):
+        # left by sessions killed before cleaning
+        if not os.path.isdir(root_dir):
+            return
+        for name in os.listdir(root_dir):
+            _, _, pid = name.rpartition('.')
+            if pid.isdigit() and not ImageStager._is_alive(int(pid)):
+                shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True  # i.e. owned by another user
+        return True
+
+    @staticmethod
+    def _advise(fd: int):
+        # hint kernel to read ahead aggressively
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+    @staticmethod
+    def _check_memory(required: int) -> Tuple[bool, str]:
+        available = ImageStager.available_memory()
+        if available is None:
+            return True, 'unknown available memory'
+        if required + ImageStager.MEMORY_RESERVE > available:
+            return False, (f'memory too low for staging: {required / 1024 / 1024:.1f} MB required, '
+                           f'{available / 1024 / 1024:.1f} MB available')
+        return True, f'{available / 1024 / 1024:.1f} MB available'
+
+    @staticmethod
+    def available_memory() -> Union[int, None]:
+        if platform.system() == 'Windows':
+            class MemoryStatusEx(ctypes.Structure):
+                _fields_ = [
+                    ('dwLength', ctypes.c_ulong),
+                    ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong),
+                    ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong),
+                    ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong),
+                    ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+                ]
+
+            status = MemoryStatusEx()
+            status.dwLength = ctypes.sizeof(MemoryStatusEx)
+            if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return None
+            return status.ullAvailPhys
+
+        try:
+            with open('/proc/meminfo') as file:
+                for line in file:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
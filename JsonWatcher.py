@@ -0,0 +1,113 @@
+import collections
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from typing import Any, Deque, Dict, List, Tuple, Union
+
+from T2Edl import Watcher
+
+
+class JsonWatcher(Watcher):
+    PATTERN_MARKUP = re.compile(r'\[/?(?:red|green|yellow|blue)]')
+    LEVELS = {'blue': 'info', 'yellow': 'warning', 'red': 'error'}
+    CONNECT_TIMEOUT = 1  # seconds, also of sending, the event bus waits for it
+    RECONNECT_INTERVAL = 3  # seconds between connecting attempts while the receiver is down
+    MAX_BACKLOG = 1000  # events kept while disconnected, oldest dropped
+
+    def __init__(self, address: Union[Tuple[str, int], None] = None):
+        self._address = address  # (host, port) to send events to, stdout if not set
+        self._socket: Union[socket.socket, None] = None
+        self._reconnect_time = 0.0
+        self._backlog: Deque[bytes] = collections.deque(maxlen=JsonWatcher.MAX_BACKLOG)
+        self._lock = threading.Lock()
+        self._start_times: Dict[str, float] = dict()
+        self._phase_times: Dict[str, Dict[str, float]] = dict()
+
+    def on_started(self):
+        self.emit('started')
+
+    def on_stopped(self):
+        self.emit('stopped')
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def on_update_message(self, message: str, color: str):
+        self.emit('message', level=JsonWatcher.LEVELS.get(color, 'info'), message=JsonWatcher.PATTERN_MARKUP.sub('', message))
+
+    def on_queue_progress(self, key: str, hub: Union[str, None]):
+        self.emit('queued', key=key, hub=hub)
+
+    def on_start_progress(self, key: str, hub: Union[str, None]):
+        self._start_times[key] = time.time()
+        self._phase_times[key] = dict()
+        self.emit('start', key=key, hub=hub)
+
+    def on_stop_progress(self, key: str, success: bool, message: Union[str, None]):
+        start_time = self._start_times.pop(key, None)
+        self.emit('success' if success else 'error',
+                  key=key,
+                  message=message,
+                  duration=round(time.time() - start_time, 3) if start_time is not None else None,
+                  phases=self._phase_times.pop(key, dict()))
+
+    def on_update_progress(self, key: str, cur_progress: int, max_progress: Union[int, None]):
+        self.emit('progress', key=key, current=cur_progress, total=max_progress)
+
+    def on_update_throughput(self, key: str, speed: float, average_speed: float, eta: Union[float, None]):
+        self.emit('throughput', key=key, speed=round(speed), average_speed=round(average_speed),
+                  eta=round(eta, 1) if eta is not None else None)
+
+    def on_update_phase(self, key: str, phase: str):
+        # seconds since started
+        start_time = self._start_times.get(key)
+        elapsed = round(time.time() - start_time, 3) if start_time is not None else None
+        if elapsed is not None:
+            self._phase_times.setdefault(key, dict())[phase] = elapsed
+        self.emit('phase', key=key, phase=phase, elapsed=elapsed)
+
+    def on_update_traces(self, key: str, trace_dir: str, trace_files: List[str]):
+        # after success / error, once stored (and compressed) in background
+        self.emit('traces', key=key, trace_dir=trace_dir, traces=trace_files)
+
+    def emit(self, event: str, **fields: Any):
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields}) + '\n'
+        with self._lock:
+            if self._address is None:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                return
+            self._send(line.encode('utf8'))
+
+    def _send(self, data: bytes):
+        # one connecting attempt per interval, events are kept in a bounded backlog while the receiver is down
+        self._backlog.append(data)
+        if self._socket is None:
+            if time.monotonic() < self._reconnect_time:
+                return
+            try:
+                self._socket = socket.create_connection(self._address, JsonWatcher.CONNECT_TIMEOUT)
+            except OSError:
+                self._reconnect_time = time.monotonic() + JsonWatcher.RECONNECT_INTERVAL
+                return
+        try:
+            while self._backlog:
+                self._socket.sendall(self._backlog[0])
+                self._backlog.popleft()
+        except OSError:
+            # the receiver went away, the next event reconnects at once
+            self._socket.close()
+            self._socket = None
+            self._reconnect_time = 0.0
+
+    @staticmethod
+    def parse_address(address: str) -> Union[Tuple[str, int], None]:
+        # host:port
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            return None
+        return host, int(port)
@@ -0,0 +1,167 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metric(object):
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, description: str):
+        self._name = name
+        self._description = description
+        self._lock = threading.Lock()
+
+    def name(self) -> str:
+        return self._name
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self._name} {self._description}', f'# TYPE {self._name} {self.TYPE}', *self.samples()]
+
+    def samples(self) -> List[str]:
+        return []
+
+    @staticmethod
+    def labels_of(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    @staticmethod
+    def format_labels(labels: Labels, extra: Union[Tuple[str, str], None] = None) -> str:
+        pairs = [*labels, extra] if extra is not None else list(labels)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[Labels, float] = dict()
+
+    def inc(self, value: float = 1, **labels: str):
+        key = Metric.labels_of(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self._name}{Metric.format_labels(labels)} {Metric.format_value(value)}'
+                    for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, description: str, getter: Callable[[], float]):
+        super().__init__(name, description)
+        self._getter = getter  # read on every scrape
+
+    def samples(self) -> List[str]:
+        return [f'{self._name} {Metric.format_value(self._getter())}']
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    TIME_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1200)
+    SPEED_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 300))
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = TIME_BUCKETS):
+        super().__init__(name, description)
+        self._buckets = sorted(buckets)
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = dict()  # labels -> (bucket counts, sum, count)
+
+    def observe(self, value: float, **labels: str):
+        key = Metric.labels_of(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self._buckets), 0.0, 0))
+            index = bisect.bisect_left(self._buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(self._buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self._name}_bucket{Metric.format_labels(labels, ("le", f"{bucket:g}"))} {cumulative}')
+                lines.append(f'{self._name}_bucket{Metric.format_labels(labels, ("le", "+Inf"))} {count}')
+                lines.append(f'{self._name}_sum{Metric.format_labels(labels)} {Metric.format_value(total)}')
+                lines.append(f'{self._name}_count{Metric.format_labels(labels)} {count}')
+        return lines
+
+
+class Metrics(object):
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._server: Union[ThreadingHTTPServer, None] = None
+        self._thread: Union[threading.Thread, None] = None
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._add(Counter(name, description))
+
+    def gauge(self, name: str, description: str, getter: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, description, getter))
+
+    def histogram(self, name: str, description: str, buckets: Sequence[float] = Histogram.TIME_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, description, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def start_server(self, port: int, host: str = ''):
+        if self._server is not None:
+            return  # already started
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', Metrics.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep console clean
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='t29008-metrics', daemon=True)
+        self._thread.start()
+
+    def stop_server(self):
+        if self._server is None:
+            return  # not started
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
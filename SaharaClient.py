@@ -0,0 +1,251 @@
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, Dict, Tuple, Union
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None  # Windows, builtin sahara not supported
+    tty = None
+
+
+class SaharaError(Exception):
+    pass
+
+
+class ProgrammerCache(object):
+    # programmers are read once and shared by all devices, reloaded when the file changes
+    _lock = threading.Lock()
+    _programmers: Dict[str, Tuple[Tuple[int, int], bytes]] = dict()
+
+    @staticmethod
+    def load(path: str) -> bytes:
+        # raises OSError
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with ProgrammerCache._lock:
+            entry = ProgrammerCache._programmers.get(path)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+
+            # drop those of removed image sets
+            for cached_path in list(ProgrammerCache._programmers.keys()):
+                if not os.path.exists(cached_path):
+                    del ProgrammerCache._programmers[cached_path]
+
+            with open(path, 'rb') as file:
+                data = file.read()
+            ProgrammerCache._programmers[path] = (version, data)
+            return data
+
+
+class SaharaClient(object):
+    CMD_HELLO = 0x01
+    CMD_HELLO_RESP = 0x02
+    CMD_READ_DATA = 0x03
+    CMD_END_IMAGE_TX = 0x04
+    CMD_DONE = 0x05
+    CMD_DONE_RESP = 0x06
+    CMD_RESET = 0x07
+    CMD_RESET_RESP = 0x08
+    CMD_READY = 0x0B
+    CMD_SWITCH_MODE = 0x0C
+    CMD_EXEC = 0x0D
+    CMD_EXEC_RESP = 0x0E
+    CMD_EXEC_DATA = 0x0F
+    CMD_READ_DATA_64 = 0x12
+
+    MODE_IMAGE_TX_PENDING = 0
+    MODE_IMAGE_TX_COMPLETE = 1
+    MODE_MEMORY_DEBUG = 2
+    MODE_COMMAND = 3
+
+    EXEC_SERIAL_NUM_READ = 0x01
+    EXEC_MSM_HW_ID_READ = 0x02
+
+    VERSION = 2
+    VERSION_COMPATIBLE = 1
+    STATUS_SUCCESS = 0
+
+    IMAGE_ID_PROGRAMMER = 13
+
+    HEADER = struct.Struct('<II')
+    MAX_PACKET_SIZE = 0x1000  # sahara packets are small, raw image data is not a packet
+
+    HELLO_TIMEOUT = 10  # seconds for device to say hello after opened
+    PACKET_TIMEOUT = 5  # seconds for each packet or raw data after that
+
+    # host side of sahara over the tty, one client per device
+    def __init__(self, path: str, log: Callable[[str], None]):
+        self._path = path
+        self._log = log
+        self._fd: Union[int, None] = None
+
+    def path(self) -> str:
+        return self._path
+
+    def set_log_listener(self, log: Callable[[str], None]):
+        self._log = log
+
+    def is_open(self) -> bool:
+        return self._fd is not None
+
+    def open(self):
+        # raises OSError
+        if self._fd is not None:
+            return  # already opened
+
+        fd = os.open(self._path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(fd, termios.TCSANOW)  # never flushed, device may have said hello already
+        except termios.error as e:
+            os.close(fd)
+            raise OSError(f'failed to set raw mode of {self._path}: {e}')
+        self._fd = fd
+        self._log(f'Opened port {self._path}')
+
+    def close(self):
+        if self._fd is None:
+            return  # not opened
+
+        os.close(self._fd)
+        self._fd = None
+
+    def identify(self) -> Tuple[Union[int, None], Union[int, None]]:
+        # serial and hw id in command mode, device is switched back to image transfer after them
+        self._hello(SaharaClient.MODE_COMMAND)
+        self._expect(SaharaClient.CMD_READY, 'CMD_READY')
+
+        serial = self._exec(SaharaClient.EXEC_SERIAL_NUM_READ)
+        if serial is not None:
+            serial = int.from_bytes(serial[:4], 'little')
+            self._log(f'Serial Num: 0x{serial:08x}')
+        hw_id = self._exec(SaharaClient.EXEC_MSM_HW_ID_READ)
+        if hw_id is not None:
+            hw_id = int.from_bytes(hw_id[:8], 'little')
+            self._log(f'HW_ID: 0x{hw_id:016x}')
+
+        self._send(SaharaClient.CMD_SWITCH_MODE, SaharaClient.MODE_IMAGE_TX_PENDING)
+        self._log('Switched to image transfer mode')
+        return serial, hw_id
+
+    def upload(self, image_id: int, image: bytes):
+        self._hello(SaharaClient.MODE_IMAGE_TX_PENDING)
+
+        # device reads the image piece by piece as it parses the elf
+        view = memoryview(image)
+        while True:
+            command, body = self._read_packet()
+            if command in (SaharaClient.CMD_READ_DATA, SaharaClient.CMD_READ_DATA_64):
+                if command == SaharaClient.CMD_READ_DATA:
+                    requested_id, offset, length = struct.unpack_from('<III', body)
+                else:
+                    requested_id, offset, length = struct.unpack_from('<QQQ', body)
+                self._log(f'Received READ_DATA image id {requested_id}, offset 0x{offset:x}, length 0x{length:x}')
+                if requested_id != image_id:
+                    raise SaharaError(f'unexpected image id {requested_id}, only {image_id} is provided')
+                if offset + length > len(image):
+                    raise SaharaError(f'read beyond image of {len(image)} bytes, offset 0x{offset:x}, length 0x{length:x}')
+                self._write(view[offset:offset + length])
+            elif command == SaharaClient.CMD_END_IMAGE_TX:
+                requested_id, status = struct.unpack_from('<II', body)
+                if status != SaharaClient.STATUS_SUCCESS:
+                    raise SaharaError(f'device rejected image {requested_id}, status 0x{status:x} (nak)')
+                self._log(f'Received END_IMAGE_TX image id {requested_id}')
+                break
+            elif command == SaharaClient.CMD_HELLO:
+                raise SaharaError('unexpected hello, device restarted sahara')
+            else:
+                raise SaharaError(f'unexpected packet 0x{command:x} while uploading')
+
+        self._send(SaharaClient.CMD_DONE)
+        body = self._expect(SaharaClient.CMD_DONE_RESP, 'DONE_RESP')
+        status, = struct.unpack_from('<I', body)
+        self._log(f'Received DONE_RESP, image transfer {"complete" if status == 1 else "pending"}')
+        self._log('Sahara protocol completed')
+
+    def _hello(self, mode: int):
+        body = self._expect(SaharaClient.CMD_HELLO, 'HELLO', SaharaClient.HELLO_TIMEOUT)
+        version, version_compatible, _, device_mode = struct.unpack_from('<IIII', body)
+        self._log(f'Received HELLO packet, version {version}, compatible {version_compatible}, mode {device_mode}')
+        if version < SaharaClient.VERSION_COMPATIBLE:
+            raise SaharaError(f'sahara version {version} not supported')
+        self._send(SaharaClient.CMD_HELLO_RESP, SaharaClient.VERSION, SaharaClient.VERSION_COMPATIBLE,
+                   SaharaClient.STATUS_SUCCESS, mode, 0, 0, 0, 0, 0, 0)
+        self._log(f'Sent HELLO_RESP, mode {mode}')
+
+    def _exec(self, client_command: int) -> Union[bytes, None]:
+        self._send(SaharaClient.CMD_EXEC, client_command)
+        body = self._expect(SaharaClient.CMD_EXEC_RESP, 'CMD_EXEC_RESP')
+        _, length = struct.unpack_from('<II', body)
+        if length == 0:
+            self._log(f'Command 0x{client_command:x} not supported by device')
+            return None
+        self._send(SaharaClient.CMD_EXEC_DATA, client_command)
+        return self._read(length, f'data of command 0x{client_command:x}')
+
+    def _expect(self, command: int, name: str, timeout: float = PACKET_TIMEOUT) -> bytes:
+        received, body = self._read_packet(timeout, name)
+        if received == SaharaClient.CMD_END_IMAGE_TX and len(body) >= 8:
+            _, status = struct.unpack_from('<II', body)
+            raise SaharaError(f'device ended transfer while waiting for {name}, status 0x{status:x} (nak)')
+        if received != command:
+            raise SaharaError(f'unexpected packet 0x{received:x} while waiting for {name}')
+        return body
+
+    def _read_packet(self, timeout: float = PACKET_TIMEOUT, name: str = 'packet') -> Tuple[int, bytes]:
+        command, length = SaharaClient.HEADER.unpack(self._read(SaharaClient.HEADER.size, name, timeout))
+        if not SaharaClient.HEADER.size <= length <= SaharaClient.MAX_PACKET_SIZE:
+            raise SaharaError(f'invalid packet length {length} of command 0x{command:x}')
+        return command, self._read(length - SaharaClient.HEADER.size, name)
+
+    def _read(self, size: int, name: str, timeout: float = PACKET_TIMEOUT) -> bytes:
+        data = bytearray()
+        deadline = time.monotonic() + timeout
+        while len(data) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SaharaError(f'timeout while waiting for {name}')
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                continue
+            try:
+                chunk = os.read(self._fd, size - len(data))
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                raise SaharaError(f'read failed: {e}')
+            if not chunk:
+                raise SaharaError('read failed: port closed')
+            data += chunk
+        return bytes(data)
+
+    def _send(self, command: int, *fields: int):
+        self._write(struct.pack(f'<II{len(fields)}I', command, SaharaClient.HEADER.size + 4 * len(fields), *fields))
+
+    def _write(self, data: Union[bytes, memoryview]):
+        view = memoryview(data)
+        deadline = time.monotonic() + SaharaClient.PACKET_TIMEOUT
+        while len(view) > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SaharaError('timeout while writing to device')
+            _, writable, _ = select.select([], [self._fd], [], remaining)
+            if not writable:
+                continue
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                raise SaharaError(f'write failed: {e}')
+            view = view[written:]
+
+    @staticmethod
+    def is_supported() -> bool:
+        return termios is not None
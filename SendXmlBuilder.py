@@ -0,0 +1,314 @@
+import fnmatch
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Sequence, Set, Tuple, Union
+
+from ImageManifest import ImageManifest, ProgramEntry
+
+
+class XmlPass(object):
+    def name(self) -> str:
+        return ''
+
+    def on_rawprogram(self, xml: str, root: ElementTree.Element) -> bool:
+        # return True if modified
+        return False
+
+    def on_patch(self, xml: str, root: ElementTree.Element) -> bool:
+        # return True if modified
+        return False
+
+    def summary(self) -> Union[str, None]:
+        return None
+
+
+class PartitionFilterPass(XmlPass):
+    def __init__(self,
+                 manifest: ImageManifest,
+                 partitions: Union[Sequence[str], None] = None,
+                 skip_partitions: Union[Sequence[str], None] = None):
+        self._manifest = manifest
+        self._partitions = partitions
+        self._skip_partitions = skip_partitions or []
+        self._selected_files: Set[str] = set()
+        self._removed_count = 0
+
+    def name(self) -> str:
+        return 'partition filter'
+
+    def selects(self, label: str) -> bool:
+        if self._partitions is not None and not any(fnmatch.fnmatchcase(label, p) for p in self._partitions):
+            return False
+        return not any(fnmatch.fnmatchcase(label, p) for p in self._skip_partitions)
+
+    def unknown_patterns(self) -> List[str]:
+        labels = self._manifest.partitions()
+        return [pattern for pattern in [*(self._partitions or []), *self._skip_partitions]
+                if not any(fnmatch.fnmatchcase(label, pattern) for label in labels)]
+
+    def on_rawprogram(self, xml: str, root: ElementTree.Element) -> bool:
+        modified = False
+        for element in list(root):
+            label = element.get('label')
+            if label is None:
+                # unlabeled ranges (i.e. zeroout) only kept when nothing is explicitly selected
+                selected = self._partitions is None
+            else:
+                selected = self.selects(label)
+
+            if selected:
+                if element.tag == 'program' and element.get('filename'):
+                    self._selected_files.add(element.get('filename'))
+            else:
+                root.remove(element)
+                self._removed_count += 1
+                modified = True
+        return modified
+
+    def on_patch(self, xml: str, root: ElementTree.Element) -> bool:
+        # patches to files not programmed are useless, patches to DISK are always kept
+        modified = False
+        for element in list(root):
+            filename = element.get('filename', 'DISK')
+            if filename != 'DISK' and filename not in self._selected_files:
+                root.remove(element)
+                modified = True
+        return modified
+
+    def summary(self) -> Union[str, None]:
+        return f'{self._removed_count} entries filtered out'
+
+
+class SendXmlBuilder(object):
+    def __init__(self, manifest: ImageManifest):
+        self._manifest = manifest
+        self._passes: List[XmlPass] = []
+        self._output_dir: Union[str, None] = None
+        self._sendxml: List[str] = manifest.sendxml()
+        self._programs: List[ProgramEntry] = manifest.programs()
+
+    def add_pass(self, xml_pass: XmlPass):
+        self._passes.append(xml_pass)
+
+    def passes(self) -> List[XmlPass]:
+        return self._passes
+
+    def sendxml(self) -> List[str]:
+        # original file names or full path of generated files
+        return self._sendxml
+
+    def programs(self) -> List[ProgramEntry]:
+        # program entries really sent
+        return self._programs
+
+    def output_dir(self) -> Union[str, None]:
+        return self._output_dir
+
+    def build(self) -> Tuple[bool, str]:
+        if not self._passes:
+            return True, 'original xml'
+
+        self.clean()
+        self._output_dir = tempfile.mkdtemp(prefix='t29008_xml_')
+
+        # patches follow rawprograms, so passes see all programs before patches
+        rawprograms: List[str] = []
+        for xml in self._manifest.rawprograms():
+            rawprograms.extend(self._build_xml(xml, True))
+        if not rawprograms:
+            return False, 'nothing to download'
+
+        patches: List[str] = []
+        for xml in self._manifest.patches():
+            patches.extend(self._build_xml(xml, False))
+        self._sendxml = [*rawprograms, *patches]
+
+        self._programs = []
+        for xml in rawprograms:
+            path = xml if os.path.isabs(xml) else os.path.join(self._manifest.image_dir(), xml)
+            self._programs.extend(ImageManifest.parse_rawprogram(path, os.path.basename(xml), self._manifest.files()))
+
+        summaries = [f'{p.name()}: {p.summary()}' for p in self._passes if p.summary()]
+        return True, ', '.join(summaries) if summaries else 'no change'
+
+    def clean(self):
+        if self._output_dir is not None:
+            shutil.rmtree(self._output_dir, ignore_errors=True)
+            self._output_dir = None
+        self._sendxml = self._manifest.sendxml()
+        self._programs = self._manifest.programs()
+
+    def _build_xml(self, xml: str, is_rawprogram: bool) -> List[str]:
+        tree = ElementTree.parse(os.path.join(self._manifest.image_dir(), xml))
+        root = tree.getroot()
+
+        modified = False
+        for xml_pass in self._passes:
+            if is_rawprogram:
+                modified = xml_pass.on_rawprogram(xml, root) or modified
+            else:
+                modified = xml_pass.on_patch(xml, root) or modified
+
+        if not modified:
+            return [xml]
+        if len(root) == 0:
+            return []  # nothing left, skip the whole file
+
+        output = os.path.join(self._output_dir, xml)
+        tree.write(output, encoding='utf-8', xml_declaration=True)
+        return [output]
+
+
+class MergeRangesPass(XmlPass):
+    RANGE_TAGS = ('program', 'zeroout', 'erase')
+
+    def __init__(self, manifest: ImageManifest, erase_partitions: Sequence[Tuple[str, str]] = ()):
+        self._manifest = manifest
+        self._erase_partitions = list(erase_partitions)  # (lun, label) to erase by <erase> commands
+        self._erased_partitions: List[Tuple[str, str]] = []
+        self._command_count = 0
+        self._saved_count = 0
+
+    def name(self) -> str:
+        return 'merge'
+
+    def erased_partitions(self) -> List[Tuple[str, str]]:
+        return self._erased_partitions
+
+    def on_rawprogram(self, xml: str, root: ElementTree.Element) -> bool:
+        elements = list(root)
+        self._add_erase(xml, elements)
+        count = len(elements)
+
+        # reorder by physical sector only when it cannot change the result
+        if self.can_reorder(elements):
+            elements.sort(key=MergeRangesPass._sort_key)
+
+        merged: List[ElementTree.Element] = []
+        for element in elements:
+            if merged and MergeRangesPass._merge(merged[-1], element):
+                continue
+            merged.append(element)
+
+        self._command_count += len(merged)
+        self._saved_count += count - len(merged)
+        if merged == list(root):
+            return False
+
+        for element in list(root):
+            root.remove(element)
+        for element in merged:
+            root.append(element)
+        return True
+
+    def summary(self) -> Union[str, None]:
+        return f'{self._command_count} commands, {self._saved_count} saved'
+
+    def _add_erase(self, xml: str, elements: List[ElementTree.Element]):
+        for element in list(elements):
+            key = MergeRangesPass._partition_key(element)
+            if element.tag != 'program' or key not in self._erase_partitions or key in self._erased_partitions:
+                continue
+            if MergeRangesPass._start(element) is None or ImageManifest.parse_int(element.get('num_partition_sectors'), 0) <= 0:
+                continue
+
+            erase = ElementTree.Element('erase')
+            erase.tail = element.tail
+            for name in ('SECTOR_SIZE_IN_BYTES', 'label', 'num_partition_sectors', 'physical_partition_number', 'start_sector'):
+                erase.set(name, element.get(name, ''))
+            # whole partition even if an earlier pass split its program
+            for program in self._manifest.programs():
+                if program.xml() == os.path.basename(xml) and (program.lun(), program.label()) == key:
+                    erase.set('start_sector', program.start_sector())
+                    erase.set('num_partition_sectors', str(program.num_sectors()))
+                    break
+            # before anything written to the partition, the order is kept when they overlap
+            index = next(i for i, e in enumerate(elements) if MergeRangesPass._partition_key(e) == key)
+            elements.insert(index, erase)
+            self._erased_partitions.append(key)
+
+    @staticmethod
+    def _partition_key(element: ElementTree.Element) -> Tuple[str, str]:
+        return element.get('physical_partition_number', '0'), element.get('label', '')
+
+    def can_reorder(self, elements: List[ElementTree.Element]) -> bool:
+        ranges: Dict[str, List[Tuple[int, int]]] = dict()
+        for element in elements:
+            if element.tag not in MergeRangesPass.RANGE_TAGS:
+                return False  # unknown command, keep everything in place
+            start = MergeRangesPass._start(element)
+            if start is None:
+                continue  # symbolic sectors (i.e. backup GPT) are kept after numeric ones
+            if element.tag == 'program' and not element.get('filename'):
+                continue  # skipped by fh_loader
+            lun = element.get('physical_partition_number', '0')
+            ranges.setdefault(lun, []).append((start, start + self._extent(element)))
+
+        # any overlap means order matters
+        for lun_ranges in ranges.values():
+            lun_ranges.sort()
+            for (_, prev_end), (start, _) in zip(lun_ranges, lun_ranges[1:]):
+                if start < prev_end:
+                    return False
+        return True
+
+    def _extent(self, element: ElementTree.Element) -> int:
+        # sectors really written, program without size writes the whole file
+        sectors = MergeRangesPass._sectors(element)
+        if element.tag == 'program' and sectors <= 0:
+            sector_size = ImageManifest.parse_int(element.get('SECTOR_SIZE_IN_BYTES'), 512)
+            file_size = self._manifest.file_size(element.get('filename', ''))
+            sectors = (file_size + sector_size - 1) // sector_size
+        return sectors
+
+    @staticmethod
+    def _sort_key(element: ElementTree.Element) -> Tuple[int, int, int]:
+        # symbolic sectors and programs skipped by fh_loader go last
+        start = MergeRangesPass._start(element)
+        if start is None or (element.tag == 'program' and not element.get('filename')):
+            return 1, 0, 0
+        return 0, ImageManifest.parse_int(element.get('physical_partition_number'), 0), start
+
+    @staticmethod
+    def _merge(prev: ElementTree.Element, element: ElementTree.Element) -> bool:
+        # merge element into prev if contiguous on the same LUN
+        if prev.tag != element.tag or prev.tag not in MergeRangesPass.RANGE_TAGS:
+            return False
+        for name in ('physical_partition_number', 'SECTOR_SIZE_IN_BYTES'):
+            if prev.get(name, '') != element.get(name, ''):
+                return False
+
+        prev_start, start = MergeRangesPass._start(prev), MergeRangesPass._start(element)
+        if prev_start is None or start is None:
+            return False
+        prev_sectors = MergeRangesPass._sectors(prev)
+        if prev_start + prev_sectors != start:
+            return False
+
+        if prev.tag == 'program':
+            # only chunks of the same plain file, continuous in both file and disk
+            if not prev.get('filename') or prev.get('filename') != element.get('filename'):
+                return False
+            if prev.get('sparse', 'false').lower() == 'true' or element.get('sparse', 'false').lower() == 'true':
+                return False
+            prev_offset = ImageManifest.parse_int(prev.get('file_sector_offset'), 0)
+            if prev_offset + prev_sectors != ImageManifest.parse_int(element.get('file_sector_offset'), 0):
+                return False
+
+        sectors = prev_sectors + MergeRangesPass._sectors(element)
+        sector_size = ImageManifest.parse_int(prev.get('SECTOR_SIZE_IN_BYTES'), 512)
+        prev.set('num_partition_sectors', str(sectors))
+        if prev.get('size_in_KB') is not None:
+            prev.set('size_in_KB', f'{sectors * sector_size / 1024:.1f}')
+        return True
+
+    @staticmethod
+    def _start(element: ElementTree.Element) -> Union[int, None]:
+        start_sector = element.get('start_sector', '').strip()
+        return int(start_sector) if start_sector.isdigit() else None
+
+    @staticmethod
+    def _sectors(element: ElementTree.Element) -> int:
+        return ImageManifest.parse_int(element.get('num_partition_sectors'), 0)
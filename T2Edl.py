@@ -1,10 +1,31 @@
 import os.path
-from typing import Dict, Union
+import socket
+import tarfile
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
 
 from Application import Application
+from AsyncT2EdlTask import AsyncT2EdlTask
+from AsyncTaskEngine import AsyncTaskEngine
+from ControlServer import ControlServer
+from Coordinator import CoordinatorClient
+from DeviceRouter import DeviceRouter
+from DownloadScheduler import DownloadScheduler
+from EventBus import EventBus
+from EventDispatcher import EventDispatcher
+from HistoryDb import HistoryDb
+from ImageCache import ImageCache
+from ImageManifest import ImageManifest
+from ImageProfile import ImageProfile, ProfileConfig
+from ImageStager import ImageStager
+from Metrics import Histogram, Metrics
+from SendXmlBuilder import MergeRangesPass, PartitionFilterPass, SendXmlBuilder
 from T2EdlTask import T2EdlTask
 from Task import Task
-from UsbMonitor import UsbMonitor
+from TraceStore import TraceStore
+from UsbMonitor import BaseUsbMonitor, UsbDevice, UsbMonitor
+from ZeroBlockScanner import ZeroBlockScanner, ZeroOutPass
 
 
 class Watcher(object):
@@ -17,7 +38,10 @@ class Watcher(object):
     def on_update_message(self, message: str, color: str):
         pass
 
-    def on_start_progress(self, key: str):
+    def on_queue_progress(self, key: str, hub: Union[str, None]):
+        pass
+
+    def on_start_progress(self, key: str, hub: Union[str, None]):
         pass
 
     def on_stop_progress(self, key: str, success: bool, message: Union[str, None]):
@@ -26,11 +50,23 @@ class Watcher(object):
     def on_update_progress(self, key: str, cur_progress: int, max_progress: Union[int, None]):
         pass
 
+    def on_update_throughput(self, key: str, speed: float, average_speed: float, eta: Union[float, None]):
+        pass
+
+    def on_update_phase(self, key: str, phase: str):
+        pass
+
+    def on_update_traces(self, key: str, trace_dir: str, trace_files: List[str]):
+        pass
+
 
 class T2Edl(object):
     STATE_IDLE = 0
     STATE_STARTED = 1
 
+    ENGINE_THREAD = 'thread'  # one thread per device
+    ENGINE_ASYNCIO = 'asyncio'  # all devices in one event loop
+    ENGINES = (ENGINE_THREAD, ENGINE_ASYNCIO)
 
     def __init__(self,
                  image_dir: str,
@@ -42,7 +78,31 @@ class T2Edl(object):
                  signed_digests: Union[str, None] = None,
                  chained_digests: Union[str, None] = None,
                  disable_zeroout: bool = False,
-                 disable_erase: bool = False):
+                 disable_erase: bool = False,
+                 max_parallel: int = 0,
+                 max_parallel_per_hub: int = 0,
+                 stage_mode: str = ImageStager.MODE_NONE,
+                 image_cache_size: int = ImageCache.DEFAULT_MAX_SIZE,
+                 partitions: Union[Sequence[str], None] = None,
+                 skip_partitions: Union[Sequence[str], None] = None,
+                 zeroout_scan: bool = False,
+                 optimize_xml: bool = False,
+                 engine: str = ENGINE_THREAD,
+                 trace_compression: str = TraceStore.COMPRESSION_GZIP,
+                 trace_max_age: float = 0,
+                 trace_max_size: int = 0,
+                 ui_rate: float = EventBus.DEFAULT_RATE,
+                 metrics_port: int = 0,
+                 monitor: Union[BaseUsbMonitor, None] = None,
+                 history_db: Union[str, None] = None,
+                 station: Union[str, None] = None,
+                 retries: int = 0,
+                 retry_backoff: float = T2EdlTask.RETRY_BACKOFF,
+                 control_socket: Union[str, None] = None,
+                 routes: Union[str, None] = None,
+                 coordinator: Union[str, None] = None,
+                 coordinator_fallback: int = 0,
+                 sahara: str = T2EdlTask.SAHARA_TOOL):
         self._image_dir = image_dir
         self._reboot_on_success = reboot_on_success
         self._trace_dir = trace_dir
@@ -53,6 +113,40 @@ class T2Edl(object):
         self._chained_digests = chained_digests
         self._disable_zeroout = disable_zeroout
         self._disable_erase = disable_erase
+        self._max_parallel = max_parallel
+        self._max_parallel_per_hub = max_parallel_per_hub
+        self._stage_mode = stage_mode
+        self._image_cache_size = image_cache_size
+        self._partitions = partitions
+        self._skip_partitions = skip_partitions
+        self._zeroout_scan = zeroout_scan
+        self._optimize_xml = optimize_xml
+        self._engine = engine
+        self._trace_compression = trace_compression
+        self._trace_max_age = trace_max_age
+        self._trace_max_size = trace_max_size
+        self._metrics_port = metrics_port
+        self._station = station or socket.gethostname()
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._sahara = sahara
+
+        # image sets by profile name, devices are routed to one of them by usb path, serial or hw id.
+        # a profile is replaced as a whole when switched.
+        self._routes = routes
+        self._router: Union[DeviceRouter, None] = None
+        self._profiles: Dict[str, ImageProfile] = dict()
+        self._pending_image_dirs: Dict[str, str] = dict()
+        self._task_profiles: Dict[str, ImageProfile] = dict()
+        self._trace_store: Union[TraceStore, None] = None
+        self._history_db = HistoryDb(history_db) if history_db else None
+
+        # lot wide quota and stats shared with other stations
+        self._coordinator = CoordinatorClient(coordinator, self._station, fallback=coordinator_fallback) \
+            if coordinator else None
+        if self._coordinator is not None:
+            self._coordinator.set_state_listener(self.on_coordinator_state_changed)
+            self._coordinator.set_slot_listener(lambda: self._event_dispatcher.post(self.on_slot_available))
 
         self._started_task_count = 0
 
@@ -60,46 +154,397 @@ class T2Edl(object):
 
         self._stopped = True
         self._running_tasks: Dict[str, Task] = dict()
+        self._hubs: Dict[str, Union[str, None]] = dict()
+        self._arrival_times: Dict[str, float] = dict()
+        self._usb_paths: Dict[str, Union[str, None]] = dict()
+        self._slot_waiting: Dict[str, Tuple[UsbDevice, float]] = dict()  # in arrival order, with arrival time
+
+        self._scheduler = DownloadScheduler(max_parallel, max_parallel_per_hub)
+        self._scheduler.set_start_listener(lambda key, task: self.on_task_scheduled(key, task))
+
+        # monitor events are handled by the event dispatcher to keep the monitor loop responsive,
+        # waiting for removed tasks is done by the cleanup dispatcher to keep arrivals responsive.
+        self._event_dispatcher = EventDispatcher('t29008-event')
+        self._cleanup_dispatcher = EventDispatcher('t29008-cleanup')
+        # next image set is prepared without blocking arrivals
+        self._profile_dispatcher = EventDispatcher('t29008-profile')
+
+        # local control, only in daemon mode
+        self._control_server = ControlServer(control_socket, self.on_control_request) if control_socket else None
+        # metrics, served only if metrics port is set
+        self._metrics = Metrics()
+        self._metric_devices = self._metrics.counter('t29008_devices_total', 'Finished downloads by result.')
+        self._metric_failures = self._metrics.counter('t29008_failures_total', 'Failed downloads by reason.')
+        self._metric_bytes = self._metrics.counter('t29008_transferred_bytes_total', 'Bytes sent to devices.')
+        self._metric_retries = self._metrics.counter('t29008_retries_total', 'Retried download attempts.')
+        self._metric_queued_time = self._metrics.histogram('t29008_queued_seconds', 'Time from device arrival to download start.')
+        self._metric_download_time = self._metrics.histogram('t29008_download_seconds', 'Time from download start to end.')
+        self._metric_phase_time = self._metrics.histogram('t29008_phase_seconds', 'Time spent in each download phase.')
+        self._metric_file_time = self._metrics.histogram('t29008_file_seconds', 'Transfer time of each image file.')
+        self._metric_file_speed = self._metrics.histogram('t29008_file_bytes_per_second', 'Transfer speed of each image file.',
+                                                          Histogram.SPEED_BUCKETS)
+        self._metrics.gauge('t29008_devices_per_hour', 'Finished downloads per hour since started.',
+                            lambda: self._scheduler.stats().devices_per_hour())
+        self._metrics.gauge('t29008_bytes_per_second', 'Bytes sent per second since started.',
+                            lambda: self._scheduler.stats().bytes_per_second())
+        self._metrics.gauge('t29008_running_downloads', 'Downloads in progress.', lambda: self._scheduler.running_count())
+        self._metrics.gauge('t29008_queued_downloads', 'Devices waiting for a download slot.', lambda: self._scheduler.queued_count())
+
+        # watcher is called by one thread only, progress is coalesced and rate limited
+        self._event_bus = EventBus('t29008-ui', ui_rate)
+        self._async_engine = AsyncTaskEngine() if engine == T2Edl.ENGINE_ASYNCIO else None
+
+        self._monitor = monitor if monitor is not None else UsbMonitor()
+        self._monitor.set_arrival_listener(lambda device: self._event_dispatcher.post(lambda: self.on_arrival(device)))
+        self._monitor.set_removed_listener(lambda device: self._event_dispatcher.post(lambda: self.on_removed(device)))
+
+    def verify_vip(self, profile: ImageProfile) -> bool:
+        manifest = profile.manifest()
+        config = profile.config()
+        signed_digests = config.signed_digests()
+        chained_digests = config.chained_digests()
 
-        self._monitor = UsbMonitor()
-        self._monitor.set_arrival_listener(lambda port: self.on_arrival(port))
-        self._monitor.set_removed_listener(lambda port: self.on_removed(port))
-
-    def verify_vip(self) -> bool:
         # check vip
-        if self._is_vip is None:
+        if config.is_vip() is None:
             # auto find signed digests and chained digests if not set
-            self._signed_digests = T2EdlTask.param_signeddigests(self._image_dir, self._signed_digests)
-            self._chained_digests = T2EdlTask.param_chaineddigests(self._image_dir, self._chained_digests)
+            signed_digests = T2EdlTask.param_signeddigests(manifest, signed_digests)
+            chained_digests = T2EdlTask.param_chaineddigests(manifest, chained_digests)
 
             # enable vip if both signed digests and chained digests files are exists
-            self._is_vip = self._signed_digests is not None and self._chained_digests is not None
-        elif self._is_vip:
+            is_vip = signed_digests is not None and chained_digests is not None
+        elif config.is_vip():
             # auto find signed digests and chained digests if not set
-            self._signed_digests = T2EdlTask.param_signeddigests(self._image_dir, self._signed_digests)
-            self._chained_digests = T2EdlTask.param_chaineddigests(self._image_dir, self._chained_digests)
+            signed_digests = T2EdlTask.param_signeddigests(manifest, signed_digests)
+            chained_digests = T2EdlTask.param_chaineddigests(manifest, chained_digests)
+            is_vip = True
 
-            if self._signed_digests is None:
+            if signed_digests is None:
                 self.notify_error_message('signeddigests file not exists!!')
                 return False
-            if self._chained_digests is None:
+            if chained_digests is None:
                 self.notify_error_message('chaineddigests file not exists!!')
                 return False
-        else: # self._is_vip == False
-            self._signed_digests = None
-            self._chained_digests = None
+        else: # config.is_vip() == False
+            is_vip = False
+            signed_digests = None
+            chained_digests = None
+        profile.set_vip(is_vip, signed_digests, chained_digests)
 
         # show vip status
-        if self._is_vip:
-            self.notify_warning_message('VIP: ON')
+        prefix = '' if config.name() == ProfileConfig.DEFAULT_NAME else f'[{config.name()}] '
+        if is_vip:
+            self.notify_warning_message(f'{prefix}VIP: ON')
         else:
-            self.notify_info_message('VIP: OFF')
+            self.notify_info_message(f'{prefix}VIP: OFF')
+
+        return True
+
+    def decompress_images(self, profile: ImageProfile) -> bool:
+        if not ImageCache.needs_decompress(profile.image_dir()):
+            return True
+
+        # progress is only visible after started, show decompressing as messages
+        cache = ImageCache(Application.get().cache_dir(), self._image_cache_size)
+        last_percent = -1
+
+        def on_progress(done: int, total: int):
+            nonlocal last_percent
+            percent = done * 100 // total if total > 0 else 100
+            if percent // 10 != last_percent // 10:
+                last_percent = percent
+                self.notify_info_message(f'Decompressing images... {percent}%')
+
+        cache.set_progress_listener(on_progress)
+        try:
+            result, msg = cache.prepare(profile.image_dir())
+        except (OSError, EOFError, tarfile.TarError) as e:
+            result, msg = False, f'{e}'
+        if not result:
+            self.notify_error_message(f'Failed to decompress images: {msg}')
+            return False
+
+        self.notify_info_message(f'Images {msg}')
+        profile.set_cache(cache)
+        profile.set_image_dir(cache.image_dir())
+        return True
 
+    def load_manifest(self, profile: ImageProfile) -> bool:
+        try:
+            manifest = ImageManifest.load(profile.image_dir(), Application.get().cache_dir())
+        except OSError as e:
+            self.notify_error_message(f'Failed to scan image dir: {e}')
+            return False
+
+        if not manifest.rawprograms():
+            self.notify_error_message(f'No rawprogram xml found in: {profile.image_dir()}')
+            return False
+
+        profile.set_manifest(manifest)
+        self.notify_info_message(f'Images: {len(manifest.file_list())} files, '
+                                 f'{len(manifest.partitions())} partitions, '
+                                 f'{manifest.total_bytes() / 1024 / 1024:.1f} MB to download')
         return True
 
+    def build_sendxml(self, profile: ImageProfile) -> bool:
+        manifest = profile.manifest()
+        sendxml_builder = SendXmlBuilder(manifest)
+        profile.set_sendxml_builder(sendxml_builder)
+
+        # partition filter
+        if self._partitions is not None or self._skip_partitions:
+            if profile.is_vip():
+                # signed digests only match the original xml
+                self.notify_error_message('Partition filter is not supported by VIP download!!')
+                return False
+
+            partition_filter = PartitionFilterPass(manifest, self._partitions, self._skip_partitions)
+            unknown_patterns = partition_filter.unknown_patterns()
+            if unknown_patterns:
+                self.notify_error_message(f'Unknown partitions: {",".join(unknown_patterns)}')
+                return False
+            sendxml_builder.add_pass(partition_filter)
+            profile.set_erase_partitions([p for p in T2EdlTask.ERASE_PARTITIONS if partition_filter.selects(p)])
+
+        # zero blocks to <zeroout>
+        if self._zeroout_scan:
+            if profile.is_vip() or self._disable_zeroout:
+                self.notify_error_message('Zeroout scan requires <zeroout> support and is not supported by VIP download!!')
+                return False
+
+            self.notify_info_message('Scanning images for zero blocks...')
+            zeroout = ZeroOutPass(manifest, ZeroBlockScanner(Application.get().cache_dir()))
+            try:
+                zeroout.scan()
+            except OSError as e:
+                self.notify_error_message(f'Failed to scan images: {e}')
+                return False
+            sendxml_builder.add_pass(zeroout)
+
+        # merge ranges, always the last pass
+        merge: Union[MergeRangesPass, None] = None
+        if self._optimize_xml:
+            if profile.is_vip():
+                self.notify_error_message('Xml optimization is not supported by VIP download!!')
+                return False
+
+            erase_partitions = [] if self._disable_erase else [(T2EdlTask.ERASE_LUN, p) for p in profile.erase_partitions()]
+            merge = MergeRangesPass(manifest, erase_partitions)
+            sendxml_builder.add_pass(merge)
+
+        if not sendxml_builder.passes():
+            return True  # send original xml
+
+        try:
+            result, msg = sendxml_builder.build()
+        except (OSError, ElementTree.ParseError) as e:
+            result, msg = False, f'{e}'
+        if not result:
+            self.notify_error_message(f'Failed to generate xml: {msg}')
+            return False
+
+        # partitions erased by generated <erase> commands
+        if merge is not None:
+            profile.set_erase_partitions([p for p in profile.erase_partitions()
+                                          if (T2EdlTask.ERASE_LUN, p) not in merge.erased_partitions()])
+
+        total_bytes = sum(program.transfer_bytes() for program in sendxml_builder.programs())
+        self.notify_info_message(f'Generated xml: {msg}, {total_bytes / 1024 / 1024:.1f} MB to download')
+        return True
+
+    def stage_images(self, profile: ImageProfile) -> bool:
+        if self._stage_mode == ImageStager.MODE_NONE:
+            return True
+
+        key = f'staging ({self._stage_mode})' if profile.name() == ProfileConfig.DEFAULT_NAME \
+            else f'staging {profile.name()} ({self._stage_mode})'
+        stager = ImageStager(profile.manifest(), self._stage_mode)
+        profile.set_stager(stager)
+        stager.set_progress_listener(lambda done, total: self.notify_update_progress(key, done, total))
+        self.notify_start_progress(key)
+        try:
+            result, msg = stager.stage()
+        except OSError as e:
+            result, msg = False, f'{e}'
+        self.notify_stop_progress(key, result, msg)
+        if not result:
+            stager.clean()
+            return False
+
+        # download from staged dir
+        staged_dir = stager.staged_dir()
+        if staged_dir is not None:
+            profile.set_manifest(ImageManifest.load(staged_dir))
+            profile.set_image_dir(staged_dir)
+        return True
+
+    def default_config(self, image_dir: str) -> ProfileConfig:
+        return ProfileConfig(ProfileConfig.DEFAULT_NAME, image_dir, self._prog, self._is_vip, self._signed_digests,
+                             self._chained_digests)
+
+    def load_router(self) -> bool:
+        try:
+            self._router = DeviceRouter.load(self._routes)
+        except (OSError, ValueError) as e:
+            self.notify_error_message(f'Failed to load routes {self._routes}: {e}')
+            return False
+        self.notify_info_message(f'Routes: {len(self._router.rules())} rules to '
+                                 f'{len(self._router.profiles())} profiles, others to default')
+        return True
+
+    def prepare_profile(self, config: ProfileConfig) -> Union[ImageProfile, None]:
+        # all steps before staging, failures are shown as messages
+        if not os.path.exists(config.image_dir()):
+            self.notify_error_message(f'Image path not exists: {config.image_dir()}')
+            return None
+
+        # routed profiles use prog of command line if not set
+        config = ProfileConfig(config.name(), os.path.realpath(config.image_dir()), config.prog() or self._prog,
+                               config.is_vip(), config.signed_digests(), config.chained_digests())
+        if config.name() != ProfileConfig.DEFAULT_NAME:
+            self.notify_info_message(f'Profile {config.name()}: {config.image_dir()}')
+        profile = ImageProfile(config)
+        if not self.decompress_images(profile) \
+                or not self.load_manifest(profile) \
+                or not self.verify_vip(profile) \
+                or not self.build_sendxml(profile):
+            profile.clean()
+            return None
+        return profile
+
+    def switch_image(self, image_dir: str, name: str = ProfileConfig.DEFAULT_NAME) -> Tuple[bool, str]:
+        # new image set is prepared in background, used by devices arriving after it is ready
+        if self._stopped:
+            return False, 'not started'
+        profile = self._profiles.get(name)
+        if profile is None:
+            return False, f'unknown profile: {name}'
+        config = profile.config().with_image_dir(image_dir)
+        self._profile_dispatcher.post(lambda: self._prepare_next_profile(config))
+        return True, f'preparing {image_dir} for profile {name}'
+
+    def _prepare_next_profile(self, config: ProfileConfig):
+        if self._stopped:
+            return  # stopping, no more devices to use it
+
+        self.notify_info_message(f'Preparing image set: {config.image_dir()}')
+        self._pending_image_dirs[config.name()] = config.image_dir()
+        profile = self.prepare_profile(config)
+        if profile is not None and not self.stage_images(profile):
+            profile.clean()
+            profile = None
+        del self._pending_image_dirs[config.name()]
+        if profile is None:
+            self.notify_error_message(f'Image set not switched: {config.image_dir()}')
+            return
+
+        # switched on the event dispatcher, between two arrivals
+        self._event_dispatcher.post(lambda: self.set_profile(profile))
+
+    def set_profile(self, profile: ImageProfile):
+        # running tasks keep the profile they started with
+        previous = self._profiles.get(profile.name())
+        self._profiles[profile.name()] = profile
+        if profile.name() == ProfileConfig.DEFAULT_NAME:
+            self._image_dir = profile.source_dir()
+        if previous is not None:
+            previous.retire()
+        self.notify_info_message(f'Image set of {profile.name()} switched: {profile.image_dir()}, '
+                                 f'build {profile.build()[:12]}')
+
+    def resolve_profile(self, key: str, usb_path: Union[str, None], serial: Union[str, None],
+                        hw_id: Union[str, None]) -> Tuple[ImageManifest, Dict[str, Any]]:
+        # called by task after serial and hw id are read, before the programmer is uploaded
+        name = self._router.route(usb_path, serial, hw_id)
+        profile = self._profiles[name]
+        profile.acquire()
+        self._task_profiles[key] = profile
+        self.notify_info_message(f'[{key}] serial {serial or "-"}, hw id {hw_id or "-"}: {name}')
+        return profile.manifest(), profile.task_params()
+
+    def pause(self):
+        # arriving devices are queued until resumed
+        self._scheduler.pause()
+        self.notify_warning_message('Paused, arriving devices are queued.')
+
+    def resume(self):
+        self._scheduler.resume()
+        self.notify_info_message('Resumed.')
+
+    def set_max_parallel(self, max_parallel: int, max_parallel_per_hub: int):
+        self._max_parallel = max_parallel
+        self._max_parallel_per_hub = max_parallel_per_hub
+        self._scheduler.set_max_parallel(max_parallel, max_parallel_per_hub)
+        self.notify_info_message(f'Max parallel downloads: {max_parallel or "no limit"}, '
+                                 f'per hub: {max_parallel_per_hub or "no limit"}')
+
+    def status(self) -> Dict[str, Any]:
+        devices = []
+        for key, task in list(self._running_tasks.items()):
+            if task.check_state(Task.STATE_SUCCESS):
+                state = 'success'
+            elif task.check_state(Task.STATE_ERROR):
+                state = 'error'
+            elif task.check_state(Task.STATE_RUNNING):
+                state = 'running'
+            else:
+                state = 'queued'
+            profile = self._task_profiles.get(key)
+            devices.append({'port': key, 'hub': self._hubs.get(key), 'state': state, 'phase': task.phase(),
+                            'profile': profile.name() if profile else None,
+                            'serial': task.serial(), 'done_bytes': task.meter().done_bytes(),
+                            'total_bytes': task.meter().total_bytes()})
+        return {
+            'stopped': self._stopped,
+            'paused': self._scheduler.paused(),
+            'profiles': [{'name': name, 'image_dir': profile.source_dir(), 'build': profile.build(),
+                          'vip': profile.is_vip(), 'pending_image_dir': self._pending_image_dirs.get(name)}
+                         for name, profile in list(self._profiles.items())],
+            'max_parallel': self._max_parallel,
+            'max_parallel_per_hub': self._max_parallel_per_hub,
+            'running': self._scheduler.running_count(),
+            'queued': self._scheduler.queued_count(),
+            'summary': self._scheduler.stats().summary(),
+            'coordinator': {'url': self._coordinator.url(), 'online': self._coordinator.online(),
+                            'exhausted': self._coordinator.exhausted()} if self._coordinator is not None else None,
+            'devices': devices,
+        }
+
+    def on_control_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # called by control server threads
+        command = request.get('command')
+        if command == ControlServer.COMMAND_STATUS:
+            return {'ok': True, 'status': self.status()}
+        elif command == ControlServer.COMMAND_PAUSE:
+            self.pause()
+            return {'ok': True, 'message': 'paused'}
+        elif command == ControlServer.COMMAND_RESUME:
+            self.resume()
+            return {'ok': True, 'message': 'resumed'}
+        elif command == ControlServer.COMMAND_IMAGE:
+            image_dir = request.get('image_dir')
+            if not isinstance(image_dir, str) or not image_dir:
+                return {'ok': False, 'message': 'image_dir not provided'}
+            name = request.get('profile', ProfileConfig.DEFAULT_NAME)
+            if not isinstance(name, str):
+                return {'ok': False, 'message': 'profile should be a string'}
+            result, msg = self.switch_image(image_dir, name)
+            return {'ok': result, 'message': msg}
+        elif command == ControlServer.COMMAND_PARALLEL:
+            max_parallel = request.get('max_parallel', self._max_parallel)
+            max_parallel_per_hub = request.get('max_parallel_per_hub', self._max_parallel_per_hub)
+            if not isinstance(max_parallel, int) or not isinstance(max_parallel_per_hub, int) \
+                    or max_parallel < 0 or max_parallel_per_hub < 0:
+                return {'ok': False, 'message': 'max parallel should be a non negative integer'}
+            self.set_max_parallel(max_parallel, max_parallel_per_hub)
+            return {'ok': True, 'message': f'max parallel {max_parallel}, per hub {max_parallel_per_hub}'}
+        elif command == ControlServer.COMMAND_STOP:
+            self.stop()
+            return {'ok': True, 'message': 'stopping after all downloading finished'}
+        return {'ok': False, 'message': f'unknown command: {command}'}
+
     def on_task_state_updated(self,
                               key: str,
-                              task: Task,
+                              task: T2EdlTask,
                               state: int,
                               cur_progress: int,
                               max_progress: int,
@@ -112,10 +557,105 @@ class T2Edl(object):
             if message:
                 self.notify_message(f'[red][{key}] {message}')
             self.notify_update_progress(key, cur_progress, max_progress)
+            meter = task.meter()
+            if meter.total_bytes() > 0:
+                self.notify_update_throughput(key, meter.speed(), meter.average_speed(), meter.eta())
         elif state == Task.STATE_SUCCESS:
+            self.record_metrics(key, task, True, message)
+            self.record_history(key, task, True, message)
+            self.store_trace(key, task, True, message)
             self.notify_stop_progress(key, True, message)
+            self._scheduler.on_finished(key, True, task.meter().done_bytes())
+            self.release_profile(key)
         elif state == Task.STATE_ERROR:
+            self.record_metrics(key, task, False, message)
+            self.record_history(key, task, False, message)
+            self.store_trace(key, task, False, message)
             self.notify_stop_progress(key, False, message)
+            self._scheduler.on_finished(key, False, task.meter().done_bytes())
+            self.release_profile(key)
+
+    def record_metrics(self, key: str, task: T2EdlTask, success: bool, message: Union[str, None]):
+        self._metric_devices.inc(result='success' if success else 'error')
+        if not success:
+            self._metric_failures.inc(reason=T2Edl.failure_reason(task, message))
+        self._metric_bytes.inc(task.meter().done_bytes())
+        if task.attempts() > 1:
+            self._metric_retries.inc(task.attempts() - 1)
+
+        durations = task.phase_durations()
+        for phase, duration in durations:
+            self._metric_phase_time.observe(duration, phase=phase)
+        if durations:
+            self._metric_download_time.observe(sum(duration for _, duration in durations),
+                                               result='success' if success else 'error')
+        for filename, transfer_bytes, duration in task.file_times():
+            self._metric_file_time.observe(duration, file=filename)
+            if duration > 0:
+                self._metric_file_speed.observe(transfer_bytes / duration, file=filename)
+
+    def record_history(self, key: str, task: T2EdlTask, success: bool, message: Union[str, None]):
+        if self._history_db is None and self._coordinator is None:
+            return
+
+        durations = task.phase_durations()
+        duration = sum(d for _, d in durations)
+        profile = self._task_profiles.get(key)
+        record = {
+            'station': self._station,
+            'port': task.port(),
+            'usb_path': self._usb_paths.get(key),
+            'hub': self._hubs.get(key),
+            'serial': task.serial(),
+            'build': profile.build() if profile else None,
+            'image_dir': profile.source_dir() if profile else None,
+            'engine': self._engine,
+            'started_at': time.time() - duration,
+            'duration': duration,
+            'bytes': task.meter().done_bytes(),
+            'result': 'success' if success else 'error',
+            'error_class': None if success else T2Edl.failure_reason(task, message),
+            'message': message,
+            'phases': T2Edl.sum_phases(durations),
+        }
+        if self._history_db is not None:
+            self._history_db.add(record)
+        if self._coordinator is not None:
+            self._coordinator.report_finish(record)
+
+    def on_coordinator_state_changed(self, online: bool, message: str):
+        # called by coordinator client thread
+        if online:
+            self.notify_info_message(f'Coordinator connected: {self._coordinator.url()}')
+        else:
+            self.notify_warning_message(f'Coordinator unreachable, continue on local lease: {message}')
+
+    @staticmethod
+    def sum_phases(durations: List[Tuple[str, float]]) -> Dict[str, float]:
+        # phases of retried attempts are entered again
+        phases: Dict[str, float] = dict()
+        for phase, duration in durations:
+            phases[phase] = phases.get(phase, 0.0) + duration
+        return phases
+
+    @staticmethod
+    def failure_reason(task: T2EdlTask, message: Union[str, None]) -> str:
+        # classified from tool output, or phase where it failed
+        phase = task.phase() or 'start'
+        if message and 'cancelled' in message:
+            return 'cancelled'
+        if task.failure_class() is not None:
+            return task.failure_class()
+        if message and 'timeout' in message:
+            return f'{phase} timeout'
+        return phase
+
+    def store_trace(self, key: str, task: T2EdlTask, success: bool, message: Union[str, None]):
+        if self._trace_store is None or task.trace_timestamp() is None:
+            return  # failed before any trace written
+        # queried by port name, the device key changes with every enumeration
+        self._trace_store.add(task.port(), self._usb_paths.get(key), task.trace_timestamp(), success, task.serial(),
+                              message, task.trace_files(), lambda files: self.notify_update_traces(key, files))
 
     def start(self):
         if not self._stopped:
@@ -130,11 +670,6 @@ class T2Edl(object):
         self.notify_warning_message(f'    4. Ctrl + C to stop. t29008 will exit after all downloading finished.')
         self.notify_warning_message(f'-------------------------------------------------------------------------')
 
-        # verify parameter
-        if not os.path.exists(self._image_dir):
-            self.notify_error_message(f'Image path not exists: {self._image_dir}')
-            return  # failed
-
         # get real path
         self._image_dir = os.path.realpath(self._image_dir)
         self._trace_dir = os.path.realpath(self._trace_dir)
@@ -142,21 +677,91 @@ class T2Edl(object):
         # print path
         self.notify_info_message(f'Image Path: {self._image_dir}')
         self.notify_info_message(f'trace Dir: {self._trace_dir}')
-
-        # verify VIP
-        if not self.verify_vip():
+        if self._max_parallel > 0:
+            self.notify_info_message(f'Max parallel downloads: {self._max_parallel}')
+        if self._max_parallel_per_hub > 0:
+            self.notify_info_message(f'Max parallel downloads per hub: {self._max_parallel_per_hub}')
+        if self._async_engine is not None:
+            self.notify_info_message(f'Task engine: {self._engine}')
+        if self._sahara != T2EdlTask.SAHARA_TOOL:
+            self.notify_info_message(f'Sahara: {self._sahara}')
+
+        # trace storage
+        if not TraceStore.is_compression_supported(self._trace_compression):
+            self.notify_error_message(f'Trace compression {self._trace_compression} requires "pip install zstandard"')
             self._stopped = True
             return  # failed
+        self._trace_store = TraceStore(self._trace_dir, self._trace_compression, self._trace_max_age, self._trace_max_size)
+
+        # routes of devices to image sets
+        configs = [self.default_config(self._image_dir)]
+        if self._routes is not None:
+            if not self.load_router():
+                self._stopped = True
+                return  # failed
+            configs.extend(self._router.profiles().values())
+
+        # decompress, scan image dir, verify VIP and generate xml once for all tasks of each profile
+        profiles: List[ImageProfile] = []
+        for config in configs:
+            profile = self.prepare_profile(config) if not self._stopped else None  # ctrl + c while preparing
+            if profile is None:
+                for prepared in profiles:
+                    prepared.clean()
+                self._stopped = True
+                return  # failed
+            profiles.append(profile)
 
         # show starting
+        self._event_bus.start()
         self.notify_started()
+
+        # stage images before any downloading, nothing is started yet if stopped meanwhile
+        if not all(not self._stopped and self.stage_images(profile) for profile in profiles) or self._stopped:
+            for profile in profiles:
+                profile.clean()
+            self._stopped = True
+            self.notify_stopped()
+            self._event_bus.stop()
+            return  # failed
+        for profile in profiles:
+            self._profiles[profile.name()] = profile
+
         self.notify_info_message('Start downloading...')
 
-        # start UsbMonitor
-        self._monitor.start()
+        # start dispatchers
+        self._event_dispatcher.start()
+        self._cleanup_dispatcher.start()
+        self._profile_dispatcher.start()
+        self._trace_store.start()
+        if self._history_db is not None:
+            self.notify_info_message(f'History: {self._history_db.path()}')
+            self._history_db.start()
+        if self._coordinator is not None:
+            self.notify_info_message(f'Coordinator: {self._coordinator.url()}')
+            self._coordinator.start()
+        if self._metrics_port > 0:
+            try:
+                self._metrics.start_server(self._metrics_port)
+                self.notify_info_message(f'Metrics: http://localhost:{self._metrics_port}/metrics')
+            except OSError as e:
+                self.notify_error_message(f'Failed to start metrics server: {e}')
+        if self._async_engine is not None:
+            self._async_engine.start()
+        if self._control_server is not None:
+            try:
+                self._control_server.start()
+                self.notify_info_message(f'Control: {self._control_server.path()}')
+            except OSError as e:
+                self.notify_error_message(f'Failed to start control server: {e}')
+
+        # start UsbMonitor, blocked until stopped. stopping before it started does not unblock it
+        if not self._stopped:
+            self._monitor.start()
 
         # stop
         self.stop()
+        self.wait_for_finished()
 
     def stop(self):
         if self._stopped:
@@ -165,61 +770,215 @@ class T2Edl(object):
         self._stopped = True
         self._monitor.stop()
         self.notify_info_message('Application will stop after all downloading finished!!')
+
+    def wait_for_finished(self):
+        if self._control_server is not None:
+            self._control_server.stop()
+
+        # no more monitor events after event dispatcher stopped, a prepared image set may still be switched in
+        self._profile_dispatcher.stop()
+        self._event_dispatcher.stop()
+        self.drop_slot_waiting()
+
+        # queued devices are still downloaded, even if paused
+        self._scheduler.resume()
+        self._scheduler.wait_for_idle()
         for task in self._running_tasks.values():
             #task.wait_for_state(Task.STATE_SUCCESS | Task.STATE_ERROR)
             task.wait_for_finished()
+        self._running_tasks.clear()
+        self._task_profiles.clear()
+        self._hubs.clear()
+        self._usb_paths.clear()
+        self._arrival_times.clear()
+
+        self._cleanup_dispatcher.stop()
+        if self._async_engine is not None:
+            self._async_engine.stop()
+        self._trace_store.stop()
+        if self._history_db is not None:
+            self._history_db.stop()
+        if self._coordinator is not None:
+            self._coordinator.stop()
+        self._metrics.stop_server()
+        for profile in self._profiles.values():
+            profile.clean()
+        self._profiles.clear()
+        self.notify_info_message(f'Throughput: {self._scheduler.stats().summary()}')
         self.notify_stopped()
+        self._event_bus.stop()
 
-    def on_arrival(self, port: str):
-        if port in self._running_tasks:
-            self.notify_warning_message(f'[{port}] arrived while already started downloading.')
+    def on_arrival(self, device: UsbDevice):
+        # tasks are keyed by device identity, a port name reused by a new device does not wait for the old task
+        key = device.key()
+
+        if self._stopped:
+            self.notify_warning_message(f'[{key}] arrived after stopped, ignored.')
+            return  # stopped
+
+        if key in self._running_tasks:
+            self.notify_warning_message(f'[{key}] arrived while already started downloading.')
             return # already started
 
-        self.notify_start_progress(port)
-        task = T2EdlTask(port,
-                         self._image_dir,
-                         self._trace_dir,
-                         reboot_on_success=self._reboot_on_success,
-                         prog=self._prog,
-                         is_vip=self._is_vip,
-                         signed_digests=self._signed_digests,
-                         chained_digests=self._chained_digests,
-                         disable_zeroout=self._disable_zeroout,
-                         disable_erase=self._disable_erase)
-        self._running_tasks[port] = task
+        if key in self._slot_waiting:
+            self.notify_warning_message(f'[{key}] arrived while already waiting for a download slot.')
+            return  # already queued
+
+        # slots of the lot quota are leased from coordinator in background, devices wait for them in arrival order
+        if self._coordinator is not None and (self._slot_waiting or not self.take_slot(key)):
+            if not self._stopped:
+                location = device.location()
+                self._slot_waiting[key] = (device, time.monotonic())
+                self.notify_warning_message(f'[{key}] waiting for a download slot from coordinator, queued.')
+                self.notify_queue_progress(key, location.hub() if location else None)
+            return
+
+        self.start_device(device, time.monotonic())
+
+    def take_slot(self, key: str) -> bool:
+        # auto stopped if the lot quota is reached
+        slot = self._coordinator.take_slot()
+        if slot == CoordinatorClient.SLOT_NONE:
+            if self._coordinator.exhausted():
+                self.notify_warning_message(f'[{key}] lot quota of coordinator reached, ignored.')
+                self.notify_info_message('Auto stop due to lot quota of coordinator reached.')
+                self.stop()
+            return False
+        if slot == CoordinatorClient.SLOT_LOCAL:
+            self.notify_warning_message(f'[{key}] started on local lease, coordinator unreachable.')
+        return True
+
+    def on_slot_available(self):
+        while self._slot_waiting and not self._stopped:
+            key = next(iter(self._slot_waiting))
+            if not self.take_slot(key):
+                break
+            self.start_device(*self._slot_waiting.pop(key))
+        if self._stopped:
+            self.drop_slot_waiting()
+
+    def drop_slot_waiting(self):
+        for key in self._slot_waiting:
+            self.notify_stop_progress(key, False, 'stopped while waiting for a download slot')
+        self._slot_waiting.clear()
+
+    def start_device(self, device: UsbDevice, arrival_time: float):
+        key = device.key()
+        port = device.port()
+
+        # devices on the same hub share its bandwidth
+        location = device.location()
+        hub = location.hub() if location else None
+        self._hubs[key] = hub
+        self._usb_paths[key] = location.port() if location else None
+        self._arrival_times[key] = arrival_time
+
+        # the image set may be switched any time, a task keeps the one it started with
+        usb_path = self._usb_paths[key]
+        name = self._router.route_by_port(usb_path) if self._router is not None else ProfileConfig.DEFAULT_NAME
+        if name is not None:
+            profile = self._profiles[name]
+            profile.acquire()
+            self._task_profiles[key] = profile
+            task = self.create_task(port, profile)
+        else:
+            # routed by serial or hw id, the default profile is replaced once they are read
+            task = self.create_task(port, self._profiles[ProfileConfig.DEFAULT_NAME],
+                                    lambda serial, hw_id: self.resolve_profile(key, usb_path, serial, hw_id))
+        self._running_tasks[key] = task
         task.set_state_update_listener(
-            lambda state, cur_progress, max_progress, message: self.on_task_state_updated(port, task, state,
+            lambda state, cur_progress, max_progress, message: self.on_task_state_updated(key, task, state,
                                                                                           cur_progress, max_progress,
                                                                                           message))
-        task.start()
+        task.set_phase_listener(lambda phase: self.notify_update_phase(key, phase))
+        if not self._scheduler.submit(key, task, hub):
+            self.notify_queue_progress(key, hub)
 
         self._started_task_count += 1
         if 0 < self._max_download_count <= self._started_task_count:
             self.notify_info_message(f'Auto stop due to max download count({self._max_download_count}) reached.')
             self.stop()
 
-    def on_removed(self, port: str):
-        if port not in self._running_tasks:
-            self.notify_warning_message(f'[{port}] removed while not started downloading.')
+    def create_task(self, port: str, profile: ImageProfile,
+                    identify: Union[Callable[[Union[str, None], Union[str, None]],
+                                             Tuple[ImageManifest, Dict[str, Any]]], None] = None) -> T2EdlTask:
+        params = dict(reboot_on_success=self._reboot_on_success,
+                      disable_zeroout=self._disable_zeroout,
+                      disable_erase=self._disable_erase,
+                      retries=self._retries,
+                      retry_backoff=self._retry_backoff,
+                      identify=identify,
+                      sahara=self._sahara,
+                      **profile.task_params())
+        if self._async_engine is not None:
+            return AsyncT2EdlTask(self._async_engine, port, profile.manifest(), self._trace_dir, **params)
+        return T2EdlTask(port, profile.manifest(), self._trace_dir, **params)
+
+    def release_profile(self, key: str):
+        profile = self._task_profiles.pop(key, None)
+        if profile is not None:
+            profile.release()
+
+    def on_removed(self, device: UsbDevice):
+        key = device.key()
+        if self._slot_waiting.pop(key, None) is not None:
+            self.notify_stop_progress(key, False, 'removed while waiting for a download slot')
+            return
+
+        if key not in self._running_tasks:
+            self.notify_warning_message(f'[{key}] removed while not started downloading.')
             return  # already started
 
-        self._running_tasks[port].wait_for_finished()
-        del self._running_tasks[port]
+        # removed before started
+        if self._scheduler.cancel(key):
+            del self._running_tasks[key]
+            del self._hubs[key]
+            del self._usb_paths[key]
+            del self._arrival_times[key]
+            self.release_profile(key)
+            if self._coordinator is not None:
+                self._coordinator.cancel_slot()
+            self.notify_stop_progress(key, False, 'removed while queued')
+            return
+
+        # wait for the task asynchronously, then release the port on the event dispatcher
+        task = self._running_tasks[key]
+        task.cancel()
+        self._cleanup_dispatcher.post(lambda: self._cleanup_task(key, task))
+
+    def _cleanup_task(self, key: str, task: Task):
+        task.wait_for_finished()
+        self._event_dispatcher.post(lambda: self._release_task(key, task))
+
+    def _release_task(self, key: str, task: Task):
+        # ignore if already released
+        if self._running_tasks.get(key) is task:
+            del self._running_tasks[key]
+            del self._hubs[key]
+            del self._usb_paths[key]
+            del self._arrival_times[key]
+
+    def on_task_scheduled(self, key: str, task: Task):
+        arrival_time = self._arrival_times.get(key)
+        if arrival_time is not None:
+            self._metric_queued_time.observe(time.monotonic() - arrival_time)
+        self.notify_start_progress(key, self._hubs.get(key))
+        task.start()
 
     def watch(self, watcher: Watcher):
         self._watcher = watcher
 
     def notify_started(self):
         if self._watcher:
-            self._watcher.on_started()
+            self._event_bus.post(lambda: self._watcher.on_started())
 
     def notify_stopped(self):
         if self._watcher:
-            self._watcher.on_stopped()
+            self._event_bus.post(lambda: self._watcher.on_stopped())
 
     def notify_message(self, message: str, color='blue'):
         if self._watcher:
-            self._watcher.on_update_message(message, color)
+            self._event_bus.post(lambda: self._watcher.on_update_message(message, color))
 
     def notify_info_message(self, message: str):
         self.notify_message(message, 'blue')
@@ -230,14 +989,30 @@ class T2Edl(object):
     def notify_error_message(self, message: str):
         self.notify_message(message, 'red')
 
-    def notify_start_progress(self, key: str):
+    def notify_queue_progress(self, key: str, hub: Union[str, None] = None):
+        if self._watcher:
+            self._event_bus.post(lambda: self._watcher.on_queue_progress(key, hub))
+
+    def notify_start_progress(self, key: str, hub: Union[str, None] = None):
         if self._watcher:
-            self._watcher.on_start_progress(key)
+            self._event_bus.post(lambda: self._watcher.on_start_progress(key, hub))
 
     def notify_stop_progress(self, key: str, success: bool, message: Union[str, None]):
         if self._watcher:
-            self._watcher.on_stop_progress(key, success, message)
+            self._event_bus.post_final(key, lambda: self._watcher.on_stop_progress(key, success, message))
 
     def notify_update_progress(self, key: str, cur_progress: int = 0, max_progress: Union[int, None] = None):
         if self._watcher:
-            self._watcher.on_update_progress(key, cur_progress, max_progress)
+            self._event_bus.post_latest(key, 'progress', lambda: self._watcher.on_update_progress(key, cur_progress, max_progress))
+
+    def notify_update_throughput(self, key: str, speed: float, average_speed: float, eta: Union[float, None]):
+        if self._watcher:
+            self._event_bus.post_latest(key, 'throughput', lambda: self._watcher.on_update_throughput(key, speed, average_speed, eta))
+
+    def notify_update_phase(self, key: str, phase: str):
+        if self._watcher:
+            self._event_bus.post(lambda: self._watcher.on_update_phase(key, phase))
+
+    def notify_update_traces(self, key: str, trace_files: List[str]):
+        if self._watcher:
+            self._event_bus.post(lambda: self._watcher.on_update_traces(key, self._trace_dir, trace_files))
@@ -2,18 +2,56 @@ import os
 import platform
 import re
 import subprocess
+import threading
+import time
 from datetime import datetime
-from typing import Callable, Tuple, Sequence, Union
+from typing import Any, Callable, Dict, List, TextIO, Tuple, Sequence, Union
 
 from Application import Application
+from FailureClassifier import FailureClassifier
+from ImageManifest import ImageManifest, ProgramEntry
+from SaharaClient import ProgrammerCache, SaharaClient, SaharaError
 from Task import Task
+from ThroughputMeter import ThroughputMeter
 
 
 class T2EdlTask(Task):
     PATTERN_FH_LOADER_PERCENT_LINE = re.compile(r'\s*\d{2}:\d{2}:\d{2}:\s+\w+:\s+\{percent\s+files\s+transferred\s+(?P<percent>\d+\.\d+)%}\s*')
+    PATTERN_FH_LOADER_FILE_LINE = re.compile(r'.*<program>\s+FILE:\s+\'(?P<filename>[^\']+)\'')
+    PATTERN_FH_LOADER_THROUGHPUT_LINE = re.compile(r'.*Throughput\D*(?P<speed>\d+(?:\.\d+)?)\s*(?P<unit>[KMG]?)B(?:ps|/s)', re.IGNORECASE)
 
-    PATTERN_RAWPROGRAM = re.compile(r'rawprogram\d+.xml')
-    PATTERN_PATCH = re.compile(r'patch\d+.xml')
+    PATTERN_SAHARA_HELLO_LINE = re.compile(r'.*hello', re.IGNORECASE)
+    PATTERN_SAHARA_UPLOAD_LINE = re.compile(r'.*(?:read_data|image\s+id|sending\s+image|reading\s+file)', re.IGNORECASE)
+    PATTERN_SAHARA_DONE_LINE = re.compile(r'.*(?:end_image_tx|done\s+packet|protocol\s+completed|uploaded\s+all)', re.IGNORECASE)
+    PATTERN_SAHARA_SERIAL_LINE = re.compile(r'.*serial\s*(?:num(?:ber)?)?\s*[:=]\s*(?P<serial>(?:0x)?[0-9a-fA-F]+)', re.IGNORECASE)
+    PATTERN_SAHARA_HW_ID_LINE = re.compile(r'.*hw\s*_?id\s*[:=]\s*(?P<hw_id>(?:0x)?[0-9a-fA-F]+)', re.IGNORECASE)
+
+    PHASE_IDENTIFY = 'identify'
+
+    PHASE_SAHARA = 'sahara'
+    PHASE_SAHARA_HELLO = 'sahara hello'
+    PHASE_SAHARA_UPLOAD = 'uploading programmer'
+    PHASE_SAHARA_DONE = 'programmer loaded'
+    PHASE_FIREHOSE = 'firehose'
+    PHASE_DOWNLOAD = 'downloading'
+    PHASE_RETRY = 'retry'  # backoff before next attempt, whose phases are entered again
+    PHASES = (PHASE_IDENTIFY, PHASE_SAHARA, PHASE_SAHARA_HELLO, PHASE_SAHARA_UPLOAD, PHASE_SAHARA_DONE, PHASE_FIREHOSE, PHASE_DOWNLOAD)
+
+    TRACE_BUFFER_SIZE = 64 * 1024
+
+    # sahara command mode, device returns to image transfer mode after them
+    SAHARA_COMMAND_SERIAL = '1'
+    SAHARA_COMMAND_HW_ID = '2'
+
+    SAHARA_TOOL = 'tool'  # one QSaharaServer process per device
+    SAHARA_BUILTIN = 'builtin'  # in process over the tty, programmer read once for all devices
+    SAHARAS = (SAHARA_TOOL, SAHARA_BUILTIN)
+
+    RETRY_BACKOFF = 2.0  # seconds before the first retry, doubled for each next one
+    RETRY_BACKOFF_MAX = 30.0
+
+    THROUGHPUT_UNITS = {'': 1, 'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+    PROGRESS_UPDATE_INTERVAL = 0.5  # seconds between estimated progress updates inside one file
 
     SIGNEDDIGESTS_SEARCH_LIST_WINDOWS = (
         'DigestsSignedZlpAwareHost.bin.mbn',
@@ -39,9 +77,12 @@ class T2EdlTask(Task):
 
     CHAINEDDIGESTS_SEARCH_LIST = CHAINEDDIGESTS_SEARCH_LIST_WINDOWS if platform.system() == 'Windows' else CHAINEDDIGESTS_SEARCH_LIST_LINUX
 
+    ERASE_LUN = '5'
+    ERASE_PARTITIONS = ('modemst1', 'modemst2')
+
     def __init__(self,
                  port: str,
-                 image_dir: str,
+                 manifest: ImageManifest,
                  trace_dir: str,
                  reboot_on_success: bool = False,
                  prog: str = 'prog_firehose_ddr.elf',
@@ -49,19 +90,84 @@ class T2EdlTask(Task):
                  signed_digests: Union[str, None] = None,
                  chained_digests: Union[str, None] = None,
                  disable_zeroout: bool = False,
-                 disable_erase: bool = False):
+                 disable_erase: bool = False,
+                 sendxml: Union[Sequence[str], None] = None,
+                 programs: Union[Sequence[ProgramEntry], None] = None,
+                 erase_partitions: Sequence[str] = ERASE_PARTITIONS,
+                 retries: int = 0,
+                 retry_backoff: float = RETRY_BACKOFF,
+                 identify: Union[Callable[[Union[str, None], Union[str, None]],
+                                          Union[Tuple[ImageManifest, Dict[str, Any]], None]], None] = None,
+                 sahara: str = SAHARA_TOOL):
         super().__init__()
 
         self._port = port
-        self._image_dir = image_dir
+        self._port_name = os.path.basename(port)  # port may be a device path, i.e. emulated ones
         self._trace_dir = trace_dir
         self._reboot_on_success = reboot_on_success
+        self._disable_zeroout = disable_zeroout
+        self._disable_erase = disable_erase
+        self.set_profile(manifest, prog, is_vip, signed_digests, chained_digests, sendxml, programs, erase_partitions)
+
+        # image set decided by serial and hw id read in sahara command mode
+        self._identify = identify
+
+        # builtin sahara keeps the connection from identifying to programmer upload
+        self._sahara = sahara
+        self._sahara_client: Union[SaharaClient, None] = None
+
+        # byte based progress
+        self._current_program: Union[ProgramEntry, None] = None
+        self._current_program_time = 0.0
+        self._finished_bytes = 0
+        self._last_progress_time = 0.0
+
+        # live status parsed from tool output
+        self._phase: Union[str, None] = None
+        self._serial: Union[str, None] = None
+        self._hw_id: Union[str, None] = None
+        self._on_update_phase: Union[Callable[[str], None], None] = None
+
+        # timings
+        self._phase_times: List[Tuple[str, float]] = []  # (phase, monotonic time entered)
+        self._file_times: List[Tuple[str, int, float]] = []  # (filename, bytes, seconds)
+
+        # trace files of this download, of all attempts
+        self._trace_timestamp: Union[str, None] = None
+        self._trace_files: List[str] = []
+
+        # retry, fh_loader resumes from the xml it failed in
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._attempt = 0
+        self._classifier = FailureClassifier()
+        self._sendxml_index = 0
+        self._files_sent = False
+        self._needs_sahara = True
+        self._cancel_event = threading.Event()
+
+    def set_profile(self,
+                    manifest: ImageManifest,
+                    prog: str = 'prog_firehose_ddr.elf',
+                    is_vip: Union[bool, None] = None,
+                    signed_digests: Union[str, None] = None,
+                    chained_digests: Union[str, None] = None,
+                    sendxml: Union[Sequence[str], None] = None,
+                    programs: Union[Sequence[ProgramEntry], None] = None,
+                    erase_partitions: Sequence[str] = ERASE_PARTITIONS):
+        # what to download, only changed before downloading
+        self._manifest = manifest
+        self._image_dir = manifest.image_dir()
         self._prog = prog
         self._is_vip = is_vip
         self._signed_digests = signed_digests
         self._chained_digests = chained_digests
-        self._disable_zeroout = disable_zeroout
-        self._disable_erase = disable_erase
+        self._sendxml = list(sendxml) if sendxml is not None else manifest.sendxml()
+        self._programs = list(programs) if programs is not None else manifest.programs()
+        self._erase_partitions = erase_partitions
+
+        self._meter = ThroughputMeter(sum(p.transfer_bytes() for p in self._programs))
+        self._pending_programs: List[ProgramEntry] = [p for p in self._programs if p.transfer_bytes() > 0]
 
         self._slash = '\\' if platform.system() == 'Windows' else '/'
         if not self._image_dir.endswith(self._slash):
@@ -70,57 +176,186 @@ class T2EdlTask(Task):
     def on_start(self) -> bool:
         self.set_state(Task.STATE_RUNNING)
 
-        if not os.path.exists(self._trace_dir):
-            os.makedirs(self._trace_dir, exist_ok=True)
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[0:-3]
-        sahara_trace_filename = f'{timestamp}_{self._port}_sahara.log'
-        fh_loader_trace_filename = f'{timestamp}_{self._port}_fh_loader.log'
+        if self._identify is not None:
+            result, msg = self.identify_device()
+            if not result:
+                self.set_state(Task.STATE_ERROR, message=msg)
+                return False
+
+        while True:
+            result, msg = self.download_attempt()
+            if result:
+                break
+
+            delay = self.retry_delay()
+            if delay is None:
+                self.set_state(Task.STATE_ERROR, message=msg)
+                return False
+            self.notify_retry(delay, msg)
+            if self._cancel_event.wait(delay):
+                self.set_state(Task.STATE_ERROR, message='cancelled')
+                return False
+
+        self._finish_current_program()
+        self._meter.update(self._meter.total_bytes())
+        self.set_state(Task.STATE_SUCCESS, message=msg)
 
-        result, msg = self.download_sahara(sahara_trace_filename)
-        if not result:
-            self.set_state(Task.STATE_ERROR, message=msg)
-            return False
+        return True
 
-        result, msg = self.download_fh_loader(fh_loader_trace_filename)
+    def cancel(self):
+        # no more retries, the running tool is not interrupted
+        self._cancel_event.set()
+
+    def identify_device(self) -> Tuple[bool, str]:
+        trace_filename = self.prepare_identify_trace()
+        self.set_phase(T2EdlTask.PHASE_IDENTIFY)
+        if self._sahara == T2EdlTask.SAHARA_BUILTIN:
+            if not self.run_sahara_builtin(trace_filename, True):
+                return False, trace_filename
+            result, msg = self.apply_identity(trace_filename)
+            if not result:
+                self.close_sahara_client()
+            return result, msg
+
+        cmd = self.sahara_identify_cmd()
+        sahara = T2EdlTask._create_process(cmd)
+        with self.open_trace(trace_filename, cmd) as file:
+            for line in sahara.stdout:
+                file.write(line)
+                self.parse_identity_line(line)
+        sahara.wait()
+        if sahara.returncode != 0:
+            return False, trace_filename
+
+        return self.apply_identity(trace_filename)
+
+    def apply_identity(self, trace_filename: str) -> Tuple[bool, str]:
+        route = self._identify(self._serial, self._hw_id)
+        if route is None:
+            return False, f'no image set for serial {self._serial or "-"}, hw id {self._hw_id or "-"}, {trace_filename}'
+        manifest, params = route
+        self.set_profile(manifest, **params)
+        return True, trace_filename
+
+    def download_attempt(self) -> Tuple[bool, str]:
+        self._classifier.reset()
+        sahara_trace_filename, fh_loader_trace_filename, console_trace_filename = self.prepare_trace()
+
+        # a retry after fh_loader failed talks to the programmer still running on device
+        if self._needs_sahara:
+            result, msg = self.download_sahara(sahara_trace_filename)
+            if not result:
+                return False, msg
+            self._needs_sahara = False
+
+        self.rewind_programs()
+        self.start_meter()
+        result, msg = self.download_fh_loader(fh_loader_trace_filename, console_trace_filename)
+        self._meter.stop()
         if not result:
-            self.set_state(Task.STATE_ERROR, message=msg)
-            return False
+            self._classifier.feed_fh_loader_trace(os.path.join(self._trace_dir, fh_loader_trace_filename))
+            self._sendxml_index = self.resume_index()
+        return result, msg
 
-        self.set_state(Task.STATE_SUCCESS, message=msg)
+    def start_meter(self):
+        if self._attempt == 0:
+            self._meter.start()
+        else:
+            self._meter.resume()
+
+    def retry_delay(self) -> Union[float, None]:
+        # seconds to wait before next attempt, None if not to retry
+        if self._attempt >= self._retries or self._cancel_event.is_set():
+            return None
+        if not FailureClassifier.is_retryable(self._classifier.failure_class()):
+            return None
+        if self._is_vip and not self._needs_sahara:
+            return None  # digests are chained from the first xml, fh_loader can not resume
+        self._attempt += 1
+        return min(self._retry_backoff * 2 ** (self._attempt - 1), T2EdlTask.RETRY_BACKOFF_MAX)
+
+    def notify_retry(self, delay: float, msg: str):
+        self.set_phase(T2EdlTask.PHASE_RETRY)
+        resume = f' from {os.path.basename(self._sendxml[self._sendxml_index])}' \
+            if not self._needs_sahara and 0 < self._sendxml_index < len(self._sendxml) else ''
+        self.set_state(Task.STATE_RUNNING, self._meter.done_bytes(), self._meter.total_bytes(),
+                       message=f'{self._classifier.failure_class()}, retry {self._attempt}/{self._retries}{resume} '
+                               f'in {delay:g}s, {msg}')
+
+    def resume_index(self) -> int:
+        # fh_loader sends xml in order, those before the failed one are done
+        if self._current_program is not None:
+            for index in range(self._sendxml_index, len(self._sendxml)):
+                if os.path.basename(self._sendxml[index]) == self._current_program.xml():
+                    return index
+        elif self._files_sent:
+            # all files sent, failed in patches
+            for index in range(self._sendxml_index, len(self._sendxml)):
+                if ImageManifest.PATTERN_PATCH.match(os.path.basename(self._sendxml[index])):
+                    return index
+        return self._sendxml_index
+
+    def rewind_programs(self):
+        # progress of xml already sent is kept
+        done_xml = set(os.path.basename(xml) for xml in self._sendxml[:self._sendxml_index])
+        self._files_sent = False
+        self._current_program = None
+        self._finished_bytes = sum(p.transfer_bytes() for p in self._programs if p.xml() in done_xml)
+        self._pending_programs = [p for p in self._programs if p.transfer_bytes() > 0 and p.xml() not in done_xml]
+        self._meter.update(self._finished_bytes)
+
+    def prepare_identify_trace(self) -> str:
+        if not os.path.exists(self._trace_dir):
+            os.makedirs(self._trace_dir, exist_ok=True)
 
-        return True
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[0:-3]
+        trace_filename = f'{timestamp}_{self._port_name}_identify.log'
+        self._trace_timestamp = timestamp
+        self._trace_files.append(trace_filename)
+        return trace_filename
 
-    def download_sahara(self, trace_filename: str) -> Tuple[bool, str]:
-        trace_file = os.path.join(self._trace_dir, trace_filename)
+    def prepare_trace(self) -> Tuple[str, str, str]:
+        if not os.path.exists(self._trace_dir):
+            os.makedirs(self._trace_dir, exist_ok=True)
 
-        cmd = [
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[0:-3]
+        sahara_trace_filename = f'{timestamp}_{self._port_name}_sahara.log'
+        fh_loader_trace_filename = f'{timestamp}_{self._port_name}_fh_loader.log'  # written by fh_loader itself
+        console_trace_filename = f'{timestamp}_{self._port_name}_fh_loader_console.log'
+        if self._trace_timestamp is None:
+            self._trace_timestamp = timestamp
+        if self._needs_sahara:
+            self._trace_files.append(sahara_trace_filename)
+        self._trace_files.extend([fh_loader_trace_filename, console_trace_filename])
+        return sahara_trace_filename, fh_loader_trace_filename, console_trace_filename
+
+    def open_trace(self, trace_filename: str, cmd: Sequence[str]) -> TextIO:
+        # buffered, tool output is streamed into it line by line
+        file = open(os.path.join(self._trace_dir, trace_filename), 'w', buffering=T2EdlTask.TRACE_BUFFER_SIZE)
+        file.write(f'cmd: {" ".join(cmd)}\n\n')
+        return file
+
+    def sahara_cmd(self) -> List[str]:
+        return [
             T2EdlTask.bin_sahara(),
             '-p', T2EdlTask.param_port(self._port),
-            '-s', f'13:{self._prog}',
+            '-s', f'{SaharaClient.IMAGE_ID_PROGRAMMER}:{self._prog}',
             '-b', self._image_dir
         ]
 
-        # run sahara
-        sahara = T2EdlTask._create_process(cmd)
-        sahara.wait()
-
-        # save logs
-        with open(trace_file, 'w') as file:
-            file.write(f'cmd: {" ".join(cmd)}\n\n')
-            file.write(sahara.stdout.read())
-
-        # result
-        return sahara.returncode == 0, trace_filename
-
-    def download_fh_loader(self, trace_filename: str) -> Tuple[bool, str]:
-        trace_file = os.path.join(self._trace_dir, trace_filename)
+    def sahara_identify_cmd(self) -> List[str]:
+        return [
+            T2EdlTask.bin_sahara(),
+            '-p', T2EdlTask.param_port(self._port),
+            '-c', T2EdlTask.SAHARA_COMMAND_SERIAL,
+            '-c', T2EdlTask.SAHARA_COMMAND_HW_ID
+        ]
 
-        # cmd
+    def fh_loader_cmd(self, trace_file: str) -> List[str]:
         cmd = [
             T2EdlTask.bin_fh_loader(),
             f'--port={T2EdlTask.param_port(self._port)}',
-            f'--sendxml={T2EdlTask.param_sendxml(self._image_dir)}',
+            f'--sendxml={T2EdlTask.param_sendxml(self._sendxml[self._sendxml_index:])}',
             f'--search_path={self._image_dir}',
             '--showpercentagecomplete',
             '--memoryname=ufs',
@@ -137,8 +372,67 @@ class T2EdlTask(Task):
             cmd.append('--power=reset,1')
         if not self._disable_zeroout:
             cmd.append('--ex_zeroout')
-        if not self._disable_erase:
-            cmd.append('--ex_erase=5:modemst1,5:modemst2')
+        if not self._disable_erase and self._erase_partitions:
+            cmd.append(f'--ex_erase={T2EdlTask.param_erase(self._erase_partitions)}')
+        return cmd
+
+    def download_sahara(self, trace_filename: str) -> Tuple[bool, str]:
+        self.set_phase(T2EdlTask.PHASE_SAHARA)
+        if self._sahara == T2EdlTask.SAHARA_BUILTIN:
+            return self.run_sahara_builtin(trace_filename, False), trace_filename
+
+        cmd = self.sahara_cmd()
+
+        # run sahara, save logs while reading to never block on a full pipe
+        sahara = T2EdlTask._create_process(cmd)
+        with self.open_trace(trace_filename, cmd) as file:
+            for line in sahara.stdout:
+                file.write(line)
+                self.parse_sahara_line(line)
+
+        # result
+        sahara.wait()
+        return sahara.returncode == 0, trace_filename
+
+    def run_sahara_builtin(self, trace_filename: str, identify: bool) -> bool:
+        # same trace and phases as the tool, handshake steps are reported as they happen
+        cmd = [T2EdlTask.SAHARA_BUILTIN] + (self.sahara_identify_cmd() if identify else self.sahara_cmd())[1:]
+        with self.open_trace(trace_filename, cmd) as file:
+            def on_line(line: str):
+                file.write(f'{line}\n')
+                if identify:
+                    self.parse_identity_line(line)
+                else:
+                    self.parse_sahara_line(line)
+
+            client = self._sahara_client or SaharaClient(T2EdlTask.param_port(self._port), on_line)
+            client.set_log_listener(on_line)
+            self._sahara_client = None
+            try:
+                client.open()
+                if identify:
+                    client.identify()  # serial and hw id are parsed from its lines
+                    self._sahara_client = client  # programmer is uploaded in the same session
+                    return True
+                client.upload(SaharaClient.IMAGE_ID_PROGRAMMER, ProgrammerCache.load(self._image_dir + self._prog))
+            except (SaharaError, OSError) as e:
+                on_line(f'ERROR: {e}')
+                client.close()
+                return False
+            client.close()
+            return True
+
+    def close_sahara_client(self):
+        if self._sahara_client is not None:
+            self._sahara_client.close()
+            self._sahara_client = None
+
+    def download_fh_loader(self, trace_filename: str, console_trace_filename: str) -> Tuple[bool, str]:
+        trace_file = os.path.join(self._trace_dir, trace_filename)
+
+        # cmd
+        cmd = self.fh_loader_cmd(trace_file)
+        self.set_phase(T2EdlTask.PHASE_FIREHOSE)
 
         # run fh_loader
         fh_loader = T2EdlTask._create_process(cmd)
@@ -148,8 +442,10 @@ class T2EdlTask(Task):
         # fh_loader.stdin.flush()
 
         # progress
-        for line in fh_loader.stdout:
-           self.parse_hf_loader_line(line)
+        with self.open_trace(console_trace_filename, cmd) as file:
+            for line in fh_loader.stdout:
+                file.write(line)
+                self.parse_hf_loader_line(line)
 
         # result
         fh_loader.wait()
@@ -176,12 +472,140 @@ class T2EdlTask(Task):
                 start_new_session=True
             )
 
+    def meter(self) -> ThroughputMeter:
+        return self._meter
+
+    def trace_timestamp(self) -> Union[str, None]:
+        return self._trace_timestamp
+
+    def trace_files(self) -> List[str]:
+        return self._trace_files
+
+    def phase(self) -> Union[str, None]:
+        return self._phase
+
+    def port(self) -> str:
+        return self._port
+
+    def serial(self) -> Union[str, None]:
+        return self._serial
+
+    def hw_id(self) -> Union[str, None]:
+        return self._hw_id
+
+    def failure_class(self) -> Union[str, None]:
+        return self._classifier.failure_class()
+
+    def attempts(self) -> int:
+        return self._attempt + 1
+
+    def phase_durations(self, end_time: Union[float, None] = None) -> List[Tuple[str, float]]:
+        # seconds spent in each phase, the last one lasts until end_time (now if not set)
+        end_time = time.monotonic() if end_time is None else end_time
+        ends = [t for _, t in self._phase_times[1:]] + [end_time]
+        return [(phase, max(end - start, 0.0)) for (phase, start), end in zip(self._phase_times, ends)]
+
+    def file_times(self) -> List[Tuple[str, int, float]]:
+        return self._file_times
+
+    def set_phase_listener(self, listener: Callable[[str], None]):
+        self._on_update_phase = listener
+
+    def set_phase(self, phase: str):
+        # phases only move forward within one attempt, tools may repeat earlier messages
+        if phase != T2EdlTask.PHASE_RETRY and self._phase in T2EdlTask.PHASES \
+                and T2EdlTask.PHASES.index(phase) <= T2EdlTask.PHASES.index(self._phase):
+            return
+        self._phase = phase
+        self._phase_times.append((phase, time.monotonic()))
+        if self._on_update_phase:
+            self._on_update_phase(phase)
+
+    def parse_identity_line(self, line: str):
+        self._classifier.feed_sahara_line(line)
+
+        matched = T2EdlTask.PATTERN_SAHARA_SERIAL_LINE.match(line)
+        if matched and self._serial is None:
+            self._serial = matched['serial']
+        matched = T2EdlTask.PATTERN_SAHARA_HW_ID_LINE.match(line)
+        if matched and self._hw_id is None:
+            self._hw_id = matched['hw_id']
+
+    def parse_sahara_line(self, line: str):
+        self.parse_identity_line(line)
+
+        if T2EdlTask.PATTERN_SAHARA_DONE_LINE.match(line):
+            self.set_phase(T2EdlTask.PHASE_SAHARA_DONE)
+        elif T2EdlTask.PATTERN_SAHARA_UPLOAD_LINE.match(line):
+            self.set_phase(T2EdlTask.PHASE_SAHARA_UPLOAD)
+        elif T2EdlTask.PATTERN_SAHARA_HELLO_LINE.match(line):
+            self.set_phase(T2EdlTask.PHASE_SAHARA_HELLO)
+
     def parse_hf_loader_line(self, line: str):
+        self._classifier.feed_fh_loader_line(line)
+
         matched = T2EdlTask.PATTERN_FH_LOADER_PERCENT_LINE.match(line)
         if matched:
             progress_str = matched['percent']
-            progress = int(float(progress_str) * 100)
-            self.set_state(Task.STATE_RUNNING, progress, 10000)
+            self._files_sent = float(progress_str) >= 100
+            if self._meter.total_bytes() <= 0:
+                # no byte info, fallback to percent of files
+                progress = int(float(progress_str) * 100)
+                self.set_state(Task.STATE_RUNNING, progress, 10000)
+                return
+            if self._files_sent:
+                self._finish_current_program()
+            self.update_byte_progress()
+            return
+
+        matched = T2EdlTask.PATTERN_FH_LOADER_FILE_LINE.match(line)
+        if matched:
+            self.set_phase(T2EdlTask.PHASE_DOWNLOAD)
+            self._start_program(matched['filename'])
+            self.update_byte_progress()
+            return
+
+        matched = T2EdlTask.PATTERN_FH_LOADER_THROUGHPUT_LINE.match(line)
+        if matched:
+            speed = float(matched['speed']) * T2EdlTask.THROUGHPUT_UNITS[matched['unit'].upper()]
+            self._meter.set_reported_speed(speed)
+
+        if time.monotonic() - self._last_progress_time >= T2EdlTask.PROGRESS_UPDATE_INTERVAL:
+            self.update_byte_progress()
+
+    def update_byte_progress(self):
+        if self._meter.total_bytes() <= 0:
+            return
+
+        now = time.monotonic()
+        done_bytes = self._finished_bytes
+
+        # fh_loader tells nothing inside one file, estimate with the known speed
+        if self._current_program is not None:
+            speed = self._meter.reported_speed() or self._meter.average_speed()
+            estimated = int(speed * (now - self._current_program_time))
+            done_bytes += min(estimated, int(self._current_program.transfer_bytes() * 0.99))
+
+        self._last_progress_time = now
+        self._meter.update(done_bytes)
+        self.set_state(Task.STATE_RUNNING, self._meter.done_bytes(), self._meter.total_bytes())
+
+    def _start_program(self, filename: str):
+        self._finish_current_program()
+        for program in self._pending_programs:
+            if program.filename() == filename:
+                self._pending_programs.remove(program)
+                self._current_program = program
+                self._current_program_time = time.monotonic()
+                return
+
+    def _finish_current_program(self):
+        if self._current_program is not None:
+            self._finished_bytes += self._current_program.transfer_bytes()
+            self._file_times.append((self._current_program.filename(),
+                                     self._current_program.transfer_bytes(),
+                                     time.monotonic() - self._current_program_time))
+            self._current_program = None
 
     @staticmethod
     def bin_sahara():
@@ -194,6 +618,8 @@ class T2EdlTask(Task):
     @staticmethod
     def param_port(port: str) -> str:
         os_name = platform.system()
+        if os.path.isabs(port):
+            return port  # already a device path
         if os_name == 'Windows':
             return f'\\\\.\\{port}'
         elif os_name == 'Linux':
@@ -202,37 +628,36 @@ class T2EdlTask(Task):
             return port
 
     @staticmethod
-    def param_sendxml(image_dir: str) -> str:
-        file_list = os.listdir(image_dir)
-        raw_programs = [filename for filename in file_list if T2EdlTask.PATTERN_RAWPROGRAM.match(filename)]
-        patches = [filename for filename in file_list if T2EdlTask.PATTERN_PATCH.match(filename)]
-        return ','.join([*sorted(raw_programs), *sorted(patches)])
+    def param_sendxml(sendxml: Sequence[str]) -> str:
+        return ','.join(sendxml)
+
+    @staticmethod
+    def param_erase(partitions: Sequence[str]) -> str:
+        return ','.join(f'{T2EdlTask.ERASE_LUN}:{partition}' for partition in partitions)
 
     @staticmethod
     def param_zlpawarehost() -> str:
         return '1' if platform.system() == 'Windows' else '0'
 
     @staticmethod
-    def auto_detect(image_dir: str,
+    def auto_detect(manifest: ImageManifest,
                     detect_list: Sequence[str],
                     detected_filename: Union[str, None] = None) -> Union[str, None]:
         if detected_filename is None:
-            file_list = os.listdir(image_dir)
-            for filename in detect_list:
-                if filename in file_list:
-                    detected_filename = filename
-                    break
-        if detected_filename is not None and not os.path.exists(os.path.join(image_dir, detected_filename)):
+            detected_filename = manifest.find_file(detect_list)
+        if detected_filename is not None \
+                and not manifest.has_file(detected_filename) \
+                and not os.path.exists(os.path.join(manifest.image_dir(), detected_filename)):
             detected_filename = None
         return detected_filename
 
     @staticmethod
-    def param_signeddigests(image_dir: str, signed_digests: Union[str, None] = None) -> Union[str, None]:
-        return T2EdlTask.auto_detect(image_dir, T2EdlTask.SIGNEDDIGESTS_SEARCH_LIST, signed_digests)
+    def param_signeddigests(manifest: ImageManifest, signed_digests: Union[str, None] = None) -> Union[str, None]:
+        return T2EdlTask.auto_detect(manifest, T2EdlTask.SIGNEDDIGESTS_SEARCH_LIST, signed_digests)
 
     @staticmethod
-    def param_chaineddigests(image_dir: str, chained_digests: Union[str, None] = None) -> Union[str, None]:
-        return T2EdlTask.auto_detect(image_dir, T2EdlTask.CHAINEDDIGESTS_SEARCH_LIST, chained_digests)
+    def param_chaineddigests(manifest: ImageManifest, chained_digests: Union[str, None] = None) -> Union[str, None]:
+        return T2EdlTask.auto_detect(manifest, T2EdlTask.CHAINEDDIGESTS_SEARCH_LIST, chained_digests)
 
     @staticmethod
     def encoding():
@@ -1,7 +1,8 @@
+from datetime import timedelta
 from typing import Dict, Union
 
 from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, TaskID
+from rich.progress import BarColumn, Progress, SpinnerColumn, TaskID, TaskProgressColumn, TextColumn, TimeElapsedColumn
 
 from T2Edl import Watcher
 
@@ -11,7 +12,11 @@ class T2EdlUi(Watcher):
         self._console = Console(record=True)
         self._progress = Progress(
                 SpinnerColumn(),
-                *Progress.get_default_columns(),
+                TextColumn('[progress.description]{task.description}'),
+                BarColumn(),
+                TaskProgressColumn(),
+                TextColumn('{task.fields[phase]}'),
+                TextColumn('{task.fields[throughput]}'),
                 TimeElapsedColumn(),
                 console=self._console,
                 transient=False,
@@ -27,8 +32,18 @@ class T2EdlUi(Watcher):
     def on_update_message(self, message: str, color: str):
         self._console.log(f'[{color}]{message}')
 
-    def on_start_progress(self, key: str):
-        self._tasks[key] = self._progress.add_task(f'[green]{key}', total=None)
+    def on_queue_progress(self, key: str, hub: Union[str, None]):
+        self._tasks[key] = self._progress.add_task(f'[yellow]{T2EdlUi.label(key, hub)} (queued)', total=None, start=False, phase='', throughput='')
+
+    def on_start_progress(self, key: str, hub: Union[str, None]):
+        if key in self._tasks:
+            # started from queue
+            task = self._tasks[key]
+            self._progress.update(task, description=f'[green]{T2EdlUi.label(key, hub)}')
+            self._progress.start_task(task)
+            return
+
+        self._tasks[key] = self._progress.add_task(f'[green]{T2EdlUi.label(key, hub)}', total=None, phase='', throughput='')
 
     def on_stop_progress(self, key: str, success: bool, message: Union[str, None]):
         if key not in self._tasks:
@@ -36,7 +51,7 @@ class T2EdlUi(Watcher):
             return
 
         # stop task
-        task = self._tasks[key]
+        task = self._tasks.pop(key)
         self._progress.stop_task(task)
         self._progress.remove_task(task)
 
@@ -57,3 +72,21 @@ class T2EdlUi(Watcher):
 
         # update
         self._progress.update(task, completed=cur_progress, total=max_progress)
+
+    def on_update_throughput(self, key: str, speed: float, average_speed: float, eta: Union[float, None]):
+        if key not in self._tasks:
+            return
+
+        eta_str = '-:--:--' if eta is None else str(timedelta(seconds=int(eta)))
+        self._progress.update(self._tasks[key],
+                              throughput=f'{speed / 1024 / 1024:6.1f} MB/s (avg {average_speed / 1024 / 1024:.1f}) ETA {eta_str}')
+
+    def on_update_phase(self, key: str, phase: str):
+        if key not in self._tasks:
+            return
+
+        self._progress.update(self._tasks[key], phase=phase)
+
+    @staticmethod
+    def label(key: str, hub: Union[str, None]) -> str:
+        return f'{key} @hub {hub}' if hub else key
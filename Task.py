@@ -36,13 +36,17 @@ class Task(object):
         self.notify_state_update(self._state, cur_progress, max_progress, message)
 
     def start(self):
-        self._thread = threading.Thread(target=self.on_start)
+        self._thread = threading.Thread(target=self._run)
         self._thread.start()
 
     def wait_for_finished(self):
         if self._thread:
             self._thread.join()
 
+    def cancel(self):
+        # threads can not be interrupted, subclasses may stop earlier
+        pass
+
     def set_state_update_listener(self, listener: Callable[[int, int, int, str], None]):
         self._on_update_state = listener
 
@@ -50,5 +54,12 @@ class Task(object):
         if self._on_update_state:
             self._on_update_state(state, cur_progress, max_progress, message)
 
+    def _run(self):
+        try:
+            self.on_start()
+        except Exception as e:
+            # always end with a final state, someone may be waiting for it
+            self.set_state(Task.STATE_ERROR, message=f'{type(e).__name__}: {e}')
+
     def on_start(self) -> bool:
         pass
\ No newline at end of file
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple, Union
+
+
+class ThroughputMeter(object):
+    WINDOW = 3.0  # seconds for instantaneous speed
+
+    def __init__(self, total_bytes: int = 0):
+        self._lock = threading.Lock()
+        self._total_bytes = total_bytes
+        self._done_bytes = 0
+        self._start_time: Union[float, None] = None
+        self._end_time: Union[float, None] = None
+        self._samples: Deque[Tuple[float, int]] = deque()
+        self._reported_speed: Union[float, None] = None  # speed reported by tool in bytes/s
+
+    def start(self):
+        with self._lock:
+            self._start_time = time.monotonic()
+            self._end_time = None
+            self._samples.clear()
+            self._samples.append((self._start_time, self._done_bytes))
+
+    def resume(self):
+        # continues after stopped, the pause counts in average speed
+        with self._lock:
+            now = time.monotonic()
+            if self._start_time is None:
+                self._start_time = now
+            self._end_time = None
+            self._samples.clear()
+            self._samples.append((now, self._done_bytes))
+
+    def stop(self):
+        with self._lock:
+            self._end_time = time.monotonic()
+
+    def update(self, done_bytes: int):
+        now = time.monotonic()
+        with self._lock:
+            self._done_bytes = min(done_bytes, self._total_bytes) if self._total_bytes > 0 else done_bytes
+            self._samples.append((now, self._done_bytes))
+            while len(self._samples) > 2 and now - self._samples[0][0] > ThroughputMeter.WINDOW:
+                self._samples.popleft()
+
+    def set_reported_speed(self, speed: float):
+        self._reported_speed = speed
+
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def done_bytes(self) -> int:
+        return self._done_bytes
+
+    def reported_speed(self) -> Union[float, None]:
+        return self._reported_speed
+
+    def elapsed(self) -> float:
+        if self._start_time is None:
+            return 0.0
+        end_time = self._end_time if self._end_time is not None else time.monotonic()
+        return end_time - self._start_time
+
+    def speed(self) -> float:
+        # bytes/s in the last WINDOW seconds
+        with self._lock:
+            if len(self._samples) < 2:
+                return 0.0
+            (first_time, first_bytes), (last_time, last_bytes) = self._samples[0], self._samples[-1]
+        if last_time <= first_time:
+            return 0.0
+        return (last_bytes - first_bytes) / (last_time - first_time)
+
+    def average_speed(self) -> float:
+        elapsed = self.elapsed()
+        return self._done_bytes / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Union[float, None]:
+        # seconds left, None if unknown
+        speed = self.average_speed()
+        if self._total_bytes <= 0 or speed <= 0:
+            return None
+        return max(self._total_bytes - self._done_bytes, 0) / speed
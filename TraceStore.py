@@ -0,0 +1,205 @@
+import gzip
+import json
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+
+from EventDispatcher import EventDispatcher
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TraceStore(object):
+    COMPRESSION_NONE = 'none'
+    COMPRESSION_GZIP = 'gzip'
+    COMPRESSION_ZSTD = 'zstd'
+    COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD)
+    COMPRESSION_SUFFIXES = {COMPRESSION_NONE: '', COMPRESSION_GZIP: '.gz', COMPRESSION_ZSTD: '.zst'}
+
+    INDEX_FILE = 'index.jsonl'
+    TRACE_SUFFIXES = ('.log', '.log.gz', '.log.zst')
+    CHUNK_SIZE = 1024 * 1024
+    RETENTION_INTERVAL = 60  # seconds between retention scans
+
+    RESULT_SUCCESS = 'success'
+    RESULT_ERROR = 'error'
+
+    def __init__(self,
+                 trace_dir: str,
+                 compression: str = COMPRESSION_GZIP,
+                 max_age: float = 0,
+                 max_size: int = 0):
+        self._trace_dir = trace_dir
+        self._compression = compression
+        self._max_age = max_age  # seconds, 0 for no limit
+        self._max_size = max_size  # bytes, 0 for no limit
+        self._last_retention_time = 0.0
+
+        # compressing is done in background, never slows down downloading
+        self._dispatcher = EventDispatcher('t29008-trace')
+
+    def trace_dir(self) -> str:
+        return self._trace_dir
+
+    @staticmethod
+    def is_compression_supported(compression: str) -> bool:
+        return compression != TraceStore.COMPRESSION_ZSTD or zstandard is not None
+
+    def start(self):
+        self._dispatcher.start()
+        self._dispatcher.post(lambda: self.apply_retention(True))
+
+    def stop(self):
+        # pending traces are still stored
+        self._dispatcher.stop()
+
+    def add(self,
+            port: str,
+            usb_path: Union[str, None],
+            timestamp: str,
+            success: bool,
+            serial: Union[str, None],
+            message: Union[str, None],
+            trace_files: Sequence[str],
+            on_stored: Union[Callable[[List[str]], None], None] = None):
+        record = {
+            'port': port,
+            'usb_path': usb_path,
+            'timestamp': timestamp,
+            'result': TraceStore.RESULT_SUCCESS if success else TraceStore.RESULT_ERROR,
+            'serial': serial,
+            'message': message,
+            'files': list(trace_files),
+        }
+        self._dispatcher.post(lambda: self._store(record, on_stored))
+
+    def _store(self, record: Dict[str, Any], on_stored: Union[Callable[[List[str]], None], None] = None):
+        files: List[str] = []
+        for filename in record['files']:
+            if os.path.exists(os.path.join(self._trace_dir, filename)):
+                files.append(self._compress(filename))
+        record['files'] = files
+
+        with open(os.path.join(self._trace_dir, TraceStore.INDEX_FILE), 'a', encoding='utf8') as file:
+            file.write(json.dumps(record) + '\n')
+
+        # names really written, compressing may have failed
+        if on_stored is not None:
+            on_stored(files)
+
+        self.apply_retention()
+
+    def _compress(self, filename: str) -> str:
+        if self._compression == TraceStore.COMPRESSION_NONE:
+            return filename
+
+        source = os.path.join(self._trace_dir, filename)
+        compressed_filename = filename + TraceStore.COMPRESSION_SUFFIXES[self._compression]
+        target = os.path.join(self._trace_dir, compressed_filename)
+        tmp_target = f'{target}.tmp'
+        try:
+            with open(source, 'rb') as src_file, open(tmp_target, 'wb') as dst_file:
+                if self._compression == TraceStore.COMPRESSION_ZSTD:
+                    with zstandard.ZstdCompressor().stream_writer(dst_file, closefd=False) as stream:
+                        shutil.copyfileobj(src_file, stream, TraceStore.CHUNK_SIZE)
+                else:
+                    with gzip.GzipFile(fileobj=dst_file, mode='wb') as stream:
+                        shutil.copyfileobj(src_file, stream, TraceStore.CHUNK_SIZE)
+            shutil.copystat(source, tmp_target)
+            os.replace(tmp_target, target)
+            os.remove(source)
+        except OSError:
+            # keep the plain trace
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+            return filename
+        return compressed_filename
+
+    def apply_retention(self, force: bool = False):
+        if self._max_age <= 0 and self._max_size <= 0:
+            return
+        now = time.time()
+        if not force and now - self._last_retention_time < TraceStore.RETENTION_INTERVAL:
+            return
+        self._last_retention_time = now
+        if not os.path.isdir(self._trace_dir):
+            return
+
+        # oldest first, traces not in index are also counted
+        traces: List[Tuple[float, int, str]] = []
+        with os.scandir(self._trace_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(TraceStore.TRACE_SUFFIXES):
+                    stat = entry.stat()
+                    traces.append((stat.st_mtime, stat.st_size, entry.path))
+        traces.sort()
+
+        total = sum(trace[1] for trace in traces)
+        removed = False
+        for mtime, size, path in traces:
+            expired = 0 < self._max_age < now - mtime
+            oversize = 0 < self._max_size < total
+            if not expired and not oversize:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed = True
+            except OSError:
+                pass
+
+        if removed:
+            self._compact_index()
+
+    def _compact_index(self):
+        # drop records whose traces are all removed
+        records = [record for record in TraceStore.load_index(self._trace_dir)
+                   if any(os.path.exists(os.path.join(self._trace_dir, f)) for f in record.get('files', []))]
+
+        index_file = os.path.join(self._trace_dir, TraceStore.INDEX_FILE)
+        tmp_file = f'{index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+        os.replace(tmp_file, index_file)
+
+    @staticmethod
+    def load_index(trace_dir: str) -> List[Dict[str, Any]]:
+        records: List[Dict[str, Any]] = []
+        try:
+            with open(os.path.join(trace_dir, TraceStore.INDEX_FILE), 'r', encoding='utf8') as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass  # partially written line
+        except OSError:
+            pass
+        return records
+
+    @staticmethod
+    def query(trace_dir: str,
+              port: Union[str, None] = None,
+              serial: Union[str, None] = None,
+              result: Union[str, None] = None,
+              since: Union[str, None] = None,
+              usb_path: Union[str, None] = None) -> List[Dict[str, Any]]:
+        # since is a timestamp prefix, i.e. 20240101 or 20240101_1200
+        records: List[Dict[str, Any]] = []
+        for record in TraceStore.load_index(trace_dir):
+            if port is not None and record.get('port') != port:
+                continue
+            if usb_path is not None and record.get('usb_path') != usb_path:
+                continue
+            if serial is not None and (record.get('serial') or '').lower() != serial.lower():
+                continue
+            if result is not None and record.get('result') != result:
+                continue
+            if since is not None and record.get('timestamp', '') < since:
+                continue
+            records.append(record)
+        return records
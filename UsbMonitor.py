@@ -1,18 +1,70 @@
+import errno
 import os
 import platform
 import re
+import select
+import socket
 import subprocess
 import time
-from typing import Callable, Set, Union
+from typing import Callable, Dict, Set, Tuple, Union
 
 from Application import Application
 
 
+class UsbLocation(object):
+    def __init__(self, controller: str, hub: str, port: str, sysfs_path: str):
+        self._controller = controller  # i.e. usb1
+        self._hub = hub  # i.e. usb1 for root hub or 1-2 for external hub
+        self._port = port  # i.e. 1-2.3
+        self._sysfs_path = sysfs_path
+
+    def controller(self) -> str:
+        return self._controller
+
+    def hub(self) -> str:
+        return self._hub
+
+    def port(self) -> str:
+        return self._port
+
+    def sysfs_path(self) -> str:
+        return self._sysfs_path
+
+    def __str__(self):
+        return self._port
+
+
+class UsbDevice(object):
+    # one enumeration of a device, a re-plugged device is a new one even if it gets the same port name
+    def __init__(self, port: str, location: Union[UsbLocation, None] = None, devnum: Union[int, None] = None):
+        self._port = port  # i.e. ttyUSB0 or COM3, passed to tools
+        self._location = location
+        self._devnum = devnum  # assigned by kernel on each enumeration
+
+    def port(self) -> str:
+        return self._port
+
+    def location(self) -> Union[UsbLocation, None]:
+        return self._location
+
+    def devnum(self) -> Union[int, None]:
+        return self._devnum
+
+    def key(self) -> str:
+        # port name only if the monitor cannot tell enumerations apart
+        if self._location is None or self._devnum is None:
+            return self._port
+        return f'{self._port}@{self._location.port()}#{self._devnum}'
+
+    def __str__(self):
+        return self.key()
+
+
 class BaseUsbMonitor(object):
     def __init__(self):
         self._stopped = True
-        self._on_arrival: Union[Callable[[str], None], None] = None
-        self._on_removed: Union[Callable[[str], None], None] = None
+        self._on_arrival: Union[Callable[[UsbDevice], None], None] = None
+        self._on_removed: Union[Callable[[UsbDevice], None], None] = None
 
     def start(self):
         if not self._stopped:
@@ -26,19 +78,26 @@ class BaseUsbMonitor(object):
         self._stopped = True
         self.on_stop()
 
-    def set_arrival_listener(self, listener: Callable[[str], None]):
+    def set_arrival_listener(self, listener: Callable[[UsbDevice], None]):
         self._on_arrival = listener
 
-    def set_removed_listener(self, listener: Callable[[str], None]):
+    def set_removed_listener(self, listener: Callable[[UsbDevice], None]):
         self._on_removed = listener
 
-    def notify_arrival(self, port: str):
+    def notify_arrival(self, device: UsbDevice):
         if self._on_arrival:
-            self._on_arrival(port)
+            self._on_arrival(device)
 
-    def notify_removed(self, port: str):
+    def notify_removed(self, device: UsbDevice):
         if self._on_removed:
-            self._on_removed(port)
+            self._on_removed(device)
+
+    def resolve_location(self, port: str) -> Union[UsbLocation, None]:
+        return None
+
+    def resolve_device(self, port: str) -> Union[UsbDevice, None]:
+        # device currently enumerated as port, None if already gone
+        return UsbDevice(port, self.resolve_location(port))
 
     def on_start(self):
         pass
@@ -50,25 +109,33 @@ class BaseUsbMonitor(object):
 class PollingUsbMonitor(BaseUsbMonitor):
     def __init__(self):
         super().__init__()
-        self._ports: Set[str] = set()
+        self._devices: Dict[str, UsbDevice] = dict()  # by device key
 
     def on_start(self):
         while not self._stopped:
-            new_ports: Set[str] = self.on_polling()
+            self.update_ports(self.on_polling())
 
-            # notify removed
-            for port in (self._ports - new_ports):
-                self.notify_removed(port)
+            # check for every 1 second
+            time.sleep(1)
 
-            # notify arrival
-            for port in (new_ports - self._ports):
-                self.notify_arrival(port)
+    def update_ports(self, new_ports: Set[str]):
+        # a port swapped to another device between two polls is removed and arrived in the same round
+        new_devices: Dict[str, UsbDevice] = dict()
+        for port in new_ports:
+            device = self.resolve_device(port)
+            if device is not None:
+                new_devices[device.key()] = device
 
-            # update ports
-            self._ports = new_ports
+        # notify removed
+        for key in (self._devices.keys() - new_devices.keys()):
+            self.notify_removed(self._devices[key])
 
-            # check for every 1 second
-            time.sleep(1)
+        # notify arrival
+        for key in (new_devices.keys() - self._devices.keys()):
+            self.notify_arrival(new_devices[key])
+
+        # update devices
+        self._devices = new_devices
 
     def on_polling(self) -> Set[str]:
         pass
@@ -115,15 +182,199 @@ class LinuxUsbMonitor(PollingUsbMonitor):
 
             matched = LinuxUsbMonitor.PATTERN_DETACH_LINE.match(line)
             if matched:
-                ports.remove(matched['port'])
+                ports.discard(matched['port'])
 
         proc.wait()
 
         return ports
 
 
+class SysfsUsbMonitor(PollingUsbMonitor):
+    SYSFS_TTY_DIR = '/sys/class/tty'
+    PATTERN_TTY_USB = re.compile(r'ttyUSB\d+')
+
+    VENDOR_ID = '05c6'
+    PRODUCT_ID = '9008'
+
+    def __init__(self):
+        super().__init__()
+
+    def on_polling(self) -> Set[str]:
+        ports: Set[str] = set()
+
+        try:
+            names = os.listdir(SysfsUsbMonitor.SYSFS_TTY_DIR)
+        except OSError:
+            return ports
+
+        for name in names:
+            if SysfsUsbMonitor.PATTERN_TTY_USB.fullmatch(name) and SysfsUsbMonitor.is_edl_port(name):
+                ports.add(name)
+
+        return ports
+
+    def resolve_location(self, port: str) -> Union[UsbLocation, None]:
+        usb_dir = SysfsUsbMonitor.usb_device_dir(port)
+        if usb_dir is None:
+            return None
+
+        # .../usb1/1-2/1-2.3: device 1-2.3 on external hub 1-2 of controller usb1
+        hub_dir = os.path.dirname(usb_dir)
+        controller_dir = usb_dir
+        while controller_dir != os.path.dirname(controller_dir) and not os.path.basename(controller_dir).startswith('usb'):
+            controller_dir = os.path.dirname(controller_dir)
+
+        return UsbLocation(os.path.basename(controller_dir),
+                           os.path.basename(hub_dir),
+                           os.path.basename(usb_dir),
+                           usb_dir)
+
+    def resolve_device(self, port: str) -> Union[UsbDevice, None]:
+        location = self.resolve_location(port)
+        if location is None:
+            return None  # removed while resolving
+        return UsbDevice(port, location, SysfsUsbMonitor.read_devnum(location.sysfs_path()))
+
+    @staticmethod
+    def is_edl_port(port: str) -> bool:
+        return SysfsUsbMonitor.read_usb_id(port) == (SysfsUsbMonitor.VENDOR_ID, SysfsUsbMonitor.PRODUCT_ID)
+
+    @staticmethod
+    def read_usb_id(port: str) -> Union[Tuple[str, str], None]:
+        usb_dir = SysfsUsbMonitor.usb_device_dir(port)
+        if usb_dir is None:
+            return None
+
+        try:
+            with open(os.path.join(usb_dir, 'idVendor')) as file:
+                vendor_id = file.read().strip().lower()
+            with open(os.path.join(usb_dir, 'idProduct')) as file:
+                product_id = file.read().strip().lower()
+        except OSError:
+            return None
+
+        return vendor_id, product_id
+
+    @staticmethod
+    def read_devnum(usb_dir: str) -> Union[int, None]:
+        try:
+            with open(os.path.join(usb_dir, 'devnum')) as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def usb_device_dir(port: str) -> Union[str, None]:
+        # /sys/class/tty/ttyUSBn/device -> .../usb1/1-2/1-2:1.0/ttyUSBn
+        device_link = os.path.join(SysfsUsbMonitor.SYSFS_TTY_DIR, port, 'device')
+        if not os.path.exists(device_link):
+            return None
+
+        # walk up to the usb device which holds idVendor & idProduct
+        path = os.path.realpath(device_link)
+        while path and path != os.path.dirname(path):
+            if os.path.exists(os.path.join(path, 'idVendor')):
+                return path
+            path = os.path.dirname(path)
+        return None
+
+
+class UeventUsbMonitor(SysfsUsbMonitor):
+    NETLINK_KOBJECT_UEVENT = 15
+    NETLINK_GROUP_KERNEL = 1
+    RECEIVE_BUFFER_SIZE = 1024 * 1024
+    SELECT_TIMEOUT = 0.5
+
+    def __init__(self):
+        super().__init__()
+        self._socket: Union[socket.socket, None] = None
+
+    def on_start(self):
+        self._socket = UeventUsbMonitor._open_socket()
+        if self._socket is None:
+            # netlink not available (i.e. container without permission), fallback to polling sysfs
+            super().on_start()
+            return
+
+        try:
+            # devices already connected before start
+            self.update_ports(self.on_polling())
+
+            while not self._stopped:
+                readable, _, _ = select.select([self._socket], [], [], UeventUsbMonitor.SELECT_TIMEOUT)
+                if not readable:
+                    continue
+
+                try:
+                    data = self._socket.recv(UeventUsbMonitor.RECEIVE_BUFFER_SIZE)
+                except OSError as e:
+                    if e.errno == errno.ENOBUFS:
+                        # events lost, re-sync with sysfs
+                        self.update_ports(self.on_polling())
+                    continue
+
+                self.on_uevent(UeventUsbMonitor.parse_uevent(data))
+        finally:
+            self._socket.close()
+            self._socket = None
+
+    def on_uevent(self, event: Dict[str, str]):
+        if event.get('SUBSYSTEM') != 'tty':
+            return
+
+        port = event.get('DEVNAME', '')
+        if port.startswith('/dev/'):
+            port = port[len('/dev/'):]
+        if not SysfsUsbMonitor.PATTERN_TTY_USB.fullmatch(port):
+            return
+
+        action = event.get('ACTION')
+        if action == 'add':
+            if not SysfsUsbMonitor.is_edl_port(port):
+                return
+            device = self.resolve_device(port)
+            if device is not None and device.key() not in self._devices:
+                self._devices[device.key()] = device
+                self.notify_arrival(device)
+        elif action == 'remove':
+            # sysfs is already gone, find the device by its port name
+            for key, device in list(self._devices.items()):
+                if device.port() == port:
+                    del self._devices[key]
+                    self.notify_removed(device)
+
+    @staticmethod
+    def parse_uevent(data: bytes) -> Dict[str, str]:
+        # kernel uevent: "<action>@<devpath>\0KEY=VALUE\0KEY=VALUE\0..."
+        event: Dict[str, str] = dict()
+        for field in data.split(b'\0'):
+            key, sep, value = field.decode('utf8', errors='replace').partition('=')
+            if sep:
+                event[key] = value
+        return event
+
+    @staticmethod
+    def _open_socket() -> Union[socket.socket, None]:
+        if not hasattr(socket, 'AF_NETLINK'):
+            return None
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, UeventUsbMonitor.NETLINK_KOBJECT_UEVENT)
+        except OSError:
+            return None
+
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UeventUsbMonitor.RECEIVE_BUFFER_SIZE)
+            sock.bind((0, UeventUsbMonitor.NETLINK_GROUP_KERNEL))
+        except OSError:
+            sock.close()
+            return None
+
+        return sock
+
+
 os_name = platform.system()
 if os_name == 'Windows':
     UsbMonitor = WindowsUsbMonitor
 elif os_name == 'Linux':
-    UsbMonitor = LinuxUsbMonitor
+    UsbMonitor = UeventUsbMonitor
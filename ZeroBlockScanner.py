@@ -0,0 +1,225 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple, Union
+
+from ImageManifest import ImageManifest
+from SendXmlBuilder import XmlPass
+
+
+class ZeroBlockScanner(object):
+    BLOCK_SIZE = 64 * 1024  # multiple of all sector sizes
+    CHUNK_SIZE = 4 * 1024 * 1024  # multiple of BLOCK_SIZE
+    DIGESTS_FILE = 'digests.json'
+
+    ZERO_BLOCK = bytes(BLOCK_SIZE)
+    ZERO_CHUNK = bytes(CHUNK_SIZE)
+
+    def __init__(self, cache_dir: Union[str, None] = None):
+        self._cache_dir = os.path.join(cache_dir, 'zero_blocks') if cache_dir else None
+        self._digests: Dict[str, str] = self._load_json(ZeroBlockScanner.DIGESTS_FILE) or dict()
+        self._lock = threading.Lock()
+
+    def scan(self, paths: Sequence[str]) -> Dict[str, List[Tuple[int, int]]]:
+        # path -> zero runs as (offset, size) in bytes, aligned to BLOCK_SIZE
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            results = dict(zip(paths, executor.map(self.scan_file, paths)))
+        self._save_json(ZeroBlockScanner.DIGESTS_FILE, self._digests)
+        return results
+
+    def scan_file(self, path: str) -> List[Tuple[int, int]]:
+        # cached by image digest
+        stat = os.stat(path)
+        memo_key = f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}'
+        with self._lock:
+            digest = self._digests.get(memo_key)
+        if digest is not None:
+            cached = self._load_json(f'{digest}.json')
+            if cached is not None:
+                return [(run[0], run[1]) for run in cached]
+
+        digest, runs = ZeroBlockScanner._scan(path)
+        with self._lock:
+            self._digests[memo_key] = digest
+        self._save_json(f'{digest}.json', runs)
+        return runs
+
+    @staticmethod
+    def _scan(path: str) -> Tuple[str, List[Tuple[int, int]]]:
+        sha256 = hashlib.sha256()
+        runs: List[Tuple[int, int]] = []
+        run_start: Union[int, None] = None
+        offset = 0
+
+        with open(path, 'rb') as file:
+            while True:
+                chunk = file.read(ZeroBlockScanner.CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+
+                # whole chunk at once in the common case, block by block otherwise
+                if chunk == ZeroBlockScanner.ZERO_CHUNK:
+                    if run_start is None:
+                        run_start = offset
+                else:
+                    for block_offset in range(0, len(chunk), ZeroBlockScanner.BLOCK_SIZE):
+                        block = chunk[block_offset:block_offset + ZeroBlockScanner.BLOCK_SIZE]
+                        if block == ZeroBlockScanner.ZERO_BLOCK:
+                            if run_start is None:
+                                run_start = offset + block_offset
+                        elif run_start is not None:
+                            runs.append((run_start, offset + block_offset - run_start))
+                            run_start = None
+                offset += len(chunk)
+
+        # a partial block at the end is never counted as zero
+        if run_start is not None:
+            end = offset - offset % ZeroBlockScanner.BLOCK_SIZE
+            if end > run_start:
+                runs.append((run_start, end - run_start))
+
+        return sha256.hexdigest(), runs
+
+    def _load_json(self, name: str):
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self._cache_dir, name), 'r', encoding='utf8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _save_json(self, name: str, data):
+        if self._cache_dir is None:
+            return
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            path = os.path.join(self._cache_dir, name)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with self._lock:
+                with open(tmp_path, 'w', encoding='utf8') as file:
+                    json.dump(data, file)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # cache is optional
+
+
+class ZeroOutPass(XmlPass):
+    MIN_ZERO_SIZE = 1024 * 1024  # smaller zero runs are not worth an extra command
+
+    def __init__(self, manifest: ImageManifest, scanner: ZeroBlockScanner, min_zero_size: int = MIN_ZERO_SIZE):
+        self._manifest = manifest
+        self._scanner = scanner
+        self._min_zero_size = min_zero_size
+        self._zero_runs: Dict[str, List[Tuple[int, int]]] = dict()
+        self._saved_bytes = 0
+        self._zeroout_count = 0
+
+    def name(self) -> str:
+        return 'zeroout'
+
+    def saved_bytes(self) -> int:
+        return self._saved_bytes
+
+    def scan(self):
+        # scan all plain (non sparse) images once, in parallel
+        filenames = {program.filename() for program in self._manifest.programs()
+                     if program.transfer_bytes() > 0 and not program.sparse()}
+        paths = {os.path.join(self._manifest.image_dir(), filename): filename for filename in filenames}
+        for path, runs in self._scanner.scan(sorted(paths.keys())).items():
+            self._zero_runs[paths[path]] = [run for run in runs if run[1] >= self._min_zero_size]
+
+    def on_rawprogram(self, xml: str, root: ElementTree.Element) -> bool:
+        modified = False
+        for index, element in reversed(list(enumerate(root))):
+            if element.tag != 'program':
+                continue
+            replacement = self._split(element)
+            if replacement is not None:
+                root.remove(element)
+                for offset, new_element in enumerate(replacement):
+                    root.insert(index + offset, new_element)
+                modified = True
+        return modified
+
+    def summary(self) -> Union[str, None]:
+        return f'{self._zeroout_count} zero ranges, {self._saved_bytes / 1024 / 1024:.1f} MB skipped'
+
+    def _split(self, element: ElementTree.Element) -> Union[List[ElementTree.Element], None]:
+        filename = element.get('filename', '')
+        runs = self._zero_runs.get(filename)
+        if not runs or element.get('sparse', 'false').lower() == 'true':
+            return None
+
+        # only plain sector numbers can be split
+        start_sector = element.get('start_sector', '')
+        if not start_sector.isdigit():
+            return None
+
+        sector_size = ImageManifest.parse_int(element.get('SECTOR_SIZE_IN_BYTES'), 512)
+        file_offset = ImageManifest.parse_int(element.get('file_sector_offset'), 0)
+        num_sectors = ImageManifest.parse_int(element.get('num_partition_sectors'), 0)
+        # a trailing partial sector is still written, padded by fh_loader
+        file_sectors = (self._manifest.file_size(filename) + sector_size - 1) // sector_size - file_offset
+        if num_sectors > 0:
+            file_sectors = min(file_sectors, num_sectors)
+        if file_sectors <= 0:
+            return None
+
+        # zero runs in sectors of this entry
+        zero_ranges: List[Tuple[int, int]] = []
+        for run_offset, run_size in runs:
+            first = max(run_offset // sector_size, file_offset)
+            last = min((run_offset + run_size) // sector_size, file_offset + file_sectors)
+            if (last - first) * sector_size >= self._min_zero_size:
+                zero_ranges.append((first, last))
+        if not zero_ranges:
+            return None
+
+        # program / zeroout / program ... covering the same sectors as the original entry
+        elements: List[ElementTree.Element] = []
+        cursor = file_offset
+        for first, last in zero_ranges:
+            if first > cursor:
+                elements.append(ZeroOutPass._program(element, int(start_sector), file_offset, cursor, first - cursor, sector_size))
+            elements.append(ZeroOutPass._zeroout(element, int(start_sector) + first - file_offset, last - first, sector_size))
+            self._saved_bytes += (last - first) * sector_size
+            self._zeroout_count += 1
+            cursor = last
+        end = file_offset + file_sectors
+        if end > cursor:
+            elements.append(ZeroOutPass._program(element, int(start_sector), file_offset, cursor, end - cursor, sector_size))
+        return elements
+
+    @staticmethod
+    def _program(origin: ElementTree.Element,
+                 start_sector: int,
+                 file_offset: int,
+                 chunk_offset: int,
+                 chunk_sectors: int,
+                 sector_size: int) -> ElementTree.Element:
+        element = copy.deepcopy(origin)
+        sector = start_sector + chunk_offset - file_offset
+        element.set('file_sector_offset', str(chunk_offset))
+        element.set('start_sector', str(sector))
+        element.set('num_partition_sectors', str(chunk_sectors))
+        element.set('size_in_KB', f'{chunk_sectors * sector_size / 1024:.1f}')
+        element.set('start_byte_hex', hex(sector * sector_size))
+        element.set('partofsingleimage', 'true')
+        return element
+
+    @staticmethod
+    def _zeroout(origin: ElementTree.Element, sector: int, num_sectors: int, sector_size: int) -> ElementTree.Element:
+        element = ElementTree.Element('zeroout')
+        element.tail = origin.tail
+        element.set('SECTOR_SIZE_IN_BYTES', str(sector_size))
+        element.set('label', origin.get('label', ''))
+        element.set('num_partition_sectors', str(num_sectors))
+        element.set('physical_partition_number', origin.get('physical_partition_number', '0'))
+        element.set('start_sector', str(sector))
+        return element
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# device side of sahara on pseudo terminals, for builtin sahara without real devices (Linux / macOS only).
+# started by bench.py as "SaharaEmulator.py <link dir> <device count> <programmer size>", one link
+# <link dir>/benchNNNN per device, "ready" printed once all are linked, exits when stdin is closed.
+# configured by the same environment variables as the stub QSaharaServer:
+#   T29008_BENCH_SAHARA_SECONDS     programmer upload time, default 0.5
+#   T29008_BENCH_SAHARA_FAIL_RATIO  0.0 - 1.0 of uploads rejected half way, default 0
+#   T29008_BENCH_SPAWN_LOG          file to append "<port> <time>" when the host answers hello
+import os
+import pty
+import random
+import select
+import struct
+import sys
+import time
+import tty
+from typing import Dict, List, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from SaharaClient import SaharaClient
+
+
+class EmulatedDevice(object):
+    STATE_HELLO = 'hello'  # waiting for HELLO_RESP
+    STATE_COMMAND = 'command'  # waiting for EXEC or SWITCH_MODE
+    STATE_UPLOAD = 'upload'  # before next READ_DATA
+    STATE_READ = 'read'  # waiting for image data
+    STATE_DONE = 'done'  # waiting for DONE
+    STATE_FINISHED = 'finished'
+
+    STEPS = 20  # READ_DATA requests of one upload
+    SERIAL = 0x1234abcd
+    HW_ID = 0x000A50E100000000
+
+    def __init__(self, port: str, image_size: int, duration: float, fail_ratio: float, spawn_log: Union[str, None]):
+        self._port = port
+        self._image_size = image_size
+        self._duration = duration
+        self._fail_ratio = fail_ratio
+        self._spawn_log = spawn_log
+
+        # the slave is kept opened, host may open and close it many times
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+
+        self._state = EmulatedDevice.STATE_HELLO
+        self._buffer = bytearray()
+        self._expected_data = 0
+        self._step = 0
+        self._next_time: Union[float, None] = None  # of next READ_DATA
+        self._answered = False
+
+    def master(self) -> int:
+        return self._master
+
+    def slave_path(self) -> str:
+        return os.ttyname(self._slave)
+
+    def next_time(self) -> Union[float, None]:
+        return self._next_time
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+    def start(self):
+        self._send_hello(SaharaClient.MODE_IMAGE_TX_PENDING)
+
+    def on_readable(self):
+        try:
+            data = os.read(self._master, 65536)
+        except (BlockingIOError, OSError):
+            return
+        self._buffer += data
+        while self._handle_buffer():
+            pass
+
+    def on_timer(self):
+        self._next_time = None
+        chunk = (self._image_size + EmulatedDevice.STEPS - 1) // EmulatedDevice.STEPS
+        offset = self._step * chunk
+        if offset >= self._image_size:
+            self._send(SaharaClient.CMD_END_IMAGE_TX, SaharaClient.IMAGE_ID_PROGRAMMER, SaharaClient.STATUS_SUCCESS)
+            self._state = EmulatedDevice.STATE_DONE
+            return
+        if self._step == EmulatedDevice.STEPS // 2 and random.random() < self._fail_ratio:
+            self._send(SaharaClient.CMD_END_IMAGE_TX, SaharaClient.IMAGE_ID_PROGRAMMER, 0x0D)  # hash check failed
+            self._state = EmulatedDevice.STATE_FINISHED
+            return
+        self._expected_data = min(chunk, self._image_size - offset)
+        self._send(SaharaClient.CMD_READ_DATA, SaharaClient.IMAGE_ID_PROGRAMMER, offset, self._expected_data)
+        self._state = EmulatedDevice.STATE_READ
+        self._step += 1
+
+    def _handle_buffer(self) -> bool:
+        # true if something consumed
+        if self._state == EmulatedDevice.STATE_READ:
+            if len(self._buffer) < self._expected_data:
+                return False
+            del self._buffer[:self._expected_data]
+            self._schedule_read()
+            return True
+
+        if len(self._buffer) < SaharaClient.HEADER.size:
+            return False
+        command, length = SaharaClient.HEADER.unpack_from(self._buffer)
+        if length < SaharaClient.HEADER.size:
+            self._buffer.clear()  # garbage, wait for the host to start over
+            return False
+        if len(self._buffer) < length:
+            return False
+        body = bytes(self._buffer[SaharaClient.HEADER.size:length])
+        del self._buffer[:length]
+
+        if command == SaharaClient.CMD_HELLO_RESP and self._state == EmulatedDevice.STATE_HELLO:
+            self._log_answered()
+            _, _, _, mode = struct.unpack_from('<IIII', body)
+            if mode == SaharaClient.MODE_COMMAND:
+                self._send(SaharaClient.CMD_READY)
+                self._state = EmulatedDevice.STATE_COMMAND
+            else:
+                self._step = 0
+                self._schedule_read()
+        elif command == SaharaClient.CMD_EXEC and self._state == EmulatedDevice.STATE_COMMAND:
+            client_command, = struct.unpack_from('<I', body)
+            self._send(SaharaClient.CMD_EXEC_RESP, client_command, len(self._exec_data(client_command)))
+        elif command == SaharaClient.CMD_EXEC_DATA and self._state == EmulatedDevice.STATE_COMMAND:
+            client_command, = struct.unpack_from('<I', body)
+            self._write(self._exec_data(client_command))
+        elif command == SaharaClient.CMD_SWITCH_MODE and self._state == EmulatedDevice.STATE_COMMAND:
+            mode, = struct.unpack_from('<I', body)
+            self._send_hello(mode)
+        elif command == SaharaClient.CMD_DONE and self._state == EmulatedDevice.STATE_DONE:
+            self._send(SaharaClient.CMD_DONE_RESP, SaharaClient.MODE_IMAGE_TX_COMPLETE)
+            self._state = EmulatedDevice.STATE_FINISHED
+        # anything else is ignored, like a device waiting for reset
+        return True
+
+    def _schedule_read(self):
+        # the upload time is spread over the requests
+        self._state = EmulatedDevice.STATE_UPLOAD
+        self._next_time = time.monotonic() + self._duration / EmulatedDevice.STEPS
+
+    def _exec_data(self, client_command: int) -> bytes:
+        if client_command == SaharaClient.EXEC_SERIAL_NUM_READ:
+            return EmulatedDevice.SERIAL.to_bytes(4, 'little')
+        if client_command == SaharaClient.EXEC_MSM_HW_ID_READ:
+            return EmulatedDevice.HW_ID.to_bytes(8, 'little')
+        return b''
+
+    def _log_answered(self):
+        if self._answered:
+            return
+        self._answered = True
+        if self._spawn_log:
+            with open(self._spawn_log, 'a') as file:
+                file.write(f'{self._port} {time.time()}\n')
+
+    def _send_hello(self, mode: int):
+        self._send(SaharaClient.CMD_HELLO, SaharaClient.VERSION, SaharaClient.VERSION_COMPATIBLE, 0x400, mode,
+                   0, 0, 0, 0, 0, 0)
+        self._state = EmulatedDevice.STATE_HELLO
+
+    def _send(self, command: int, *fields: int):
+        self._write(struct.pack(f'<II{len(fields)}I', command, SaharaClient.HEADER.size + 4 * len(fields), *fields))
+
+    def _write(self, data: bytes):
+        # packets are small, blocking briefly is fine
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                view = view[os.write(self._master, view):]
+            except BlockingIOError:
+                select.select([], [self._master], [], 1)
+
+
+def serve(devices: Dict[int, EmulatedDevice], stop_fd: int):
+    # devices by master fd, returns once stop_fd is closed by the other end
+    # devices say hello as soon as plugged in, the host reads it once the port is opened
+    for device in devices.values():
+        device.start()
+
+    while True:
+        now = time.monotonic()
+        timers: List[float] = [t for t in (device.next_time() for device in devices.values()) if t is not None]
+        timeout = max(min(timers) - now, 0) if timers else None
+        readable, _, _ = select.select([stop_fd] + list(devices.keys()), [], [], timeout)
+        for fd in readable:
+            if fd == stop_fd:
+                if not os.read(stop_fd, 4096):
+                    return  # closed
+                continue
+            devices[fd].on_readable()
+
+        now = time.monotonic()
+        for device in devices.values():
+            next_time = device.next_time()
+            if next_time is not None and next_time <= now:
+                device.on_timer()
+
+
+def main() -> int:
+    if len(sys.argv) != 4:
+        print('usage: SaharaEmulator.py <link dir> <device count> <programmer size>')
+        return -1
+    link_dir = sys.argv[1]
+    device_count = int(sys.argv[2])
+    image_size = int(sys.argv[3])
+    duration = float(os.environ.get('T29008_BENCH_SAHARA_SECONDS', '0.5'))
+    fail_ratio = float(os.environ.get('T29008_BENCH_SAHARA_FAIL_RATIO', '0'))
+    spawn_log = os.environ.get('T29008_BENCH_SPAWN_LOG')
+
+    os.makedirs(link_dir, exist_ok=True)
+    devices: Dict[int, EmulatedDevice] = dict()
+    for index in range(device_count):
+        port = f'bench{index:04d}'
+        device = EmulatedDevice(port, image_size, duration, fail_ratio, spawn_log)
+        os.symlink(device.slave_path(), os.path.join(link_dir, port))
+        devices[device.master()] = device
+    print('ready', flush=True)
+
+    try:
+        serve(devices, sys.stdin.fileno())
+    finally:
+        for device in devices.values():
+            device.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
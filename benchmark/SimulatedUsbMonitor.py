@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+from UsbMonitor import BaseUsbMonitor, UsbDevice, UsbLocation
+
+
+class SimulatedUsbMonitor(BaseUsbMonitor):
+    def __init__(self, device_count: int, interval: float = 0.0, hold_time: float = 0.0, ports_per_hub: int = 8,
+                 port_dir: Union[str, None] = None):
+        super().__init__()
+        self._device_count = device_count
+        self._interval = interval  # seconds between two arrivals
+        self._hold_time = hold_time  # seconds before removed, 0 for never removed
+        self._ports_per_hub = ports_per_hub
+        self._port_dir = port_dir  # ports are paths of emulated ttys under it if set
+        self._stop_event = threading.Event()
+        self._arrival_times: Dict[str, float] = dict()  # port name -> wall clock time
+
+    @staticmethod
+    def port_name(index: int) -> str:
+        return f'bench{index:04d}'
+
+    def arrival_times(self) -> Dict[str, float]:
+        return self._arrival_times
+
+    @staticmethod
+    def port_index(port: str) -> int:
+        return int(os.path.basename(port)[len('bench'):])
+
+    def resolve_location(self, port: str) -> UsbLocation:
+        index = SimulatedUsbMonitor.port_index(port)
+        hub = f'1-{index // self._ports_per_hub + 1}'
+        return UsbLocation('usb1', hub, f'{hub}.{index % self._ports_per_hub + 1}', f'/sys/bus/usb/devices/{hub}')
+
+    def resolve_device(self, port: str) -> UsbDevice:
+        # every simulated device is enumerated once
+        return UsbDevice(port, self.resolve_location(port), SimulatedUsbMonitor.port_index(port) + 1)
+
+    def on_start(self):
+        self._stop_event.clear()
+        removals: List[Tuple[float, UsbDevice]] = []
+        next_time = time.monotonic()
+
+        # plug in devices one by one, remove them after hold time
+        for index in range(self._device_count):
+            if self._stop_event.wait(max(next_time - time.monotonic(), 0)):
+                return
+            port_name = SimulatedUsbMonitor.port_name(index)
+            port = os.path.join(self._port_dir, port_name) if self._port_dir else port_name
+            device = self.resolve_device(port)
+            self._arrival_times[port_name] = time.time()
+            self.notify_arrival(device)
+            if self._hold_time > 0:
+                removals.append((time.monotonic() + self._hold_time, device))
+            next_time += self._interval
+
+        for remove_time, device in removals:
+            if self._stop_event.wait(max(remove_time - time.monotonic(), 0)):
+                return
+            self.notify_removed(device)
+
+        # blocked until stopped, like real monitors
+        self._stop_event.wait()
+
+    def on_stop(self):
+        self._stop_event.set()
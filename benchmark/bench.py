@@ -0,0 +1,356 @@
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Sequence, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Application import Application
+from SimulatedUsbMonitor import SimulatedUsbMonitor
+from T2Edl import T2Edl, Watcher
+from T2EdlTask import T2EdlTask
+from TraceStore import TraceStore
+
+
+class BenchWatcher(Watcher):
+    def __init__(self, device_count: int, on_all_finished, inner: Union[Watcher, None] = None):
+        self._device_count = device_count
+        self._on_all_finished = on_all_finished
+        self._inner = inner
+        self._event_count = 0
+        self._success_count = 0
+        self._error_count = 0
+
+    def event_count(self) -> int:
+        return self._event_count
+
+    def success_count(self) -> int:
+        return self._success_count
+
+    def error_count(self) -> int:
+        return self._error_count
+
+    def _forward(self, name: str, *args):
+        self._event_count += 1
+        if self._inner is not None:
+            getattr(self._inner, name)(*args)
+
+    def on_started(self):
+        self._forward('on_started')
+
+    def on_stopped(self):
+        self._forward('on_stopped')
+
+    def on_update_message(self, message: str, color: str):
+        self._forward('on_update_message', message, color)
+
+    def on_queue_progress(self, key: str, hub: Union[str, None]):
+        self._forward('on_queue_progress', key, hub)
+
+    def on_start_progress(self, key: str, hub: Union[str, None]):
+        self._forward('on_start_progress', key, hub)
+
+    def on_stop_progress(self, key: str, success: bool, message: Union[str, None]):
+        self._forward('on_stop_progress', key, success, message)
+        if not os.path.basename(key).startswith('bench'):
+            return  # i.e. staging
+        if success:
+            self._success_count += 1
+        else:
+            self._error_count += 1
+        if self._success_count + self._error_count >= self._device_count:
+            self._on_all_finished()
+
+    def on_update_progress(self, key: str, cur_progress: int, max_progress: Union[int, None]):
+        self._forward('on_update_progress', key, cur_progress, max_progress)
+
+    def on_update_throughput(self, key: str, speed: float, average_speed: float, eta: Union[float, None]):
+        self._forward('on_update_throughput', key, speed, average_speed, eta)
+
+    def on_update_phase(self, key: str, phase: str):
+        self._forward('on_update_phase', key, phase)
+
+    def on_update_traces(self, key: str, trace_dir: str, trace_files: List[str]):
+        self._forward('on_update_traces', key, trace_dir, trace_files)
+
+
+class MemorySampler(object):
+    INTERVAL = 0.1
+
+    def __init__(self):
+        self._peak_rss = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def peak_rss(self) -> int:
+        return self._peak_rss
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _loop(self):
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        while not self._stop_event.wait(MemorySampler.INTERVAL):
+            with open('/proc/self/statm') as file:
+                self._peak_rss = max(self._peak_rss, int(file.read().split()[1]) * page_size)
+
+
+PROGRAMMER_SIZE = 512 * 1024  # about a real firehose programmer, uploaded by builtin sahara
+
+
+def make_image_dir(image_dir: str, image_size: int):
+    # sparse images, only sizes matter to stub tools
+    files = [('boot.img', 'boot', image_size // 16), ('system.img', 'system', image_size * 10 // 16),
+             ('userdata.img', 'userdata', image_size * 5 // 16)]
+    lines = ['<?xml version="1.0" ?>', '<data>']
+    sector = 40
+    for filename, label, size in files:
+        with open(os.path.join(image_dir, filename), 'wb') as file:
+            file.truncate(size)
+        sectors = (size + 4095) // 4096
+        lines.append(f'  <program SECTOR_SIZE_IN_BYTES="4096" file_sector_offset="0" filename="{filename}" '
+                     f'label="{label}" num_partition_sectors="{sectors}" physical_partition_number="0" '
+                     f'sparse="false" start_sector="{sector}" />')
+        sector += sectors
+    lines.append('</data>')
+    with open(os.path.join(image_dir, 'rawprogram0.xml'), 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    with open(os.path.join(image_dir, 'patch0.xml'), 'w') as file:
+        file.write('<?xml version="1.0" ?>\n<patches>\n</patches>\n')
+    with open(os.path.join(image_dir, 'prog_firehose_ddr.elf'), 'wb') as file:
+        file.write(bytes(PROGRAMMER_SIZE))
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+def run(device_count: int,
+        work_dir: str,
+        image_dir: str,
+        engine: str,
+        interval: float,
+        hold_time: float,
+        max_parallel: int,
+        ui: str,
+        sahara: str) -> Dict[str, float]:
+    trace_dir = os.path.join(work_dir, f'trace_{device_count}')
+    spawn_log = os.path.join(work_dir, f'spawn_{device_count}.log')
+    os.environ['T29008_BENCH_SPAWN_LOG'] = spawn_log
+
+    # builtin sahara talks to emulated devices on pseudo terminals, they log when answered instead of stub spawns
+    emulator: Union[subprocess.Popen, None] = None
+    port_dir: Union[str, None] = None
+    if sahara == T2EdlTask.SAHARA_BUILTIN:
+        port_dir = os.path.join(work_dir, f'dev_{device_count}')
+        emulator = subprocess.Popen([sys.executable,
+                                     os.path.join(os.path.dirname(os.path.realpath(__file__)), 'SaharaEmulator.py'),
+                                     port_dir, str(device_count), str(PROGRAMMER_SIZE)],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        if emulator.stdout.readline().strip() != 'ready':
+            emulator.wait()
+            raise OSError('sahara emulator failed to start')
+
+    monitor = SimulatedUsbMonitor(device_count, interval, hold_time, port_dir=port_dir)
+    instance = T2Edl(image_dir,
+                     trace_dir=trace_dir,
+                     is_vip=False,
+                     max_parallel=max_parallel,
+                     engine=engine,
+                     trace_compression=TraceStore.COMPRESSION_NONE,
+                     monitor=monitor,
+                     sahara=sahara)
+
+    inner: Union[Watcher, None] = None
+    if ui == 'rich':
+        from T2EdlUi import T2EdlUi
+        inner = T2EdlUi()
+    elif ui == 'json':
+        from JsonWatcher import JsonWatcher
+        inner = JsonWatcher()
+    watcher = BenchWatcher(device_count, instance.stop, inner)
+    instance.watch(watcher)
+
+    sampler = MemorySampler()
+    sampler.start()
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_time = time.monotonic()
+
+    instance.start()
+
+    wall_time = time.monotonic() - start_time
+    if emulator is not None:
+        emulator.stdin.close()  # counted in tools cpu once waited
+        emulator.wait()
+    usage_self_end = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sampler.stop()
+
+    # arrival to sahara process started
+    latencies: List[float] = []
+    arrival_times = monitor.arrival_times()
+    if os.path.exists(spawn_log):
+        with open(spawn_log) as file:
+            for line in file:
+                port, spawn_time = line.split()
+                if port in arrival_times:
+                    latencies.append(float(spawn_time) - arrival_times[port])
+
+    return {
+        'devices': device_count,
+        'wall': wall_time,
+        'success': watcher.success_count(),
+        'error': watcher.error_count(),
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'max': max(latencies, default=0.0) * 1000,
+        'events': watcher.event_count() / wall_time if wall_time > 0 else 0.0,
+        'cpu': (usage_self_end.ru_utime + usage_self_end.ru_stime) - (usage_self.ru_utime + usage_self.ru_stime),
+        'cpu_tools': ((usage_children_end.ru_utime + usage_children_end.ru_stime)
+                      - (usage_children.ru_utime + usage_children.ru_stime)),
+        'rss': sampler.peak_rss() / 1024 / 1024,
+    }
+
+
+def show_help():
+    print('\n'.join((
+        'parameters',
+        '    -devices <n,n,...>               device counts to run',
+        '                                     <not set>: 1,8,32,128,256',
+        '    -engine <thread|asyncio>         task engine of t29008',
+        '                                     <not set>: thread',
+        '    -interval <seconds>              time between two device arrivals',
+        '                                     <not set>: 0.01',
+        '    -hold <seconds>                  remove each device after plugged in for this time',
+        '                                     <not set>: never removed',
+        '    -max-parallel|-j <count>         max count of parallel downloading',
+        '                                     <not set>: no limit',
+        '    -image-size <MB>                 total size of stub images',
+        '                                     <not set>: 64',
+        '    -speed <MB/s>                    stub fh_loader speed',
+        '                                     <not set>: 100',
+        '    -sahara-time <seconds>           stub sahara handshake time',
+        '                                     <not set>: 0.5',
+        '    -lines <count>                   stub fh_loader log lines per second',
+        '                                     <not set>: 50',
+        '    -fail-ratio <0.0-1.0>            ratio of failed downloads, half in sahara and half in fh_loader',
+        '                                     <not set>: 0',
+        '    -ui <none|rich|json>             watcher attached besides the benchmark one',
+        '                                     <not set>: none',
+        '    -sahara <tool|builtin>           sahara of t29008, builtin talks to devices emulated on pseudo terminals',
+        '                                     <not set>: tool',
+        '',
+        'i.e.',
+        '    python3 benchmark/bench.py -devices 1,64,256 -engine asyncio',
+    )))
+
+
+def main() -> int:
+    device_counts = [1, 8, 32, 128, 256]
+    engine = T2Edl.ENGINE_THREAD
+    interval = 0.01
+    hold_time = 0.0
+    max_parallel = 0
+    image_size = 64
+    speed = '100'
+    sahara_time = '0.5'
+    lines_per_second = '50'
+    fail_ratio = 0.0
+    ui = 'none'
+    sahara = T2EdlTask.SAHARA_TOOL
+
+    # load parameter
+    args = sys.argv[1:]
+    try:
+        while len(args) > 0:
+            param = args[0]
+            if param in ('-help', '-h'):
+                show_help()
+                return 0
+            if len(args) < 2:
+                raise ValueError(f'value of {param} not provided')
+            if param == '-devices':
+                device_counts = [int(count) for count in args[1].split(',') if count]
+            elif param == '-engine':
+                if args[1] not in T2Edl.ENGINES:
+                    raise ValueError(f'engine should be one of: {"|".join(T2Edl.ENGINES)}')
+                engine = args[1]
+            elif param == '-interval':
+                interval = float(args[1])
+            elif param == '-hold':
+                hold_time = float(args[1])
+            elif param in ('-max-parallel', '-j'):
+                max_parallel = int(args[1])
+            elif param == '-image-size':
+                image_size = int(args[1])
+            elif param == '-speed':
+                speed = str(float(args[1]))
+            elif param == '-sahara-time':
+                sahara_time = str(float(args[1]))
+            elif param == '-lines':
+                lines_per_second = str(float(args[1]))
+            elif param == '-fail-ratio':
+                fail_ratio = float(args[1])
+            elif param == '-ui':
+                if args[1] not in ('none', 'rich', 'json'):
+                    raise ValueError('ui should be one of: none|rich|json')
+                ui = args[1]
+            elif param == '-sahara':
+                if args[1] not in T2EdlTask.SAHARAS:
+                    raise ValueError(f'sahara should be one of: {"|".join(T2EdlTask.SAHARAS)}')
+                sahara = args[1]
+            else:
+                raise ValueError(f'unknown parameter: "{param}"')
+            args = args[2:]
+    except ValueError as e:
+        print(e)
+        print('')
+        show_help()
+        return -1
+
+    # stub tools
+    tool_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'tools')
+    Application.get().set_tool_dir(tool_dir)
+    os.environ['T29008_BENCH_SPEED_MB'] = speed
+    os.environ['T29008_BENCH_SAHARA_SECONDS'] = sahara_time
+    os.environ['T29008_BENCH_LINES_PER_SECOND'] = lines_per_second
+    os.environ['T29008_BENCH_SAHARA_FAIL_RATIO'] = str(fail_ratio / 2)
+    os.environ['T29008_BENCH_FH_LOADER_FAIL_RATIO'] = str(fail_ratio / 2)
+
+    work_dir = tempfile.mkdtemp(prefix='t29008_bench_')
+    try:
+        image_dir = os.path.join(work_dir, 'images')
+        os.makedirs(image_dir)
+        make_image_dir(image_dir, image_size * 1024 * 1024)
+
+        results = [run(count, work_dir, image_dir, engine, interval, hold_time, max_parallel, ui, sahara) for count in device_counts]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # report
+    print('')
+    print(f'engine: {engine}, sahara: {sahara}, interval: {interval}s, image: {image_size} MB, speed: {speed} MB/s, '
+          f'ui: {ui}')
+    print(f'{"devices":>8} {"wall s":>8} {"ok":>5} {"err":>5} {"spawn p50 ms":>13} {"p95 ms":>8} {"max ms":>8} '
+          f'{"events/s":>9} {"cpu s":>7} {"tools cpu s":>12} {"rss MB":>8}')
+    for r in results:
+        print(f'{r["devices"]:>8} {r["wall"]:>8.2f} {r["success"]:>5} {r["error"]:>5} {r["p50"]:>13.1f} {r["p95"]:>8.1f} '
+              f'{r["max"]:>8.1f} {r["events"]:>9.1f} {r["cpu"]:>7.2f} {r["cpu_tools"]:>12.2f} {r["rss"]:>8.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,26 @@
 import os.path
 import signal
 import sys
-from typing import Union, Sequence
+import threading
+from typing import Any, Dict, List, Sequence, Tuple, Union
 
 from Application import Application
+from ControlServer import ControlServer
+from Coordinator import Coordinator
+from EventBus import EventBus
+from HistoryDb import HistoryDb
+from ImageCache import ImageCache
+from ImageStager import ImageStager
+from JsonWatcher import JsonWatcher
+from SaharaClient import SaharaClient
 from T2Edl import T2Edl
-from T2EdlUi import T2EdlUi
+from T2EdlTask import T2EdlTask
+from TraceStore import TraceStore
+
+
+OUTPUT_RICH = 'rich'
+OUTPUT_JSON = 'json'
+OUTPUTS = (OUTPUT_RICH, OUTPUT_JSON)
 
 
 def show_help():
@@ -15,7 +30,8 @@ def show_help():
         '                                     <not set>: no reboot',
         '    -trace-dir|-t <dir>              dir to save port_trace',
         '                                     <not set>: "port_trace" under current working directory',
-        '    -image-dir|-i <dir>              image dir',
+        '    -image-dir|-i <dir>              image dir, also accepts .tar/.tar.gz/.tgz/.tar.zst/.tzst archive',
+        '                                     or dir with .gz/.zst compressed images',
         '                                     <not set>: current working directory',
         '    -max-download-count|-n <count>   auto stop after n device is downloaded',
         '                                     <not set>: no limit',
@@ -31,7 +47,75 @@ def show_help():
         '    -disable-zeroout|-dz             disable <zeroout> tag support',
         '                                     <not set>: enabled for non VIP downloading',
         '    -disable-erase|-de               disable auto erasing modemst1 and modemst2',
-        '                                     <not set>: modemst1 & modemst2 are erased for non VIP downloading'
+        '                                     <not set>: modemst1 & modemst2 are erased for non VIP downloading',
+        '    -max-parallel|-j <count>         max count of parallel downloading, more devices wait in queue',
+        '                                     <not set>: no limit',
+        '    -max-parallel-per-hub|-jh <count> max count of parallel downloading on the same USB hub (Linux only)',
+        '                                     <not set>: no limit',
+        '    -stage|-st <none|cache|tmpfs>    stage images before downloading',
+        '                                     cache: pre-read all images into page cache',
+        '                                     tmpfs: copy all images into RAM backed dir (Linux only)',
+        '                                     <not set>: none',
+        '    -image-cache-size <GB>           max size of decompressed image cache, least recently used are removed',
+        f'                                     <not set>: {ImageCache.DEFAULT_MAX_SIZE // 1024 // 1024 // 1024}',
+        '    -partitions|-pt <a,b,...>        only download these partitions, wildcard supported (non VIP only)',
+        '                                     <not set>: all partitions',
+        '    -skip-partitions|-spt <a,b,...>  do not download these partitions, wildcard supported (non VIP only)',
+        '                                     <not set>: no partition skipped',
+        '    -zeroout-scan|-zs                scan images and send zero filled ranges as <zeroout> (non VIP only)',
+        '                                     <not set>: send images as is',
+        '    -optimize-xml|-ox                merge contiguous program/zeroout/erase ranges into fewer commands (non VIP only)',
+        '                                     <not set>: send xml as is',
+        '    -engine <thread|asyncio>         thread: one thread per device',
+        '                                     asyncio: all devices in one event loop, with sahara/fh_loader timeouts',
+        '                                     <not set>: thread',
+        '    -trace-compress <none|gzip|zstd> compress traces in background after each download, zstd requires zstandard',
+        '                                     <not set>: gzip',
+        '    -trace-max-age <days>            remove traces older than this',
+        '                                     <not set>: no limit',
+        '    -trace-max-size <GB>             remove oldest traces when trace dir is larger than this',
+        '                                     <not set>: no limit',
+        '    -ui-rate <Hz>                    max progress refresh rate of each device',
+        f'                                     <not set>: {EventBus.DEFAULT_RATE:g}',
+        '    -output <rich|json>              rich: progress table on console',
+        '                                     json: one JSON object per event, for line integration',
+        '                                     <not set>: rich',
+        '    -output-address <host:port>      send json events to this TCP address instead of stdout',
+        '                                     <not set>: stdout',
+        '    -metrics-port <port>             serve Prometheus metrics on http://<station>:<port>/metrics',
+        '                                     <not set>: disabled',
+        '    -history-db <file|none>          sqlite database recording every download, none to disable',
+        '                                     <not set>: history.db under user data dir',
+        '    -station <name>                  station name recorded in download history',
+        '                                     <not set>: host name',
+        '    -retry <count>                   retry transient usb errors and sahara timeouts with backoff,',
+        '                                     fh_loader resumes from the failed rawprogram/patch xml (non VIP only)',
+        '                                     <not set>: 0, no retry',
+        '    -retry-backoff <seconds>         wait before the first retry, doubled for each next one',
+        f'                                     <not set>: {T2EdlTask.RETRY_BACKOFF:g}',
+        '    -daemon                          keep running and accept "t29008 ctl" commands on a local unix socket',
+        '                                     <not set>: no control socket',
+        '    -control-socket <file>           unix socket of daemon mode',
+        '                                     <not set>: control.sock under user data dir',
+        '    -profiles <file>                 JSON file of image profiles and rules routing devices to them',
+        '                                     by usb port path, or sahara serial / hw id before programmer upload',
+        '                                     devices matching no rule use -image-dir',
+        '                                     <not set>: all devices use -image-dir',
+        '    -coordinator <url>               lease download slots of a lot quota from "t29008 coordinator"',
+        '                                     and report downloads to it, i.e. http://line-server:29008',
+        '                                     <not set>: no coordinator',
+        '    -coordinator-fallback <count>    devices started on local lease each time coordinator is unreachable',
+        '                                     <not set>: 0, no limit',
+        '    -sahara <tool|builtin>           tool: run QSaharaServer for each device',
+        '                                     builtin: talk sahara on the tty in process, programmer read once',
+        '                                     for all devices (Linux / macOS only)',
+        '                                     <not set>: tool',
+        '',
+        'sub commands',
+        '    traces                           query the trace index, "t29008 traces -h" for details',
+        '    stats                            flash time statistics from history, "t29008 stats -h" for details',
+        '    ctl                              control a running daemon, "t29008 ctl -h" for details',
+        '    coordinator                      lot quota and stats shared by stations, "t29008 coordinator -h" for details',
         '',
         'exit',
         '    ctrl + c',
@@ -67,7 +151,32 @@ def launch(
         signed_digests: Union[str, None] = None,
         chained_digests: Union[str, None] = None,
         disable_zeroout: bool = False,
-        disable_erase: bool = False):
+        disable_erase: bool = False,
+        max_parallel: int = 0,
+        max_parallel_per_hub: int = 0,
+        stage_mode: str = ImageStager.MODE_NONE,
+        image_cache_size: int = ImageCache.DEFAULT_MAX_SIZE,
+        partitions: Union[Sequence[str], None] = None,
+        skip_partitions: Union[Sequence[str], None] = None,
+        zeroout_scan: bool = False,
+        optimize_xml: bool = False,
+        engine: str = T2Edl.ENGINE_THREAD,
+        trace_compression: str = TraceStore.COMPRESSION_GZIP,
+        trace_max_age: float = 0,
+        trace_max_size: int = 0,
+        ui_rate: float = EventBus.DEFAULT_RATE,
+        output: str = OUTPUT_RICH,
+        output_address: Union[Tuple[str, int], None] = None,
+        metrics_port: int = 0,
+        history_db: Union[str, None] = None,
+        station: Union[str, None] = None,
+        retries: int = 0,
+        retry_backoff: float = T2EdlTask.RETRY_BACKOFF,
+        control_socket: Union[str, None] = None,
+        routes: Union[str, None] = None,
+        coordinator: Union[str, None] = None,
+        coordinator_fallback: int = 0,
+        sahara: str = T2EdlTask.SAHARA_TOOL):
     os.makedirs(trace_dir, exist_ok=True)
 
     # create instance
@@ -80,8 +189,37 @@ def launch(
                      signed_digests=signed_digests,
                      chained_digests=chained_digests,
                      disable_zeroout=disable_zeroout,
-                     disable_erase=disable_erase)
-    instance.watch(T2EdlUi())
+                     disable_erase=disable_erase,
+                     max_parallel=max_parallel,
+                     max_parallel_per_hub=max_parallel_per_hub,
+                     stage_mode=stage_mode,
+                     image_cache_size=image_cache_size,
+                     partitions=partitions,
+                     skip_partitions=skip_partitions,
+                     zeroout_scan=zeroout_scan,
+                     optimize_xml=optimize_xml,
+                     engine=engine,
+                     trace_compression=trace_compression,
+                     trace_max_age=trace_max_age,
+                     trace_max_size=trace_max_size,
+                     ui_rate=ui_rate,
+                     metrics_port=metrics_port,
+                     history_db=history_db,
+                     station=station,
+                     retries=retries,
+                     retry_backoff=retry_backoff,
+                     control_socket=control_socket,
+                     routes=routes,
+                     coordinator=coordinator,
+                     coordinator_fallback=coordinator_fallback,
+                     sahara=sahara)
+
+    # rich is only loaded when needed
+    if output == OUTPUT_JSON:
+        instance.watch(JsonWatcher(output_address))
+    else:
+        from T2EdlUi import T2EdlUi
+        instance.watch(T2EdlUi())
 
     # install ctrl_c handler
     def ctrl_c_handler(signum, frame):
@@ -94,7 +232,406 @@ def launch(
     instance.start()
 
 
+def show_traces_help():
+    print('\n'.join((
+        'parameters of traces',
+        '    -trace-dir|-t <dir>              dir of port_trace',
+        '                                     <not set>: "port_trace" under current working directory',
+        '    -port <port>                     only traces of this port',
+        '    -usb-path <path>                 only traces of this usb port path, i.e. 1-2.3',
+        '    -serial <serial>                 only traces of this device serial',
+        '    -result <success|error>          only traces of this result',
+        '    -since <timestamp>               only traces since this time, i.e. 20240101 or 20240101_1200',
+        '    -n <count>                       only the last n traces',
+        '',
+        'i.e.',
+        '    t29008 traces -result error -since 20240101',
+        '    t29008 traces -serial 0x1234abcd',
+    )))
+
+
+def main_traces(args: List[str]) -> int:
+    trace_dir = 'port_trace'
+    port: Union[str, None] = None
+    usb_path: Union[str, None] = None
+    serial: Union[str, None] = None
+    result: Union[str, None] = None
+    since: Union[str, None] = None
+    count: int = 0
+
+    # load parameter
+    while len(args) > 0:
+        param = args[0]
+        if param in ('-help', '-h'):
+            show_traces_help()
+            return 0
+        elif param in ('-trace-dir', '-t'):
+            if not verify_args_count(args, 2, 'trace dir not provided!!'):
+                return -1
+            trace_dir = args[1]
+            args = args[2:]
+        elif param == '-port':
+            if not verify_args_count(args, 2, 'port not provided!!'):
+                return -1
+            port = args[1]
+            args = args[2:]
+        elif param == '-usb-path':
+            if not verify_args_count(args, 2, 'usb path not provided!!'):
+                return -1
+            usb_path = args[1]
+            args = args[2:]
+        elif param == '-serial':
+            if not verify_args_count(args, 2, 'serial not provided!!'):
+                return -1
+            serial = args[1]
+            args = args[2:]
+        elif param == '-result':
+            if not verify_args_count(args, 2, 'result not provided!!'):
+                return -1
+            if args[1] not in (TraceStore.RESULT_SUCCESS, TraceStore.RESULT_ERROR):
+                show_error(f'result should be one of: {TraceStore.RESULT_SUCCESS}|{TraceStore.RESULT_ERROR}')
+                return -1
+            result = args[1]
+            args = args[2:]
+        elif param == '-since':
+            if not verify_args_count(args, 2, 'since not provided!!'):
+                return -1
+            since = args[1]
+            args = args[2:]
+        elif param == '-n':
+            if not verify_args_count(args, 2, 'count not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('count should be in digit!!')
+                return -1
+            count = int(args[1])
+            args = args[2:]
+        else:
+            print(f'unknown parameter: "{args[0]}"')
+            print('')
+            show_traces_help()
+            return -1
+
+    records = TraceStore.query(trace_dir, port, serial, result, since, usb_path)
+    if count > 0:
+        records = records[-count:]
+    for record in records:
+        print(f'{record.get("timestamp")}  {record.get("port")}  usb: {record.get("usb_path") or "-"}  '
+              f'{record.get("result")}  '
+              f'serial: {record.get("serial") or "-"}  {record.get("message") or ""}')
+        for filename in record.get('files', []):
+            print(f'    {os.path.join(trace_dir, filename)}')
+    return 0
+
+
+def default_history_db() -> str:
+    return os.path.join(Application.get().data_dir(), 'history.db')
+
+
+def show_stats_help():
+    print('\n'.join((
+        'parameters of stats',
+        '    -history-db <file>               sqlite database of download history',
+        '                                     <not set>: history.db under user data dir',
+        f'    -by <{"|".join(HistoryDb.GROUPS)}>         group by station, usb hub port or image build',
+        '                                     <not set>: all of them',
+        '    -since <days>                    only downloads of last n days',
+        '                                     <not set>: all',
+        '    -coordinator <url>               live stats of all stations from coordinator instead of history',
+        '                                     <not set>: history db',
+        '',
+        'i.e.',
+        '    t29008 stats',
+        '    t29008 stats -by port -since 7',
+        '    t29008 stats -coordinator http://localhost:29008',
+    )))
+
+
+def main_stats(args: List[str]) -> int:
+    history_db = default_history_db()
+    groups: Sequence[str] = HistoryDb.GROUPS
+    since: Union[float, None] = None
+    coordinator: Union[str, None] = None
+
+    # load parameter
+    while len(args) > 0:
+        param = args[0]
+        if param in ('-help', '-h'):
+            show_stats_help()
+            return 0
+        elif param == '-history-db':
+            if not verify_args_count(args, 2, 'history db not provided!!'):
+                return -1
+            history_db = args[1]
+            args = args[2:]
+        elif param == '-by':
+            if not verify_args_count(args, 2, 'group not provided!!'):
+                return -1
+            if args[1] not in HistoryDb.GROUPS:
+                show_error(f'group should be one of: {"|".join(HistoryDb.GROUPS)}')
+                return -1
+            groups = (args[1],)
+            args = args[2:]
+        elif param == '-since':
+            if not verify_args_count(args, 2, 'since not provided!!'):
+                return -1
+            try:
+                since = HistoryDb.since(float(args[1]))
+            except ValueError:
+                show_error('since should be a number of days!!')
+                return -1
+            args = args[2:]
+        elif param == '-coordinator':
+            if not verify_args_count(args, 2, 'coordinator url not provided!!'):
+                return -1
+            coordinator = args[1]
+            args = args[2:]
+        else:
+            print(f'unknown parameter: "{args[0]}"')
+            print('')
+            show_stats_help()
+            return -1
+
+    if coordinator is not None:
+        try:
+            stats = Coordinator.request(coordinator, '/stats')
+        except OSError as e:
+            print(f'failed to connect coordinator on {coordinator}: {e}')
+            return -1
+        show_coordinator_stats(stats)
+        return 0
+
+    if not os.path.isfile(history_db):
+        print(f'history db not found: {history_db}')
+        return -1
+
+    for group in groups:
+        rows = HistoryDb.stats(history_db, group, since)
+        width = max([len(group)] + [len(row['key']) for row in rows])
+        print(f'{group:<{width}} {"count":>7} {"yield":>7} {"p50 s":>8} {"p95 s":>8} {"MB/s":>8}')
+        for row in rows:
+            p50 = f'{row["p50"]:.1f}' if row['p50'] is not None else '-'
+            p95 = f'{row["p95"]:.1f}' if row['p95'] is not None else '-'
+            print(f'{row["key"]:<{width}} {row["count"]:>7} {row["yield"] * 100:>6.1f}% {p50:>8} {p95:>8} '
+                  f'{row["speed"] / 1024 / 1024:>8.2f}')
+        print('')
+    return 0
+
+
+def show_coordinator_stats(stats: Dict[str, Any]):
+    quota = f'{stats["started"]}/{stats["quota"]}' if stats['quota'] > 0 else f'{stats["started"]}/no limit'
+    print(f'quota: {quota}  leased: {stats["leased"]}  success: {stats["success"]}  error: {stats["error"]}  '
+          f'yield: {stats["yield"] * 100:.1f}%  {stats["devices_per_hour"]:.1f} devices/hour')
+    width = max([len('station')] + [len(item['station']) for item in stats['stations']])
+    print(f'{"station":<{width}} {"online":>6} {"started":>7} {"local":>7} {"leased":>7} {"yield":>7} '
+          f'{"dev/h":>8} {"MB/s":>8}')
+    for item in stats['stations']:
+        print(f'{item["station"]:<{width}} {"yes" if item["online"] else "no":>6} {item["started"]:>7} '
+              f'{item["local"]:>7} {item["leased"]:>7} {item["yield"] * 100:>6.1f}% '
+              f'{item["devices_per_hour"]:>8.1f} {item["speed"] / 1024 / 1024:>8.2f}')
+
+
+def show_coordinator_help():
+    print('\n'.join((
+        'parameters of coordinator',
+        '    -port <port>                     http port stations connect to',
+        f'                                     <not set>: {Coordinator.DEFAULT_PORT}',
+        '    -host <address>                  address to listen on, 127.0.0.1 for testing on one machine',
+        '                                     <not set>: all addresses',
+        '    -quota <count>                   devices of the lot shared by all stations',
+        '                                     <not set>: 0, no limit, only stats',
+        '    -lease-ttl <seconds>             unused slots of a silent station return to the lot after it',
+        f'                                     <not set>: {Coordinator.LEASE_TTL}',
+        '',
+        'i.e.',
+        '    t29008 coordinator -quota 5000',
+        '    t29008 -i image -coordinator http://line-server:29008',
+        '    t29008 stats -coordinator http://line-server:29008',
+    )))
+
+
+def main_coordinator(args: List[str]) -> int:
+    port: int = Coordinator.DEFAULT_PORT
+    host: str = ''
+    quota: int = 0
+    lease_ttl: float = Coordinator.LEASE_TTL
+
+    # load parameter
+    while len(args) > 0:
+        param = args[0]
+        if param in ('-help', '-h'):
+            show_coordinator_help()
+            return 0
+        elif param == '-port':
+            if not verify_args_count(args, 2, 'port not provided!!'):
+                return -1
+            if not args[1].isdigit() or not 0 < int(args[1]) < 65536:
+                show_error('port should be a digit in 1-65535!!')
+                return -1
+            port = int(args[1])
+            args = args[2:]
+        elif param == '-host':
+            if not verify_args_count(args, 2, 'host not provided!!'):
+                return -1
+            host = args[1]
+            args = args[2:]
+        elif param == '-quota':
+            if not verify_args_count(args, 2, 'quota not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('quota should be in digit!!')
+                return -1
+            quota = int(args[1])
+            args = args[2:]
+        elif param == '-lease-ttl':
+            if not verify_args_count(args, 2, 'lease ttl not provided!!'):
+                return -1
+            if not args[1].isdigit() or int(args[1]) <= 0:
+                show_error('lease ttl should be a positive digit!!')
+                return -1
+            lease_ttl = int(args[1])
+            args = args[2:]
+        else:
+            print(f'unknown parameter: "{args[0]}"')
+            print('')
+            show_coordinator_help()
+            return -1
+
+    coordinator = Coordinator(quota, lease_ttl)
+    try:
+        coordinator.start_server(port, host)
+    except OSError as e:
+        print(f'failed to start coordinator on port {port}: {e}')
+        return -1
+    print(f'coordinator listening on http://{host or "0.0.0.0"}:{port}, quota: {quota or "no limit"}, ctrl + c to stop')
+
+    # serve until ctrl + c
+    stopped = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    stopped.wait()
+    coordinator.stop_server()
+    show_coordinator_stats(coordinator.stats())
+    return 0
+
+
+def default_control_socket() -> str:
+    return os.path.join(Application.get().data_dir(), 'control.sock')
+
+
+def show_ctl_help():
+    print('\n'.join((
+        'parameters of ctl',
+        '    -control-socket <file>           unix socket of the daemon',
+        '                                     <not set>: control.sock under user data dir',
+        '',
+        'commands',
+        '    status                           image set, intake and downloads of the daemon',
+        '    pause                            queue arriving devices, running downloads continue',
+        '    resume                           start queued devices',
+        '    image <dir> [<profile>]          prepare another image set of a profile in background,',
+        '                                     used by devices arriving after it is ready',
+        '                                     <profile not set>: default, the one of -image-dir',
+        '    parallel <count> [<per hub>]     change max parallel downloads, 0 for no limit',
+        '    stop                             stop the daemon after all downloading finished',
+        '',
+        'i.e.',
+        '    t29008 -daemon -i image_v1',
+        '    t29008 ctl image image_v2',
+        '    t29008 ctl parallel 16 4',
+    )))
+
+
+def show_status(status: Dict[str, Any]):
+    print(f'state: {"stopping" if status["stopped"] else "paused" if status["paused"] else "running"}')
+    for profile in status['profiles']:
+        print(f'profile {profile["name"]}: {profile["image_dir"]}  build: {(profile["build"] or "-")[:12]}  '
+              f'VIP: {"ON" if profile["vip"] else "OFF"}')
+        if profile['pending_image_dir']:
+            print(f'    preparing: {profile["pending_image_dir"]}')
+    print(f'max parallel: {status["max_parallel"] or "no limit"}  per hub: {status["max_parallel_per_hub"] or "no limit"}')
+    print(f'running: {status["running"]}  queued: {status["queued"]}')
+    print(f'throughput: {status["summary"]}')
+    for device in status['devices']:
+        progress = f'{device["done_bytes"] * 100 // device["total_bytes"]}%' if device['total_bytes'] > 0 else '-'
+        print(f'    {device["port"]}  {device["state"]}  {device["phase"] or "-"}  {progress}  '
+              f'hub: {device["hub"] or "-"}  serial: {device["serial"] or "-"}  profile: {device["profile"] or "-"}')
+
+
+def main_ctl(args: List[str]) -> int:
+    control_socket = default_control_socket()
+    request: Union[Dict[str, Any], None] = None
+
+    # load parameter
+    while len(args) > 0:
+        param = args[0]
+        if param in ('-help', '-h'):
+            show_ctl_help()
+            return 0
+        elif param == '-control-socket':
+            if not verify_args_count(args, 2, 'control socket not provided!!'):
+                return -1
+            control_socket = args[1]
+            args = args[2:]
+        elif param in (ControlServer.COMMAND_STATUS, ControlServer.COMMAND_PAUSE, ControlServer.COMMAND_RESUME,
+                       ControlServer.COMMAND_STOP):
+            request = {'command': param}
+            args = args[1:]
+        elif param == ControlServer.COMMAND_IMAGE:
+            if not verify_args_count(args, 2, 'image dir not provided!!'):
+                return -1
+            request = {'command': param, 'image_dir': os.path.abspath(args[1])}
+            args = args[2:]
+            if len(args) > 0 and not args[0].startswith('-') and args[0] not in ControlServer.COMMANDS:
+                request['profile'] = args[0]
+                args = args[1:]
+        elif param == ControlServer.COMMAND_PARALLEL:
+            if not verify_args_count(args, 2, 'max parallel count not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('max parallel count should be in digit!!')
+                return -1
+            request = {'command': param, 'max_parallel': int(args[1])}
+            args = args[2:]
+            if len(args) > 0 and args[0].isdigit():
+                request['max_parallel_per_hub'] = int(args[0])
+                args = args[1:]
+        else:
+            print(f'unknown parameter: "{args[0]}"')
+            print('')
+            show_ctl_help()
+            return -1
+
+    if request is None:
+        show_ctl_help()
+        return -1
+    if not ControlServer.is_supported():
+        print('unix socket is not supported on this platform')
+        return -1
+
+    try:
+        response = ControlServer.request(control_socket, request)
+    except (OSError, ValueError) as e:
+        print(f'failed to connect daemon on {control_socket}: {e}')
+        return -1
+
+    if 'status' in response:
+        show_status(response['status'])
+    else:
+        print(response.get('message', ''))
+    return 0 if response.get('ok') else -1
+
+
 def main() -> int:
+    # sub commands
+    if len(sys.argv) > 1 and sys.argv[1] == 'traces':
+        return main_traces(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        return main_stats(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'ctl':
+        return main_ctl(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'coordinator':
+        return main_coordinator(sys.argv[2:])
+
     reboot_on_success = False
     trace_dir = 'port_trace'
     image_dir: str = Application.get().working_dir()
@@ -105,6 +642,32 @@ def main() -> int:
     chained_digests: Union[str, None] = None
     disable_zeroout: bool = False
     disable_erase: bool = False
+    max_parallel: int = 0
+    max_parallel_per_hub: int = 0
+    stage_mode: str = ImageStager.MODE_NONE
+    image_cache_size: int = ImageCache.DEFAULT_MAX_SIZE
+    partitions: Union[List[str], None] = None
+    skip_partitions: Union[List[str], None] = None
+    zeroout_scan: bool = False
+    optimize_xml: bool = False
+    engine: str = T2Edl.ENGINE_THREAD
+    trace_compression: str = TraceStore.COMPRESSION_GZIP
+    trace_max_age: float = 0
+    trace_max_size: int = 0
+    ui_rate: float = EventBus.DEFAULT_RATE
+    output: str = OUTPUT_RICH
+    output_address: Union[Tuple[str, int], None] = None
+    metrics_port: int = 0
+    history_db: Union[str, None] = default_history_db()
+    station: Union[str, None] = None
+    retries: int = 0
+    retry_backoff: float = T2EdlTask.RETRY_BACKOFF
+    daemon: bool = False
+    control_socket: str = default_control_socket()
+    routes: Union[str, None] = None
+    coordinator: Union[str, None] = None
+    coordinator_fallback: int = 0
+    sahara: str = T2EdlTask.SAHARA_TOOL
 
     # load parameter
     args = [arg for arg in sys.argv[1:]]
@@ -153,8 +716,197 @@ def main() -> int:
             args = args[2:]
         elif param in ('-disable-zeroout', '-dz'):
             disable_zeroout = True
+            args = args[1:]
         elif param in ('-disable-erase', '-de'):
             disable_erase = True
+            args = args[1:]
+        elif param in ('-max-parallel', '-j'):
+            if not verify_args_count(args, 2, 'max parallel count not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('max parallel count should be in digit!!')
+                return -1
+            max_parallel = int(args[1])
+            args = args[2:]
+        elif param in ('-max-parallel-per-hub', '-jh'):
+            if not verify_args_count(args, 2, 'max parallel count per hub not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('max parallel count per hub should be in digit!!')
+                return -1
+            max_parallel_per_hub = int(args[1])
+            args = args[2:]
+        elif param in ('-stage', '-st'):
+            if not verify_args_count(args, 2, 'stage mode not provided!!'):
+                return -1
+            if args[1] not in ImageStager.MODES:
+                show_error(f'stage mode should be one of: {"|".join(ImageStager.MODES)}')
+                return -1
+            stage_mode = args[1]
+            args = args[2:]
+        elif param == '-image-cache-size':
+            if not verify_args_count(args, 2, 'image cache size not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('image cache size should be in digit!!')
+                return -1
+            image_cache_size = int(args[1]) * 1024 * 1024 * 1024
+            args = args[2:]
+        elif param in ('-partitions', '-pt'):
+            if not verify_args_count(args, 2, 'partitions not provided!!'):
+                return -1
+            partitions = [p for p in args[1].split(',') if p]
+            args = args[2:]
+        elif param in ('-skip-partitions', '-spt'):
+            if not verify_args_count(args, 2, 'skip partitions not provided!!'):
+                return -1
+            skip_partitions = [p for p in args[1].split(',') if p]
+            args = args[2:]
+        elif param in ('-zeroout-scan', '-zs'):
+            zeroout_scan = True
+            args = args[1:]
+        elif param in ('-optimize-xml', '-ox'):
+            optimize_xml = True
+            args = args[1:]
+        elif param == '-engine':
+            if not verify_args_count(args, 2, 'engine not provided!!'):
+                return -1
+            if args[1] not in T2Edl.ENGINES:
+                show_error(f'engine should be one of: {"|".join(T2Edl.ENGINES)}')
+                return -1
+            engine = args[1]
+            args = args[2:]
+        elif param == '-trace-compress':
+            if not verify_args_count(args, 2, 'trace compression not provided!!'):
+                return -1
+            if args[1] not in TraceStore.COMPRESSIONS:
+                show_error(f'trace compression should be one of: {"|".join(TraceStore.COMPRESSIONS)}')
+                return -1
+            trace_compression = args[1]
+            args = args[2:]
+        elif param == '-trace-max-age':
+            if not verify_args_count(args, 2, 'trace max age not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('trace max age should be in digit!!')
+                return -1
+            trace_max_age = int(args[1]) * 24 * 60 * 60
+            args = args[2:]
+        elif param == '-trace-max-size':
+            if not verify_args_count(args, 2, 'trace max size not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('trace max size should be in digit!!')
+                return -1
+            trace_max_size = int(args[1]) * 1024 * 1024 * 1024
+            args = args[2:]
+        elif param == '-ui-rate':
+            if not verify_args_count(args, 2, 'ui rate not provided!!'):
+                return -1
+            if not args[1].isdigit() or int(args[1]) <= 0:
+                show_error('ui rate should be a positive digit!!')
+                return -1
+            ui_rate = int(args[1])
+            args = args[2:]
+        elif param == '-output':
+            if not verify_args_count(args, 2, 'output not provided!!'):
+                return -1
+            if args[1] not in OUTPUTS:
+                show_error(f'output should be one of: {"|".join(OUTPUTS)}')
+                return -1
+            output = args[1]
+            args = args[2:]
+        elif param == '-output-address':
+            if not verify_args_count(args, 2, 'output address not provided!!'):
+                return -1
+            output_address = JsonWatcher.parse_address(args[1])
+            if output_address is None:
+                show_error('output address should be in host:port!!')
+                return -1
+            args = args[2:]
+        elif param == '-metrics-port':
+            if not verify_args_count(args, 2, 'metrics port not provided!!'):
+                return -1
+            if not args[1].isdigit() or not 0 < int(args[1]) < 65536:
+                show_error('metrics port should be a digit in 1-65535!!')
+                return -1
+            metrics_port = int(args[1])
+            args = args[2:]
+        elif param == '-history-db':
+            if not verify_args_count(args, 2, 'history db not provided!!'):
+                return -1
+            history_db = None if args[1] == 'none' else args[1]
+            args = args[2:]
+        elif param == '-station':
+            if not verify_args_count(args, 2, 'station not provided!!'):
+                return -1
+            station = args[1]
+            args = args[2:]
+        elif param == '-retry':
+            if not verify_args_count(args, 2, 'retry count not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('retry count should be in digit!!')
+                return -1
+            retries = int(args[1])
+            args = args[2:]
+        elif param == '-retry-backoff':
+            if not verify_args_count(args, 2, 'retry backoff not provided!!'):
+                return -1
+            try:
+                retry_backoff = float(args[1])
+            except ValueError:
+                retry_backoff = -1
+            if not 0 <= retry_backoff <= T2EdlTask.RETRY_BACKOFF_MAX:
+                show_error(f'retry backoff should be a number of seconds from 0 to {T2EdlTask.RETRY_BACKOFF_MAX:g}!!')
+                return -1
+            args = args[2:]
+        elif param == '-daemon':
+            if not ControlServer.is_supported():
+                show_error('daemon mode requires unix socket support!!')
+                return -1
+            daemon = True
+            args = args[1:]
+        elif param == '-control-socket':
+            if not verify_args_count(args, 2, 'control socket not provided!!'):
+                return -1
+            control_socket = args[1]
+            args = args[2:]
+        elif param == '-profiles':
+            if not verify_args_count(args, 2, 'profiles file not provided!!'):
+                return -1
+            if not os.path.isfile(args[1]):
+                show_error(f'profiles file not exists: {args[1]}')
+                return -1
+            routes = args[1]
+            args = args[2:]
+        elif param == '-coordinator':
+            if not verify_args_count(args, 2, 'coordinator url not provided!!'):
+                return -1
+            if not args[1].startswith(('http://', 'https://')):
+                show_error('coordinator url should start with http://!!')
+                return -1
+            coordinator = args[1]
+            args = args[2:]
+        elif param == '-coordinator-fallback':
+            if not verify_args_count(args, 2, 'coordinator fallback count not provided!!'):
+                return -1
+            if not args[1].isdigit():
+                show_error('coordinator fallback count should be in digit!!')
+                return -1
+            coordinator_fallback = int(args[1])
+            args = args[2:]
+        elif param == '-sahara':
+            if not verify_args_count(args, 2, 'sahara not provided!!'):
+                return -1
+            if args[1] not in T2EdlTask.SAHARAS:
+                show_error(f'sahara should be one of: {"|".join(T2EdlTask.SAHARAS)}')
+                return -1
+            if args[1] == T2EdlTask.SAHARA_BUILTIN and not SaharaClient.is_supported():
+                show_error('builtin sahara requires termios support!!')
+                return -1
+            sahara = args[1]
+            args = args[2:]
         else:
             show_error(f'unknown parameter: "{args[0]}"')
             return -1
@@ -179,7 +931,32 @@ def main() -> int:
         signed_digests=signed_digests,
         chained_digests=chained_digests,
         disable_zeroout=disable_zeroout,
-        disable_erase=disable_erase)
+        disable_erase=disable_erase,
+        max_parallel=max_parallel,
+        max_parallel_per_hub=max_parallel_per_hub,
+        stage_mode=stage_mode,
+        image_cache_size=image_cache_size,
+        partitions=partitions,
+        skip_partitions=skip_partitions,
+        zeroout_scan=zeroout_scan,
+        optimize_xml=optimize_xml,
+        engine=engine,
+        trace_compression=trace_compression,
+        trace_max_age=trace_max_age,
+        trace_max_size=trace_max_size,
+        ui_rate=ui_rate,
+        output=output,
+        output_address=output_address,
+        metrics_port=metrics_port,
+        history_db=history_db,
+        station=station,
+        retries=retries,
+        retry_backoff=retry_backoff,
+        control_socket=control_socket if daemon else None,
+        routes=routes,
+        coordinator=coordinator,
+        coordinator_fallback=coordinator_fallback,
+        sahara=sahara)
 
     return 0
 
@@ -0,0 +1,65 @@
+import os
+import platform
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'benchmark'))
+
+from SaharaClient import SaharaClient, SaharaError
+
+if platform.system() != 'Windows':
+    from SaharaEmulator import EmulatedDevice, serve
+
+
+@unittest.skipUnless(platform.system() != 'Windows' and SaharaClient.is_supported(), 'pty is not supported')
+class SaharaClientTest(unittest.TestCase):
+    IMAGE_SIZE = 64 * 1024
+
+    def start_device(self, duration: float = 0.1, fail_ratio: float = 0.0) -> EmulatedDevice:
+        # device side runs in background until the test ends
+        device = EmulatedDevice('test', SaharaClientTest.IMAGE_SIZE, duration, fail_ratio, None)
+        stop_read, stop_write = os.pipe()
+        thread = threading.Thread(target=serve, args=({device.master(): device}, stop_read), daemon=True)
+        thread.start()
+
+        def stop():
+            os.close(stop_write)
+            thread.join()
+            os.close(stop_read)
+            device.close()
+
+        self.addCleanup(stop)
+        return device
+
+    def open_client(self, device: EmulatedDevice) -> SaharaClient:
+        self.logs = []
+        client = SaharaClient(device.slave_path(), self.logs.append)
+        client.open()
+        self.addCleanup(client.close)
+        return client
+
+    def test_identify_and_upload(self):
+        client = self.open_client(self.start_device())
+        serial, hw_id = client.identify()
+        self.assertEqual(serial, EmulatedDevice.SERIAL)
+        self.assertEqual(hw_id, EmulatedDevice.HW_ID)
+
+        # switched back to image transfer, the device says hello again
+        client.upload(SaharaClient.IMAGE_ID_PROGRAMMER, os.urandom(SaharaClientTest.IMAGE_SIZE))
+        self.assertIn('Sahara protocol completed', self.logs)
+
+    def test_upload_rejected(self):
+        client = self.open_client(self.start_device(fail_ratio=1.0))
+        with self.assertRaisesRegex(SaharaError, 'rejected'):
+            client.upload(SaharaClient.IMAGE_ID_PROGRAMMER, os.urandom(SaharaClientTest.IMAGE_SIZE))
+
+    def test_upload_wrong_image(self):
+        client = self.open_client(self.start_device())
+        with self.assertRaisesRegex(SaharaError, 'read beyond image'):
+            client.upload(SaharaClient.IMAGE_ID_PROGRAMMER, os.urandom(SaharaClientTest.IMAGE_SIZE // 2))
+
+
+if __name__ == '__main__':
+    unittest.main()